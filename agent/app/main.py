@@ -1,20 +1,39 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import math
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
+from app.responses import ModelJSONResponse
+from core.config import settings
 from core.event_bus import EventBus
+from core.loop_engine import LoopSession
 from core.planner_service import PlannerService
 from core.schemas import (
+    LoopResultMessage,
+    LoopStartMessage,
+    LoopStepMessage,
     PlanRequest,
     PlanSimulationRequest,
     ProviderValidationRequest,
+    ScreenshotUploadResponse,
     StreamEvent,
     TelemetryEvent,
+    VerifyBatchRequest,
     VerifyRequest,
 )
+from core.screenshots import (
+    PreparedScreenshot,
+    ScreenshotError,
+    decode_base64_screenshot,
+    prepare_screenshot,
+    source_digest,
+)
+from core.session_store import SessionStateError, SessionStore
+from core.speculative_planner import SpeculativePlanner
 from core.verifier_service import VerifierService
 from macos_use_adapter.adapter import ProviderConfigurationError
 
@@ -24,92 +43,291 @@ app = FastAPI(title="Orange Sidecar", version="0.1.0")
 _event_bus = EventBus()
 _planner = PlannerService(_event_bus)
 _verifier = VerifierService()
+_sessions = SessionStore(
+    ttl_seconds=settings.session_ttl_seconds,
+    max_sessions=settings.session_max_count,
+)
+_speculator = SpeculativePlanner(_planner, _event_bus, max_sessions=settings.session_max_count)
 _telemetry_events: list[TelemetryEvent] = []
 
 
+def _http_error(exc: ProviderConfigurationError | SessionStateError | ScreenshotError) -> HTTPException:
+    headers = None
+    if exc.retry_after is not None:
+        headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    return HTTPException(
+        status_code=exc.status_code,
+        detail={"message": str(exc), "error_code": exc.error_code},
+        headers=headers,
+    )
+
+
+def _with_plan_routing(event: TelemetryEvent) -> TelemetryEvent:
+    """Attach the model and intent class of the session's last plan, for router training."""
+    if event.model is not None:
+        return event
+    state = _sessions.get(event.session_id)
+    plan = state.last_plan if state is not None else None
+    if plan is None or plan.intent_class is None:
+        return event
+    update: dict[str, object] = {"model": plan.model, "intent_class": plan.intent_class}
+    if event.stage == "planning" and event.status == "completed" and event.latency_ms is None:
+        update["latency_ms"] = plan.provider_latency_ms
+    return event.model_copy(update=update)
+
+
+def _corrective_event(session_id: str) -> StreamEvent:
+    return StreamEvent(
+        session_id=session_id,
+        event="loop_retry_corrective",
+        message="Verifier suggested corrective actions",
+        progress=78,
+        severity="warning",
+    )
+
+
 @app.get("/health")
 async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+async def _store_screenshot(
+    session_id: str, raw: bytes, *, crop: tuple[int, int, int, int] | None = None
+) -> tuple[PreparedScreenshot, bool]:
+    """Prepare and store an upload; a byte-identical re-upload reuses the stored image without re-encoding."""
+    options = {"max_edge": settings.screenshot_max_edge, "quality": settings.screenshot_jpeg_quality, "crop": crop}
+    previous = _sessions.reusable_screenshot(session_id, source_digest(raw, **options))
+    if previous is not None:
+        return previous, True
+    prepared = await asyncio.to_thread(prepare_screenshot, raw, **options)
+    _sessions.record_screenshot(session_id, prepared)
+    return prepared, False
+
+
+async def _plan_screenshot(request: PlanRequest) -> tuple[PlanRequest, PreparedScreenshot | None]:
+    if request.screenshot_id is not None:
+        return request, _sessions.resolve_screenshot(request.session_id, request.screenshot_id)
+    if request.screenshot_base64 is None or not settings.planner_vision:
+        return request, None
+    # Older clients inline the screenshot; store it like an upload and drop the base64 copy.
+    screenshot, _ = await _store_screenshot(request.session_id, decode_base64_screenshot(request.screenshot_base64))
+    return request.model_copy(update={"screenshot_base64": None, "screenshot_id": screenshot.screenshot_id}), screenshot
+
+
 @app.post("/v1/plan")
-async def plan(request: PlanRequest) -> JSONResponse:
+async def plan(request: PlanRequest) -> ModelJSONResponse:
     try:
-        plan_result = await _planner.plan(request)
-    except ProviderConfigurationError as exc:
-        raise HTTPException(
-            status_code=exc.status_code,
-            detail={"message": str(exc), "error_code": exc.error_code},
-        ) from exc
-    return JSONResponse(plan_result.model_dump(mode="json"))
+        request = _sessions.resolve_plan_request(request)
+        request, screenshot = await _plan_screenshot(request)
+        plan_result = await _speculator.take(request) or await _planner.plan(request, screenshot=screenshot)
+    except (ProviderConfigurationError, SessionStateError, ScreenshotError) as exc:
+        raise _http_error(exc) from exc
+    _sessions.record_plan(plan_result, request.loop_context)
+    if settings.speculative_planning or (request.preferences is not None and request.preferences.speculative_next_step):
+        _speculator.prepare(plan_result, request)
+    return ModelJSONResponse(plan_result)
+
+
+@app.put("/v1/screenshots/{session_id}")
+async def upload_screenshot(
+    session_id: str,
+    request: Request,
+    crop_left: int | None = Query(default=None, ge=0),
+    crop_top: int | None = Query(default=None, ge=0),
+    crop_width: int | None = Query(default=None, gt=0),
+    crop_height: int | None = Query(default=None, gt=0),
+) -> ModelJSONResponse:
+    """Raw image bytes as the body (any format Pillow reads); reference the result via PlanRequest.screenshot_id."""
+    crop_values = (crop_left, crop_top, crop_width, crop_height)
+    try:
+        if any(value is not None for value in crop_values) and any(value is None for value in crop_values):
+            raise ScreenshotError(
+                "Send all of crop_left, crop_top, crop_width and crop_height, or none.",
+                status_code=422,
+                error_code="invalid_screenshot",
+            )
+        raw = await _read_body(request, limit=settings.screenshot_max_upload_bytes)
+        crop = crop_values if crop_left is not None else None
+        screenshot, duplicate = await _store_screenshot(session_id, raw, crop=crop)  # type: ignore[arg-type]
+    except ScreenshotError as exc:
+        raise _http_error(exc) from exc
+    return ModelJSONResponse(
+        ScreenshotUploadResponse(
+            session_id=session_id,
+            screenshot_id=screenshot.screenshot_id,
+            width=screenshot.width,
+            height=screenshot.height,
+            bytes=len(screenshot.data),
+            source_bytes=len(raw),
+            duplicate=duplicate,
+        )
+    )
+
+
+async def _read_body(request: Request, *, limit: int) -> bytes:
+    too_large = ScreenshotError(
+        f"Screenshot uploads are limited to {limit} bytes.", status_code=413, error_code="screenshot_too_large"
+    )
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise too_large
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise too_large
+        chunks.append(chunk)
+    if not size:
+        raise ScreenshotError("Screenshot upload body is empty.", status_code=422, error_code="invalid_screenshot")
+    return b"".join(chunks)
 
 
 @app.post("/v1/plan/simulate")
-async def plan_simulate(request: PlanSimulationRequest) -> JSONResponse:
+async def plan_simulate(request: PlanSimulationRequest) -> ModelJSONResponse:
     try:
         simulation = await _planner.simulate(request)
     except ProviderConfigurationError as exc:
-        raise HTTPException(
-            status_code=exc.status_code,
-            detail={"message": str(exc), "error_code": exc.error_code},
-        ) from exc
-    return JSONResponse(simulation.model_dump(mode="json"))
+        raise _http_error(exc) from exc
+    return ModelJSONResponse(simulation)
 
 
 @app.get("/v1/provider/status")
-async def provider_status() -> JSONResponse:
+async def provider_status() -> ModelJSONResponse:
     payload = _planner.provider_status()
-    return JSONResponse(payload.model_dump(mode="json"))
+    return ModelJSONResponse(payload)
 
 
 @app.post("/v1/provider/validate")
-async def provider_validate(request: ProviderValidationRequest) -> JSONResponse:
+async def provider_validate(request: ProviderValidationRequest) -> ModelJSONResponse:
     payload = await _planner.validate_provider(request)
-    return JSONResponse(payload.model_dump(mode="json"))
+    return ModelJSONResponse(payload)
 
 
 @app.get("/v1/models")
-async def models() -> JSONResponse:
+async def models() -> ModelJSONResponse:
     payload = _planner.models()
-    return JSONResponse(payload.model_dump(mode="json"))
+    return ModelJSONResponse(payload)
+
+
+@app.post("/v1/models/reload")
+async def models_reload() -> ModelJSONResponse:
+    try:
+        payload = _planner.reload_models()
+    except ProviderConfigurationError as exc:
+        raise _http_error(exc) from exc
+    return ModelJSONResponse(payload)
 
 
 @app.post("/v1/verify")
-async def verify(request: VerifyRequest) -> JSONResponse:
+async def verify(request: VerifyRequest) -> ModelJSONResponse:
+    try:
+        request = _sessions.resolve_verify_request(request)
+    except SessionStateError as exc:
+        raise _http_error(exc) from exc
     result = _verifier.verify(request)
+    _sessions.record_verify(request, result)
     if result.status == "failure" and result.corrective_actions:
-        await _event_bus.publish(
-            StreamEvent(
-                session_id=request.session_id,
-                event="loop_retry_corrective",
-                message="Verifier suggested corrective actions",
-                progress=78,
-                severity="warning",
-            )
+        await _event_bus.publish(_corrective_event(request.session_id))
+    return ModelJSONResponse(result)
+
+
+@app.post("/v1/verify/batch")
+async def verify_batch(batch: VerifyBatchRequest) -> ModelJSONResponse:
+    try:
+        batch = batch.model_copy(
+            update={"requests": [_sessions.resolve_verify_request(request) for request in batch.requests]}
         )
-    return JSONResponse(result.model_dump(mode="json"))
+    except SessionStateError as exc:
+        raise _http_error(exc) from exc
+    response = _verifier.verify_batch(batch)
+    corrective_events = [
+        _corrective_event(request.session_id)
+        for request, result in zip(batch.requests, response.results)
+        if result.status == "failure" and result.corrective_actions
+    ]
+    if corrective_events:
+        await _event_bus.publish_many(corrective_events)
+    return ModelJSONResponse(response)
+
+
+@app.websocket("/v1/loop/{session_id}")
+async def loop_session(websocket: WebSocket, session_id: str) -> None:
+    """
+    Long-lived loop session: the client sends one `start` message, then a
+    `result` message per executed plan, and receives `actions` until `done`.
+    """
+    await websocket.accept()
+    session: LoopSession | None = None
+    try:
+        while True:
+            # Parsed inside the try below, so malformed JSON is reported like any invalid message.
+            message = await websocket.receive_text()
+            try:
+                if session is None:
+                    start = LoopStartMessage.model_validate_json(message)
+                    session = LoopSession(
+                        session_id=session_id,
+                        start=start,
+                        planner=_planner,
+                        verifier=_verifier,
+                        sessions=_sessions,
+                        speculator=_speculator,
+                    )
+                    step = await session.start()
+                else:
+                    step = await session.submit(LoopResultMessage.model_validate_json(message))
+            except ValidationError as exc:
+                step = LoopStepMessage(
+                    type="error",
+                    session_id=session_id,
+                    reason=str(exc),
+                    error_code="invalid_loop_message",
+                )
+            except (ProviderConfigurationError, SessionStateError) as exc:
+                step = LoopStepMessage(
+                    type="error",
+                    session_id=session_id,
+                    cycle_index=session.loop_context.cycle_index if session is not None else 0,
+                    reason=str(exc),
+                    error_code=exc.error_code,
+                    retry_after=exc.retry_after,
+                )
+                if session is not None and session.phase == "idle":
+                    session = None
+            if step.verification is not None and step.verification.status == "failure" and step.verification.corrective_actions:
+                await _event_bus.publish(_corrective_event(session_id))
+            await websocket.send_text(step.model_dump_json())
+            if step.type == "done" or (session is not None and session.phase == "done"):
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if session is not None:
+            session.close()
 
 
 @app.post("/v1/telemetry")
-async def telemetry(event: TelemetryEvent) -> JSONResponse:
-    _telemetry_events.append(event)
+async def telemetry(event: TelemetryEvent) -> ModelJSONResponse:
+    _telemetry_events.append(_with_plan_routing(event))
     if len(_telemetry_events) > 5_000:
         del _telemetry_events[:1_000]
-    return JSONResponse({"status": "accepted", "count": len(_telemetry_events)})
+    return ModelJSONResponse({"status": "accepted", "count": len(_telemetry_events)})
 
 
 @app.get("/v1/telemetry")
-async def telemetry_recent(limit: int = 100) -> JSONResponse:
+async def telemetry_recent(limit: int = 100) -> ModelJSONResponse:
     safe_limit = max(1, min(limit, 1000))
     recent = _telemetry_events[-safe_limit:]
-    return JSONResponse({"events": [e.model_dump(mode="json") for e in recent]})
+    return ModelJSONResponse({"events": recent})
 
 
 @app.get("/v1/events/{session_id}")
 async def events(session_id: str) -> StreamingResponse:
     async def stream() -> str:
         async for event in _event_bus.subscribe(session_id):
-            payload = json.dumps(event.model_dump(mode="json"))
+            payload = event.model_dump_json()
             yield f"event: {event.event}\ndata: {payload}\n\n"
 
     return StreamingResponse(stream(), media_type="text/event-stream")
@@ -0,0 +1,161 @@
+"""
+Fast-start ASGI front for the packaged sidecar.
+
+Importing `app.main` pulls in FastAPI, Pydantic, httpx and the adapter, which
+takes most of a second. `LazySidecarApp` imports nothing beyond the standard
+library, so uvicorn can bind and answer `/health` straight away while the
+real app is imported in a background thread. Other requests wait for that
+warm-up and are then handed to the real app unchanged. Import times and
+startup milestones are served from `PROFILE_PATH`.
+
+Only the stdlib may be imported at module level here.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+import importlib
+import json
+import sys
+import time
+from typing import Any, Awaitable, Callable
+
+
+PROFILE_PATH = "/v1/startup/profile"
+# Imported in this order during warm-up so the profile attributes time to the
+# heavy dependencies rather than to whichever module happens to import them first.
+WARM_IMPORTS = ("pydantic", "httpx", "fastapi", "core.schemas", "macos_use_adapter.adapter")
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+def _timed_import(name: str) -> float:
+    started = time.perf_counter()
+    importlib.import_module(name)
+    return time.perf_counter() - started
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+@dataclass
+class StartupProfile:
+    """Startup milestones (ms since `origin`) and per-module warm-up import times."""
+
+    origin: float = field(default_factory=time.perf_counter)
+    marks: dict[str, float] = field(default_factory=dict)
+    imports: list[tuple[str, float]] = field(default_factory=list)
+    # Warm-up modules that were already imported when the server started.
+    eager_imports: list[str] = field(default_factory=list)
+    error: str | None = None
+
+    def mark(self, name: str) -> None:
+        self.marks.setdefault(name, _ms(time.perf_counter() - self.origin))
+
+    def as_dict(self, *, ready: bool) -> dict[str, Any]:
+        return {
+            "ready": ready,
+            "marks": dict(self.marks),
+            "imports": [{"module": name, "ms": _ms(seconds)} for name, seconds in self.imports],
+            "eager_imports": list(self.eager_imports),
+            "error": self.error,
+        }
+
+
+class LazySidecarApp:
+    """ASGI app that serves health and the startup profile until `target` is imported, then delegates."""
+
+    def __init__(
+        self,
+        target: str = "app.main:app",
+        *,
+        warm_imports: tuple[str, ...] = WARM_IMPORTS,
+        profile: StartupProfile | None = None,
+    ) -> None:
+        self._module_name, _, self._attribute = target.partition(":")
+        self._warm_imports = (*warm_imports, self._module_name)
+        self.profile = profile or StartupProfile()
+        self._app: ASGIApp | None = None
+        self._warmup: asyncio.Task[ASGIApp | None] | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._app is not None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        # Servers running without lifespan start warm-up on the first request.
+        warmup = self._start_warmup()
+        if scope["type"] == "http" and scope["path"] == "/health":
+            self.profile.mark("first_health")
+            if warmup.done() and self._app is None:
+                await self._send_json(send, 503, {"status": "error", "ready": False})
+            else:
+                await self._send_json(send, 200, {"status": "ok", "ready": self.ready})
+            return
+        if scope["type"] == "http" and scope["path"] == PROFILE_PATH:
+            await self._send_json(send, 200, self.profile.as_dict(ready=self.ready))
+            return
+
+        app = self._app or await asyncio.shield(warmup)
+        if app is not None:
+            await app(scope, receive, send)
+        elif scope["type"] == "http":
+            detail = {"message": f"Sidecar failed to start: {self.profile.error}", "error_code": "sidecar_warmup_failed"}
+            await self._send_json(send, 503, {"detail": detail})
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1011})
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        # `app.main` registers no lifespan handlers, so its lifespan is not forwarded.
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.profile.mark("lifespan_startup")
+                self._start_warmup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _start_warmup(self) -> asyncio.Task[ASGIApp | None]:
+        if self._warmup is None:
+            self.profile.eager_imports = [name for name in self._warm_imports if name in sys.modules]
+            self._warmup = asyncio.create_task(self._warm())
+        return self._warmup
+
+    async def _warm(self) -> ASGIApp | None:
+        self.profile.mark("warmup_started")
+        try:
+            for name in self._warm_imports:
+                self.profile.imports.append((name, await asyncio.to_thread(_timed_import, name)))
+            app = getattr(sys.modules[self._module_name], self._attribute)
+        except Exception as exc:
+            self.profile.error = f"{exc.__class__.__name__}: {exc}"
+            self.profile.mark("warmup_failed")
+            return None
+        self._app = app
+        self.profile.mark("ready")
+        return app
+
+    @staticmethod
+    async def _send_json(send: Send, status: int, payload: dict[str, Any]) -> None:
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+app = LazySidecarApp()
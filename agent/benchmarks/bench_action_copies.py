@@ -0,0 +1,83 @@
+"""
+Cost of the ways the plan path can produce renumbered actions and plans.
+
+Compares the `Action` copies the adapter and verifier make today with
+`model_construct` and with a slotted dataclass converted to `Action` at the
+HTTP edge, plus `_reindex_actions` against the old copy-everything version.
+
+Run from agent/:  python benchmarks/bench_action_copies.py
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+from pathlib import Path
+import sys
+import timeit
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.schemas import Action, ActionPlan  # noqa: E402
+from macos_use_adapter.adapter import MacOSUseAdapter  # noqa: E402
+
+
+@dataclass(frozen=True, slots=True)
+class SlottedAction:
+    id: str
+    kind: str
+    target: str | None = None
+    text: str | None = None
+    key_combo: str | None = None
+    app_bundle_id: str | None = None
+    timeout_ms: int = 3000
+    destructive: bool = False
+    expected_outcome: str | None = None
+
+
+ACTION = Action(id="a1", kind="type", target="Title", text="Buy milk", expected_outcome="Title entered")
+SLOTTED = SlottedAction(**ACTION.model_dump())
+FIELDS = ACTION.model_dump()
+
+
+def copy_all(actions: list[Action]) -> list[Action]:
+    """The previous `_reindex_actions`."""
+    return [action.model_copy(update={"id": f"a{idx}"}) for idx, action in enumerate(actions, start=1)]
+
+
+def best_us(func, number: int = 50_000) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    print("renumber one action")
+    cases = [
+        ("model_copy(update=)", lambda: ACTION.model_copy(update={"id": "retry_1"})),
+        ("Action(**fields)", lambda: Action(**{**FIELDS, "id": "retry_1"})),
+        ("Action.model_construct", lambda: Action.model_construct(**{**FIELDS, "id": "retry_1"})),
+        ("slotted + Action at edge", lambda: Action(**asdict(SlottedAction(**{**FIELDS, "id": "retry_1"})))),
+    ]
+    for name, func in cases:
+        print(f"  {name:<28} {best_us(func):7.2f} us")
+
+    actions = [ACTION.model_copy(update={"id": f"a{idx}"}) for idx in range(1, 4)]
+    print("build a 3-action ActionPlan")
+    plan_fields = {"session_id": "bench", "plan_id": "p1", "confidence": 0.8, "risk_level": "low"}
+    cases = [
+        ("ActionPlan(...)", lambda: ActionPlan(actions=actions, requires_confirmation=False, **plan_fields)),
+        (
+            "ActionPlan.model_construct",
+            lambda: ActionPlan.model_construct(actions=actions, requires_confirmation=False, **plan_fields),
+        ),
+    ]
+    for name, func in cases:
+        print(f"  {name:<28} {best_us(func):7.2f} us")
+
+    print("reindex 3 actions               copy-all   reuse")
+    for name, items in (("already numbered", actions), ("commit inserted first", [actions[2], *actions[:2]])):
+        old = best_us(lambda: copy_all(items))
+        new = best_us(lambda: MacOSUseAdapter._reindex_actions(items))
+        print(f"  {name:<28} {old:7.2f} {new:7.2f} us")
+
+
+if __name__ == "__main__":
+    main()
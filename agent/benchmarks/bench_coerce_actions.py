@@ -0,0 +1,56 @@
+"""
+Time `MacOSUseAdapter._coerce_actions` over large synthetic provider outputs.
+
+Run from agent/:  python benchmarks/bench_coerce_actions.py
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import random
+import sys
+import timeit
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from macos_use_adapter.adapter import MacOSUseAdapter  # noqa: E402
+
+
+TARGETS = ("Send", "Reply", "New Note", "Title", "Location", "Done", "search bar", "first_search_result", "Save")
+COMBOS = ("cmd+s", "Command + Enter", "tab", "cmd+n", "return", "cmd+l")
+
+
+def build_raw_actions(rng: random.Random, count: int) -> list[object]:
+    raw: list[object] = []
+    for idx in range(1, count + 1):
+        roll = rng.random()
+        if roll < 0.3:
+            raw.append({"id": f"a{idx}", "kind": "click", "target": rng.choice(TARGETS), "timeout_ms": "2500"})
+        elif roll < 0.5:
+            raw.append({"id": f"a{idx}", "kind": "type", "text": f"value {idx}", "expected_outcome": "Field filled"})
+        elif roll < 0.7:
+            raw.append({"id": f"a{idx}", "kind": "key_combo", "key_combo": rng.choice(COMBOS)})
+        elif roll < 0.8:
+            raw.append({"id": f"a{idx}", "kind": "open_app", "target": "Notes", "destructive": False})
+        elif roll < 0.9:
+            raw.append({"id": f"a{idx}", "kind": "teleport", "target": "Mars"})
+        else:
+            raw.append({"id": f"a{idx}", "kind": "select_menu_item", "target": None})
+    raw.append("not an object")
+    return raw
+
+
+def main() -> None:
+    adapter = MacOSUseAdapter()
+    rng = random.Random(11)
+    print(f"{'actions':>8} {'accepted':>9} {'warnings':>9} {'usec/call':>11} {'usec/action':>12}")
+    for count in (3, 30, 300, 3000):
+        raw = build_raw_actions(rng, count)
+        runs = max(5, 3000 // count)
+        seconds = min(timeit.repeat(lambda: adapter._coerce_actions(raw), number=runs, repeat=5)) / runs
+        actions, warnings = adapter._coerce_actions(raw)
+        print(f"{count:>8} {len(actions):>9} {len(warnings):>9} {seconds * 1e6:>11.1f} {seconds * 1e6 / len(raw):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare verifier context delta engines on synthetic AX-style context dumps.
+
+Run from agent/:  python benchmarks/bench_context_delta.py
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import random
+import sys
+import timeit
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.context_delta import DELTA_ENGINES  # noqa: E402
+
+
+ROLES = ("AXButton", "AXTextField", "AXStaticText", "AXMenuItem", "AXCell", "AXRow", "AXLink")
+WORDS = ("Send", "Reply", "Inbox", "Notes", "Today", "Search", "Done", "Cancel", "Title", "Location", "Safari")
+THRESHOLDS = (0.01, 0.05)
+
+
+def build_context(rng: random.Random, *, lines: int, window: str) -> str:
+    header = f"app=Notes, window={window}, url=n/a, ax_lines={lines}"
+    body = [
+        f"{rng.choice(ROLES)} '{rng.choice(WORDS)} {rng.randint(1, 500)}' [{idx}]"
+        for idx in range(lines)
+    ]
+    return "\n".join([header, *body])
+
+
+def mutate(rng: random.Random, context: str, *, fraction: float) -> str:
+    lines = context.split("\n")
+    for _ in range(max(0, int(len(lines) * fraction))):
+        idx = rng.randrange(1, len(lines))
+        lines[idx] = f"{rng.choice(ROLES)} '{rng.choice(WORDS)} {rng.randint(501, 900)}' [{idx}]"
+    return "\n".join(lines)
+
+
+def build_cases(seed: int = 7) -> list[tuple[str, str, str]]:
+    rng = random.Random(seed)
+    cases: list[tuple[str, str, str]] = []
+    for lines in (20, 200, 600):
+        base = build_context(rng, lines=lines, window="New Note")
+        cases.append((f"identical/{lines}", base, base))
+        for fraction in (0.0, 0.005, 0.02, 0.1, 0.5):
+            changed = mutate(rng, base, fraction=fraction)
+            cases.append((f"mutate{fraction}/{lines}", base, changed))
+        cases.append((f"new-window/{lines}", base, build_context(rng, lines=lines, window="Untitled")))
+    return cases
+
+
+def main() -> None:
+    cases = build_cases()
+    exact = DELTA_ENGINES["exact"]
+    print(f"{'case':<22} {'engine':<6} {'delta':>7} {'usec':>10}")
+    disagreements = 0
+    for name, before, after in cases:
+        reference = exact(before, after)
+        for engine_name, engine in DELTA_ENGINES.items():
+            runs = 1 if len(before) > 5_000 else 20
+            seconds = timeit.timeit(lambda: engine(before, after), number=runs) / runs
+            delta = engine(before, after)
+            print(f"{name:<22} {engine_name:<6} {delta:7.3f} {seconds * 1e6:10.1f}")
+            for threshold in THRESHOLDS:
+                if (delta < threshold) != (reference < threshold):
+                    disagreements += 1
+    # On large dumps SequenceMatcher's autojunk heuristic inflates the exact
+    # delta, so disagreements there usually reflect exact-mode noise.
+    print(f"threshold disagreements vs exact ({', '.join(map(str, THRESHOLDS))}): {disagreements}")
+
+
+if __name__ == "__main__":
+    main()
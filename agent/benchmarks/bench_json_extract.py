@@ -0,0 +1,82 @@
+"""
+Compare the balanced JSON scanner with the old greedy-regex extraction on
+pathological provider outputs.
+
+Run from agent/:  python benchmarks/bench_json_extract.py
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import re
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from macos_use_adapter.payload import extract_json_object  # noqa: E402
+
+
+GREEDY_OBJECT_RE = re.compile(r"\{[\s\S]*\}")
+PLAN = json.dumps(
+    {
+        "summary": "Open Notes",
+        "confidence": 0.9,
+        "actions": [{"id": f"a{idx}", "kind": "wait", "timeout_ms": 500} for idx in range(1, 4)],
+    }
+)
+# The greedy baseline is quadratic on some inputs; skip it above this size.
+GREEDY_MAX_CHARS = 40_000
+
+
+def greedy_extract(text: str) -> dict | None:
+    """The previous `_extract_json_payload` fallback."""
+    stripped = text.strip()
+    try:
+        parsed = json.loads(stripped)
+        if isinstance(parsed, dict):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+    match = GREEDY_OBJECT_RE.search(stripped)
+    if not match:
+        return None
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def build_cases() -> list[tuple[str, str]]:
+    cases: list[tuple[str, str]] = [("clean", PLAN), ("fenced", f"Here you go:\n```json\n{PLAN}\n```\nLet me know!")]
+    for size in (10_000, 200_000):
+        cases.append((f"prose/{size}", "lorem ipsum dolor " * (size // 18)))
+        cases.append((f"prose+plan/{size}", "lorem ipsum dolor " * (size // 18) + PLAN))
+        cases.append((f"plan+stray-brace/{size}", PLAN + " trailing } prose " * (size // 17)))
+        cases.append((f"open-braces/{size}", "{" * size))
+        cases.append((f"unbalanced+plan/{size}", "{ note: " * (size // 8) + PLAN))
+    return cases
+
+
+def timed(func, text: str) -> tuple[float, bool]:
+    started = time.perf_counter()
+    result = func(text)
+    return time.perf_counter() - started, result is not None
+
+
+def main() -> None:
+    print(f"{'case':<28} {'chars':>8} {'scanner ms':>11} {'found':>6} {'greedy ms':>10} {'found':>6}")
+    for name, text in build_cases():
+        scan_seconds, scan_found = timed(extract_json_object, text)
+        if len(text) <= GREEDY_MAX_CHARS:
+            greedy_seconds, greedy_found = timed(greedy_extract, text)
+            greedy = f"{greedy_seconds * 1e3:10.2f} {str(greedy_found):>6}"
+        else:
+            greedy = f"{'skipped':>10} {'-':>6}"
+        print(f"{name:<28} {len(text):>8} {scan_seconds * 1e3:11.2f} {str(scan_found):>6} {greedy}")
+
+
+if __name__ == "__main__":
+    main()
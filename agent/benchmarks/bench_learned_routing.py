@@ -0,0 +1,68 @@
+"""
+Per-request cost of model selection: the heuristic routing table alone and
+with the learned router in shadow and "on" mode.
+
+Run from agent/:  python benchmarks/bench_learned_routing.py
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+from types import MappingProxyType
+import timeit
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.learned_routing import LearnedPolicy, LearnedRouter  # noqa: E402
+from core.model_routing import compile_routing_table  # noqa: E402
+
+
+TRANSCRIPTS = (
+    "open safari and go to github.com",
+    "reply to the last email from Sam saying I'll be there at five",
+    "search for flights to Lisbon next friday",
+    "make the selected text bold",
+)
+TABLE = compile_routing_table(
+    model_simple="claude-3-5-haiku-latest",
+    model_complex="claude-3-5-sonnet-latest",
+    app_overrides={"xcode": "claude-3-5-sonnet-latest"},
+)
+POLICY = LearnedPolicy(
+    routes=MappingProxyType(
+        {
+            "*|multi_step": "claude-3-5-haiku-latest",
+            "*|compose": "claude-3-5-sonnet-latest",
+            "*|search": "claude-3-5-haiku-latest",
+            "mail|compose": "claude-3-5-haiku-latest",
+        }
+    )
+)
+
+
+def heuristic() -> None:
+    for transcript in TRANSCRIPTS:
+        TABLE.select(transcript, app_name="Mail")
+
+
+def learned(router: LearnedRouter) -> None:
+    for transcript in TRANSCRIPTS:
+        model = TABLE.select(transcript, app_name="Mail")
+        router.route(transcript, app_name="Mail", heuristic_model=model, pinned=TABLE.override_for("Mail") is not None)
+
+
+def best_us(fn, number: int = 20_000) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number / len(TRANSCRIPTS) * 1e6
+
+
+def main() -> None:
+    shadow = LearnedRouter(POLICY, mode="shadow")
+    on = LearnedRouter(POLICY, mode="on")
+    print(f"heuristic table     {best_us(heuristic):6.2f} us/request")
+    print(f"learned (shadow)    {best_us(lambda: learned(shadow)):6.2f} us/request")
+    print(f"learned (on)        {best_us(lambda: learned(on)):6.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Transcript policy checks: the separate per-concern scans the planner used to
+run (risk substrings, complexity substrings, intent regexes, each on freshly
+lowercased text) against one `PolicyMatcher` pass, cold and memoized.
+
+Run from agent/:  python benchmarks/bench_policy_matcher.py
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import re
+import sys
+import timeit
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.policy_matcher import PolicyMatcher  # noqa: E402
+from macos_use_adapter.rules import INTENT_CLASS_TERMS, RISK_TERMS  # noqa: E402
+
+
+OLD_HIGH_RISK_TERMS = {"send", "delete", "purchase", "buy", "post", "submit"}
+OLD_COMPLEXITY_MARKERS = (" and ", " then ", "after", "before", "reply", "send", "purchase")
+OLD_INTENT_RULES = tuple(
+    (name, re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\b"))
+    for name, terms in INTENT_CLASS_TERMS
+)
+
+SHORT = "open the quarterly report from the sender this afternoon"
+LONG = (
+    "open the shared drive, find the folder with the quarterly numbers from the sender list, "
+    "copy the totals into the spreadsheet this afternoon, rename the sheet to match the month, "
+) * 20 + "and then reply to Dana with the summary"
+
+
+def separate_scans(transcript: str) -> tuple[bool, bool, str]:
+    lowered = transcript.lower()
+    risky = any(term in lowered for term in OLD_HIGH_RISK_TERMS)
+    lower = transcript.lower()
+    is_complex = len(lower.split()) > 10 or any(marker in lower for marker in OLD_COMPLEXITY_MARKERS)
+    lowered = transcript.lower()
+    intent = next((name for name, pattern in OLD_INTENT_RULES if pattern.search(lowered)), "general")
+    return risky, is_complex, intent
+
+
+def best_us(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    matcher = PolicyMatcher()
+    for label, transcript in (("short", SHORT), ("long", LONG)):
+        number = 20_000 if label == "short" else 500
+        old = best_us(lambda: separate_scans(transcript), number)
+        cold = best_us(lambda: matcher._scan(transcript), number)
+        warm = best_us(lambda: matcher.scan(transcript), number)
+        print(f"{label:5} ({len(transcript):5} chars)  separate {old:8.2f} us  one pass {cold:8.2f} us  memoized {warm:6.2f} us")
+
+    # Substring false positives the word-boundary matcher no longer reports.
+    print("old risk hit on SHORT:", any(term in SHORT.lower() for term in OLD_HIGH_RISK_TERMS))
+    print("new risk hit on SHORT:", bool(set(matcher.scan(SHORT).risk) & set(RISK_TERMS)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare response rendering via `model_dump(mode="json")` + `JSONResponse`
+with `ModelJSONResponse`, which encodes models straight to bytes.
+
+Run from agent/:  python benchmarks/bench_response_serialization.py
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+import timeit
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.responses import ModelJSONResponse  # noqa: E402
+from core.schemas import Action, ActionPlan, TelemetryEvent  # noqa: E402
+
+
+def build_plan(action_count: int) -> ActionPlan:
+    return ActionPlan(
+        session_id="bench-session",
+        plan_id="plan-bench",
+        actions=[
+            Action(
+                id=f"a{idx}",
+                kind="type",
+                target="Message body",
+                text=f"Line {idx}: the quick brown fox jumps over the lazy dog",
+                expected_outcome=f"Line {idx} typed",
+            )
+            for idx in range(1, action_count + 1)
+        ],
+        confidence=0.82,
+        risk_level="low",
+        requires_confirmation=False,
+        summary="Type a long message",
+    )
+
+
+def build_events(count: int) -> list[TelemetryEvent]:
+    return [
+        TelemetryEvent(
+            session_id=f"bench-{idx % 17}",
+            stage="executing",
+            app="Notes",
+            action_kind="type",
+            status="success",
+            latency_ms=idx % 900,
+            cycle_index=idx % 8,
+            replan_count=0,
+            loop_state="TEXT_ENTERED",
+        )
+        for idx in range(count)
+    ]
+
+
+def best_ms(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e3
+
+
+def main() -> None:
+    cases = [
+        ("ActionPlan/3", lambda: build_plan(3), lambda value: value.model_dump(mode="json")),
+        ("ActionPlan/200", lambda: build_plan(200), lambda value: value.model_dump(mode="json")),
+        (
+            "telemetry/100",
+            lambda: {"events": build_events(100)},
+            lambda value: {"events": [event.model_dump(mode="json") for event in value["events"]]},
+        ),
+        (
+            "telemetry/1000",
+            lambda: {"events": build_events(1_000)},
+            lambda value: {"events": [event.model_dump(mode="json") for event in value["events"]]},
+        ),
+    ]
+    print(f"{'case':<18} {'bytes':>9} {'dump+json ms':>13} {'direct ms':>10} {'speedup':>8}")
+    for name, build, dump in cases:
+        value = build()
+        body = ModelJSONResponse(value).body
+        number = max(10, 20_000 // max(1, len(body) // 100))
+        baseline = best_ms(lambda: JSONResponse(dump(value)), number)
+        direct = best_ms(lambda: ModelJSONResponse(value), number)
+        print(f"{name:<18} {len(body):>9} {baseline:13.3f} {direct:10.3f} {baseline / direct:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Cost of getting a 5K display screenshot to the planner: a base64 screenshot
+inside the plan JSON against a raw-bytes upload plus a small plan request,
+and the server-side downscale with and without JPEG draft decoding.
+
+Run from agent/:  python benchmarks/bench_screenshot_upload.py
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import json
+from pathlib import Path
+import sys
+import timeit
+
+from PIL import Image, ImageDraw
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.schemas import PlanRequest  # noqa: E402
+from core.screenshots import prepare_screenshot  # noqa: E402
+
+
+def screen_jpeg() -> bytes:
+    image = Image.new("RGB", (5120, 2880), (236, 236, 236))
+    draw = ImageDraw.Draw(image)
+    for row in range(0, 2880, 24):
+        draw.text((40, row), "Inbox  Sam Lee  Re: quarterly numbers  10:42" * 3, fill=(20, 20, 20))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def best_ms(fn, number: int = 20) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1000
+
+
+def main() -> None:
+    raw = screen_jpeg()
+    base = {"session_id": "bench", "transcript": "reply to Sam with the totals", "app": {"name": "Mail"}}
+    inline = json.dumps({**base, "screenshot_base64": base64.b64encode(raw).decode("ascii")}).encode()
+    referenced = json.dumps({**base, "screenshot_id": "0123456789abcdef"}).encode()
+
+    prepared = prepare_screenshot(raw)
+    print(f"source JPEG {len(raw) / 1024:7.0f} KiB -> prepared {len(prepared.data) / 1024:5.0f} KiB "
+          f"({prepared.width}x{prepared.height})")
+    print(f"plan body with base64 {len(inline) / 1024:7.0f} KiB, with screenshot_id {len(referenced) / 1024:4.1f} KiB")
+    print(f"parse base64 plan     {best_ms(lambda: PlanRequest.model_validate_json(inline)):7.3f} ms")
+    print(f"parse referenced plan {best_ms(lambda: PlanRequest.model_validate_json(referenced)):7.3f} ms")
+    print(f"prepare (draft)       {best_ms(lambda: prepare_screenshot(raw), number=5):7.1f} ms")
+    print(f"prepare (full decode) {best_ms(lambda: prepare_screenshot(raw, crop=(0, 0, 5120, 2880)), number=5):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
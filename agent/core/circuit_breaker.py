@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+import time
+from typing import Callable, Literal
+
+
+CircuitState = Literal["closed", "open", "half_open"]
+
+
+@dataclass(frozen=True, slots=True)
+class CallPermit:
+    """
+    Issued by `allow_request` and handed back to `record_*`, so an outcome is
+    only counted against the circuit state the call was admitted under.
+    """
+
+    generation: int
+    probe: bool = False
+
+
+class CircuitBreaker:
+    """
+    Failure/latency circuit breaker for provider calls.
+
+    Trips open after `failure_threshold` consecutive failures, or when at least
+    `slow_call_ratio` of the last `window` calls took longer than
+    `slow_call_seconds`. After `open_seconds` a single half-open probe is let
+    through; its outcome decides whether the circuit closes or re-opens.
+    Calls admitted before the last trip or close are stale: their outcomes are
+    ignored, so a slow call from before the trip cannot settle the probe.
+    """
+
+    def __init__(
+        self,
+        *,
+        failure_threshold: int,
+        open_seconds: float,
+        slow_call_seconds: float,
+        slow_call_ratio: float,
+        window: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._failure_threshold = max(1, failure_threshold)
+        self._open_seconds = open_seconds
+        self._slow_call_seconds = slow_call_seconds
+        self._slow_call_ratio = slow_call_ratio
+        self._clock = clock
+        self._recent_slow: deque[bool] = deque(maxlen=max(1, window))
+        self._state: CircuitState = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._last_failure: str | None = None
+        # Bumped on every trip and close; permits from older generations are stale.
+        self._generation = 0
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == "open" and self._clock() - self._opened_at >= self._open_seconds:
+            return "half_open"
+        return self._state
+
+    @property
+    def last_failure(self) -> str | None:
+        return self._last_failure
+
+    def retry_after(self) -> float | None:
+        if self.state != "open":
+            return None
+        return max(0.0, self._open_seconds - (self._clock() - self._opened_at))
+
+    def allow_request(self) -> CallPermit | None:
+        state = self.state
+        if state == "closed":
+            return CallPermit(self._generation)
+        if state == "half_open" and not self._probe_in_flight:
+            self._state = "half_open"
+            self._probe_in_flight = True
+            return CallPermit(self._generation, probe=True)
+        return None
+
+    def record_success(self, permit: CallPermit, latency_seconds: float) -> None:
+        if permit.generation != self._generation:
+            return
+        slow = latency_seconds >= self._slow_call_seconds
+        if permit.probe:
+            self._probe_in_flight = False
+            if slow:
+                self._trip(f"Half-open probe was slow ({latency_seconds:.1f}s)")
+                return
+            self._close()
+            return
+        self._consecutive_failures = 0
+        self._recent_slow.append(slow)
+        if self._slow_rate_exceeded():
+            self._trip(f"Provider latency elevated (>= {self._slow_call_seconds:.0f}s)")
+
+    def record_failure(self, permit: CallPermit, reason: str) -> None:
+        if permit.generation != self._generation:
+            return
+        self._last_failure = reason
+        if permit.probe:
+            self._probe_in_flight = False
+            self._trip(reason)
+            return
+        self._consecutive_failures += 1
+        self._recent_slow.append(True)
+        if self._consecutive_failures >= self._failure_threshold:
+            self._trip(reason)
+
+    def release_probe(self, permit: CallPermit) -> None:
+        """Give up a half-open probe whose outcome says nothing about provider health."""
+        if permit.probe and permit.generation == self._generation:
+            self._probe_in_flight = False
+
+    def _slow_rate_exceeded(self) -> bool:
+        window = self._recent_slow
+        if len(window) < (window.maxlen or 1):
+            return False
+        return sum(window) / len(window) >= self._slow_call_ratio
+
+    def _trip(self, reason: str) -> None:
+        self._generation += 1
+        self._state = "open"
+        self._opened_at = self._clock()
+        self._last_failure = reason
+        self._recent_slow.clear()
+
+    def _close(self) -> None:
+        self._generation += 1
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._recent_slow.clear()
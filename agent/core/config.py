@@ -20,8 +20,43 @@ class Settings:
     anthropic_api_base: str = os.getenv("ANTHROPIC_API_BASE", "https://api.anthropic.com")
     anthropic_validate_timeout_seconds: float = float(os.getenv("ORANGE_ANTHROPIC_VALIDATE_TIMEOUT_SECONDS", "20"))
     anthropic_plan_timeout_seconds: float = float(os.getenv("ORANGE_ANTHROPIC_PLAN_TIMEOUT_SECONDS", "60"))
+    anthropic_plan_min_timeout_seconds: float = float(os.getenv("ORANGE_ANTHROPIC_PLAN_MIN_TIMEOUT_SECONDS", "6"))
+    adaptive_plan_timeouts: bool = os.getenv("ORANGE_ADAPTIVE_PLAN_TIMEOUTS", "1") == "1"
+    adaptive_timeout_multiplier: float = float(os.getenv("ORANGE_ADAPTIVE_TIMEOUT_MULTIPLIER", "1.5"))
+    adaptive_timeout_min_samples: int = int(os.getenv("ORANGE_ADAPTIVE_TIMEOUT_MIN_SAMPLES", "8"))
     safety_strictness: str = os.getenv("ORANGE_SAFETY_STRICTNESS", "strict")
+    session_ttl_seconds: float = float(os.getenv("ORANGE_SESSION_TTL_SECONDS", "900"))
+    session_max_count: int = int(os.getenv("ORANGE_SESSION_MAX_COUNT", "256"))
+    verifier_delta_mode: str = os.getenv("ORANGE_VERIFIER_DELTA_MODE", "fast")
+    planner_output_mode: str = "json_text" if os.getenv("ORANGE_PLANNER_OUTPUT_MODE", "tool") == "json_text" else "tool"
+    speculative_planning: bool = os.getenv("ORANGE_SPECULATIVE_PLANNING", "0") == "1"
     model_overrides_raw: str = os.getenv("ORANGE_MODEL_OVERRIDES", "")
+    model_routing_file_raw: str = os.getenv("ORANGE_MODEL_ROUTING_FILE", "")
+    model_routing_poll_seconds: float = float(os.getenv("ORANGE_MODEL_ROUTING_POLL_SECONDS", "2"))
+    learned_routing_file_raw: str = os.getenv("ORANGE_LEARNED_ROUTING_FILE", "")
+    learned_routing_mode: str = os.getenv("ORANGE_LEARNED_ROUTING_MODE", "shadow")
+    vendor_rules_cache_raw: str = os.getenv("ORANGE_VENDOR_RULES_CACHE", "")
+    planner_vision: bool = os.getenv("ORANGE_PLANNER_VISION", "0") == "1"
+    screenshot_max_edge: int = int(os.getenv("ORANGE_SCREENSHOT_MAX_EDGE", "1568"))
+    screenshot_jpeg_quality: int = int(os.getenv("ORANGE_SCREENSHOT_JPEG_QUALITY", "80"))
+    screenshot_max_upload_bytes: int = int(os.getenv("ORANGE_SCREENSHOT_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+    fast_path_planner: bool = os.getenv("ORANGE_FAST_PATH_PLANNER", "1") == "1"
+    fast_path_min_confidence: float = float(os.getenv("ORANGE_FAST_PATH_MIN_CONFIDENCE", "0.8"))
+    fast_path_thresholds_raw: str = os.getenv("ORANGE_FAST_PATH_THRESHOLDS", "")
+    plan_session_rate_per_minute: float = float(os.getenv("ORANGE_PLAN_SESSION_RATE_PER_MINUTE", "30"))
+    plan_session_burst: int = int(os.getenv("ORANGE_PLAN_SESSION_BURST", "6"))
+    plan_global_rate_per_minute: float = float(os.getenv("ORANGE_PLAN_GLOBAL_RATE_PER_MINUTE", "120"))
+    plan_global_burst: int = int(os.getenv("ORANGE_PLAN_GLOBAL_BURST", "20"))
+    provider_max_concurrency: int = int(os.getenv("ORANGE_PROVIDER_MAX_CONCURRENCY", "4"))
+    provider_max_queue: int = int(os.getenv("ORANGE_PROVIDER_MAX_QUEUE", "16"))
+    provider_queue_timeout_seconds: float = float(os.getenv("ORANGE_PROVIDER_QUEUE_TIMEOUT_SECONDS", "15"))
+    provider_rate_limit_retries: int = int(os.getenv("ORANGE_PROVIDER_RATE_LIMIT_RETRIES", "2"))
+    provider_max_retry_after_seconds: float = float(os.getenv("ORANGE_PROVIDER_MAX_RETRY_AFTER_SECONDS", "8"))
+    provider_breaker_failure_threshold: int = int(os.getenv("ORANGE_PROVIDER_BREAKER_FAILURE_THRESHOLD", "3"))
+    provider_breaker_open_seconds: float = float(os.getenv("ORANGE_PROVIDER_BREAKER_OPEN_SECONDS", "30"))
+    provider_breaker_slow_call_seconds: float = float(os.getenv("ORANGE_PROVIDER_BREAKER_SLOW_CALL_SECONDS", "20"))
+    provider_breaker_slow_call_ratio: float = float(os.getenv("ORANGE_PROVIDER_BREAKER_SLOW_CALL_RATIO", "0.6"))
+    provider_breaker_window: int = int(os.getenv("ORANGE_PROVIDER_BREAKER_WINDOW", "5"))
 
     @property
     def repo_root(self) -> Path:
@@ -32,20 +67,43 @@ class Settings:
         return self.repo_root / "vendor" / "macos-use"
 
     @property
-    def model_overrides(self) -> dict[str, str]:
+    def vendor_macos_use_commit_file(self) -> Path:
+        return self.repo_root / "vendor" / "macos-use.commit"
+
+    @property
+    def vendor_rules_cache_path(self) -> Path:
+        if self.vendor_rules_cache_raw:
+            return Path(self.vendor_rules_cache_raw).expanduser()
+        return Path.home() / "Library" / "Caches" / "Orange" / "vendor_rules.json"
+
+    @property
+    def model_routing_file(self) -> Path | None:
+        if not self.model_routing_file_raw:
+            return None
+        return Path(self.model_routing_file_raw).expanduser()
+
+    @property
+    def learned_routing_file(self) -> Path | None:
+        if not self.learned_routing_file_raw:
+            return None
+        return Path(self.learned_routing_file_raw).expanduser()
+
+    @property
+    def fast_path_thresholds(self) -> dict[str, float]:
         """
-        Parse per-app model overrides from ORANGE_MODEL_OVERRIDES.
+        Parse per-intent fast-path confidence thresholds from
+        ORANGE_FAST_PATH_THRESHOLDS (e.g. "search:0.9,open_app:0.85").
         """
-        result: dict[str, str] = {}
-        for part in self.model_overrides_raw.split(","):
+        result: dict[str, float] = {}
+        for part in self.fast_path_thresholds_raw.split(","):
             item = part.strip()
             if not item or ":" not in item:
                 continue
-            app, model = item.split(":", 1)
-            app_key = app.strip().lower()
-            model_value = model.strip()
-            if app_key and model_value:
-                result[app_key] = model_value
+            intent, threshold = item.split(":", 1)
+            try:
+                result[intent.strip().lower()] = float(threshold)
+            except ValueError:
+                continue
         return result
 
     @property
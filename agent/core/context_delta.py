@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from difflib import SequenceMatcher
+import re
+from typing import Callable
+
+
+DeltaEngine = Callable[[str, str], float]
+
+# Below this combined size SequenceMatcher is cheap enough to run exactly.
+FAST_EXACT_MAX_CHARS = 4_000
+SHINGLE_SIZE = 3
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def _edge_delta(before: str, after: str) -> float | None:
+    if not before and not after:
+        return 0.0
+    if before and not after:
+        return 0.0
+    if not before and after:
+        return 1.0
+    if before == after:
+        return 0.0
+    return None
+
+
+def exact_context_delta(before: str, after: str) -> float:
+    """1 - SequenceMatcher.ratio(); the reference behaviour."""
+    edge = _edge_delta(before, after)
+    if edge is not None:
+        return edge
+    ratio = SequenceMatcher(a=before, b=after).ratio()
+    return max(0.0, 1.0 - ratio)
+
+
+def _shingles(text: str) -> set[tuple[str, ...]] | set[str]:
+    tokens = _TOKEN_RE.findall(text)
+    if len(tokens) < SHINGLE_SIZE:
+        return set(tokens)
+    return {tuple(tokens[idx : idx + SHINGLE_SIZE]) for idx in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def fast_context_delta(before: str, after: str) -> float:
+    """
+    Linear-time approximation of `exact_context_delta` for large contexts.
+
+    Identical strings short-circuit, small inputs use the exact matcher, and
+    large inputs compare token shingle sets (Jaccard distance). The
+    length-only bound (what `real_quick_ratio` computes) is checked first so
+    wildly different dumps skip tokenization entirely.
+    """
+    edge = _edge_delta(before, after)
+    if edge is not None:
+        return edge
+    if len(before) + len(after) <= FAST_EXACT_MAX_CHARS:
+        return exact_context_delta(before, after)
+
+    # SequenceMatcher.real_quick_ratio() from the lengths alone; building a
+    # matcher for it would index all of `after`.
+    shorter, total = min(len(before), len(after)), len(before) + len(after)
+    length_bound = 1.0 - 2.0 * shorter / total
+    if length_bound >= 0.5:
+        return length_bound
+
+    before_shingles = _shingles(before)
+    after_shingles = _shingles(after)
+    union = len(before_shingles | after_shingles)
+    if union == 0:
+        return 0.0
+    similarity = len(before_shingles & after_shingles) / union
+    return max(length_bound, 1.0 - similarity)
+
+
+DELTA_ENGINES: dict[str, DeltaEngine] = {
+    "exact": exact_context_delta,
+    "fast": fast_context_delta,
+}
+
+
+def resolve_delta_engine(name: str) -> DeltaEngine:
+    return DELTA_ENGINES.get(name.strip().lower(), fast_context_delta)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+import re
+from types import MappingProxyType
+from typing import Mapping
+
+
+_FIRST_KEY_RE = re.compile(r"(?:^|(?<=[\s,]))([a-z_]+)=")
+_KEY_RE = re.compile(r"([a-z_]+)=")
+_VALUE_BOUNDARY_RE = re.compile(r", (?=[a-z_]+=)")
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedContext:
+    """
+    Structured view of a desktop context header such as
+    `app=Notes, window="Re: lunch, Friday", url=n/a, ax_lines=20`.
+
+    `app` and `window` are lowercased for comparisons; `fields` keeps the raw
+    (stripped) values, read-only because parsed headers are cached and shared.
+    """
+
+    fields: Mapping[str, str]
+    app: str
+    window: str
+
+    @property
+    def has_app(self) -> bool:
+        return "app" in self.fields
+
+    def get(self, key: str) -> str | None:
+        return self.fields.get(key)
+
+
+EMPTY_CONTEXT = ParsedContext(fields=MappingProxyType({}), app="", window="")
+
+
+def _read_quoted(text: str, start: int) -> tuple[str, int]:
+    """Read a double-quoted value starting at `start` (the opening quote)."""
+    chars: list[str] = []
+    idx = start + 1
+    length = len(text)
+    while idx < length:
+        char = text[idx]
+        if char == "\\" and idx + 1 < length:
+            chars.append(text[idx + 1])
+            idx += 2
+            continue
+        if char == '"':
+            return "".join(chars), idx + 1
+        chars.append(char)
+        idx += 1
+    # Unterminated quote: keep everything after it.
+    return "".join(chars), length
+
+
+def _tokenize(header: str) -> dict[str, str]:
+    fields: dict[str, str] = {}
+    match = _FIRST_KEY_RE.search(header)
+    length = len(header)
+    while match is not None:
+        key = match.group(1)
+        pos = match.end()
+        if pos < length and header[pos] == '"':
+            value, pos = _read_quoted(header, pos)
+            boundary = header.find(", ", pos)
+            next_pos = length if boundary < 0 else boundary + 2
+        else:
+            boundary_match = _VALUE_BOUNDARY_RE.search(header, pos)
+            if boundary_match is None:
+                value, next_pos = header[pos:], length
+            else:
+                value, next_pos = header[pos : boundary_match.start()], boundary_match.end()
+        fields.setdefault(key, value.strip())
+        match = _KEY_RE.match(header, next_pos) if next_pos < length else None
+    return fields
+
+
+def parse_context(context: str) -> ParsedContext:
+    """Parse the first line of a context dump; the AX lines after it are ignored."""
+    if not context:
+        return EMPTY_CONTEXT
+    return _parse_header(context.split("\n", 1)[0])
+
+
+# Keyed on the header line only, so the cache holds short strings and hits
+# whenever the header repeats, whatever the AX dump below it.
+@lru_cache(maxsize=512)
+def _parse_header(header: str) -> ParsedContext:
+    fields = _tokenize(header)
+    if not fields:
+        return EMPTY_CONTEXT
+    return ParsedContext(
+        fields=MappingProxyType(fields),
+        app=fields.get("app", "").lower(),
+        window=fields.get("window", "").lower(),
+    )
@@ -22,6 +22,20 @@ class EventBus:
             with suppress(asyncio.QueueFull):
                 queue.put_nowait(event)
 
+    async def publish_many(self, events: list[StreamEvent]) -> None:
+        """Publish a burst of events, resolving each session's subscribers once."""
+        by_session: dict[str, list[StreamEvent]] = defaultdict(list)
+        for event in events:
+            by_session[event.session_id].append(event)
+        for session_id, session_events in by_session.items():
+            queues = self._subscribers.get(session_id)
+            if not queues:
+                continue
+            for queue in list(queues):
+                for event in session_events:
+                    with suppress(asyncio.QueueFull):
+                        queue.put_nowait(event)
+
     async def subscribe(self, session_id: str) -> AsyncIterator[StreamEvent]:
         queue: asyncio.Queue[StreamEvent] = asyncio.Queue(maxsize=100)
         self._subscribers[session_id].add(queue)
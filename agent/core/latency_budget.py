@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from collections import deque
+
+
+PROMPT_SIZE_BUCKETS = (2_000, 4_000, 8_000, 16_000)
+
+
+def prompt_size_bucket(prompt_chars: int) -> int:
+    for index, limit in enumerate(PROMPT_SIZE_BUCKETS):
+        if prompt_chars < limit:
+            return index
+    return len(PROMPT_SIZE_BUCKETS)
+
+
+class LatencyBudget:
+    """
+    Rolling provider latency per (model, prompt-size bucket) and the request
+    timeouts derived from it.
+
+    Until a key has `min_samples` observations the static `ceiling_seconds` is
+    used. Afterwards the timeout is `p95 * multiplier + margin`, clamped to
+    [floor_seconds, ceiling_seconds].
+    """
+
+    def __init__(
+        self,
+        *,
+        ceiling_seconds: float,
+        floor_seconds: float,
+        multiplier: float = 1.5,
+        margin_seconds: float = 1.0,
+        min_samples: int = 8,
+        window: int = 64,
+    ) -> None:
+        self._ceiling = ceiling_seconds
+        self._floor = min(floor_seconds, ceiling_seconds)
+        self._multiplier = multiplier
+        self._margin = margin_seconds
+        self._min_samples = max(1, min_samples)
+        self._window = max(self._min_samples, window)
+        self._samples: dict[tuple[str, int], deque[float]] = {}
+        self._timeouts: dict[tuple[str, int], float] = {}
+
+    def observe(self, model: str, prompt_chars: int, seconds: float) -> None:
+        key = (model, prompt_size_bucket(prompt_chars))
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self._window)
+        samples.append(max(0.0, seconds))
+        self._timeouts.pop(key, None)
+
+    def observe_timeout(self, model: str, prompt_chars: int, timeout_seconds: float) -> None:
+        # A timed-out call only tells us the latency exceeded the deadline; record
+        # it inflated so repeated timeouts widen the budget instead of pinning it.
+        self.observe(model, prompt_chars, min(self._ceiling, timeout_seconds * self._multiplier))
+
+    def timeout_for(self, model: str, prompt_chars: int) -> float:
+        key = (model, prompt_size_bucket(prompt_chars))
+        cached = self._timeouts.get(key)
+        if cached is not None:
+            return cached
+        samples = self._samples.get(key)
+        if samples is None or len(samples) < self._min_samples:
+            return self._ceiling
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        timeout = max(self._floor, min(self._ceiling, p95 * self._multiplier + self._margin))
+        self._timeouts[key] = timeout
+        return timeout
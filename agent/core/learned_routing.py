@@ -0,0 +1,370 @@
+"""
+Outcome-trained model routing.
+
+The heuristic `RoutingTable.select` sends every long or "and"-containing
+transcript to the complex model. This module learns, per (app, intent class),
+the cheapest and fastest model that has historically finished sessions
+successfully, from exported `/v1/telemetry` events:
+
+- `outcomes_from_telemetry` folds events into one `SessionOutcome` per session.
+- `train_policy` turns outcomes into a `LearnedPolicy` (a flat lookup table).
+- `shadow_report` compares a policy with the models that were actually used.
+- `LearnedRouter` is the online scorer: the shared policy scan plus two dict
+  lookups. In "shadow" mode it only counts how often it would have picked a
+  different model; in "on" mode its pick replaces the heuristic one.
+
+`tools/train_model_router.py` wraps training and the report for the command line.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass, field
+import json
+import math
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping
+
+from core.policy_matcher import compile_policy_matcher
+
+
+POLICY_FORMAT_VERSION = 1
+LEARNED_ROUTING_MODES = ("off", "shadow", "on")
+ANY_APP = "*"
+
+# Relative per-call price of each model family; unknown models are priced as mid-tier.
+MODEL_COST_UNITS: tuple[tuple[str, float], ...] = (("haiku", 1.0), ("sonnet", 3.0), ("opus", 15.0))
+DEFAULT_COST_UNITS = 3.0
+
+SESSION_OUTCOME_STATUSES = {"success": True, "failure": False}
+
+
+def classify_intent(transcript: str) -> str:
+    """Intent class from `INTENT_CLASS_TERMS` (see `core.policy_matcher`)."""
+    return compile_policy_matcher().scan(transcript).intent_class
+
+
+def model_cost_units(model: str) -> float:
+    lowered = model.lower()
+    for family, units in MODEL_COST_UNITS:
+        if family in lowered:
+            return units
+    return DEFAULT_COST_UNITS
+
+
+def _route_key(app: str, intent_class: str) -> str:
+    return f"{app}|{intent_class}"
+
+
+@dataclass(frozen=True, slots=True)
+class SessionOutcome:
+    app: str
+    intent_class: str
+    model: str
+    success: bool
+    replans: int = 0
+    # Mean provider planning latency over the session's cycles, when reported.
+    latency_ms: float | None = None
+
+
+@dataclass
+class _SessionAccumulator:
+    app: str | None = None
+    model: str | None = None
+    intent_class: str | None = None
+    latencies: list[int] = field(default_factory=list)
+    success: bool | None = None
+    replans: int = 0
+
+
+def outcomes_from_telemetry(events: Iterable[Mapping[str, Any]]) -> list[SessionOutcome]:
+    """
+    One outcome per session that ended in success or failure on a provider plan.
+
+    Sessions planned only by the fast path or deterministic fallback carry no
+    `model` and are skipped, as are canceled sessions.
+    """
+    sessions: dict[str, _SessionAccumulator] = {}
+    for event in events:
+        session_id = event.get("session_id")
+        if not session_id:
+            continue
+        acc = sessions.setdefault(session_id, _SessionAccumulator())
+        if event.get("app"):
+            acc.app = str(event["app"])
+        if event.get("model"):
+            acc.model = str(event["model"])
+        if event.get("intent_class"):
+            acc.intent_class = str(event["intent_class"])
+        stage = event.get("stage")
+        status = event.get("status")
+        if stage == "planning" and status == "completed" and event.get("latency_ms") is not None:
+            acc.latencies.append(int(event["latency_ms"]))
+        elif stage == "session" and status in SESSION_OUTCOME_STATUSES:
+            acc.success = SESSION_OUTCOME_STATUSES[status]
+            acc.replans = int(event.get("replan_count") or 0)
+
+    outcomes = []
+    for acc in sessions.values():
+        if acc.success is None or not acc.model or not acc.intent_class:
+            continue
+        outcomes.append(
+            SessionOutcome(
+                app=(acc.app or ANY_APP).lower(),
+                intent_class=acc.intent_class,
+                model=acc.model,
+                success=acc.success,
+                replans=acc.replans,
+                latency_ms=(sum(acc.latencies) / len(acc.latencies)) if acc.latencies else None,
+            )
+        )
+    return outcomes
+
+
+@dataclass
+class ArmStats:
+    """Aggregated outcomes of one model on one (app, intent class)."""
+
+    sessions: int = 0
+    successes: int = 0
+    replans: int = 0
+    latency_total_ms: float = 0.0
+    latency_samples: int = 0
+
+    def add(self, outcome: SessionOutcome) -> None:
+        self.sessions += 1
+        self.successes += int(outcome.success)
+        self.replans += outcome.replans
+        if outcome.latency_ms is not None:
+            self.latency_total_ms += outcome.latency_ms
+            self.latency_samples += 1
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.sessions if self.sessions else 0.0
+
+    @property
+    def success_lower_bound(self) -> float:
+        """Wilson score lower bound (95%), so a 2/2 arm does not outrank a 95/100 one."""
+        if not self.sessions:
+            return 0.0
+        z = 1.96
+        n = self.sessions
+        p = self.successes / n
+        centre = p + z * z / (2 * n)
+        margin = z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)
+        return (centre - margin) / (1 + z * z / n)
+
+    @property
+    def mean_replans(self) -> float:
+        return self.replans / self.sessions if self.sessions else 0.0
+
+    @property
+    def mean_latency_ms(self) -> float | None:
+        return self.latency_total_ms / self.latency_samples if self.latency_samples else None
+
+
+def aggregate_outcomes(outcomes: Iterable[SessionOutcome]) -> dict[tuple[str, str, str], ArmStats]:
+    """Stats keyed by (app, intent_class, model), plus an `ANY_APP` row per (intent_class, model)."""
+    arms: dict[tuple[str, str, str], ArmStats] = {}
+    for outcome in outcomes:
+        for app in (outcome.app, ANY_APP):
+            arms.setdefault((app, outcome.intent_class, outcome.model), ArmStats()).add(outcome)
+    return arms
+
+
+@dataclass(frozen=True, slots=True)
+class LearnedPolicy:
+    """Trained (app, intent class) -> model table; `ANY_APP` rows cover apps without their own."""
+
+    routes: Mapping[str, str]
+    trained_on: int = 0
+    version: int = POLICY_FORMAT_VERSION
+
+    def select(self, app_name: str | None, intent_class: str) -> str | None:
+        if app_name:
+            model = self.routes.get(_route_key(app_name.lower(), intent_class))
+            if model is not None:
+                return model
+        return self.routes.get(_route_key(ANY_APP, intent_class))
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"version": self.version, "trained_on": self.trained_on, "routes": dict(sorted(self.routes.items()))},
+            indent=2,
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> LearnedPolicy:
+        try:
+            payload = json.loads(raw)
+        except ValueError as exc:
+            raise ValueError(f"Invalid learned routing policy: {exc}") from exc
+        if not isinstance(payload, dict) or payload.get("version") != POLICY_FORMAT_VERSION:
+            raise ValueError(f"Learned routing policy must be a version {POLICY_FORMAT_VERSION} object.")
+        routes = payload.get("routes")
+        if not isinstance(routes, dict) or not all(
+            isinstance(key, str) and "|" in key and isinstance(model, str) and model for key, model in routes.items()
+        ):
+            raise ValueError('Learned routing policy "routes" must map "app|intent" keys to model names.')
+        return cls(routes=MappingProxyType(dict(routes)), trained_on=int(payload.get("trained_on") or 0))
+
+    @classmethod
+    def load(cls, path: Path) -> LearnedPolicy:
+        try:
+            raw = path.read_text(encoding="utf-8")
+        except OSError as exc:
+            raise ValueError(f"Cannot read learned routing policy: {exc}") from exc
+        return cls.from_json(raw)
+
+
+def _arm_score(model: str, stats: ArmStats, *, latency_weight: float) -> float:
+    # Replans cost another provider call each, so they scale the price.
+    latency_seconds = (stats.mean_latency_ms or 0.0) / 1000
+    return model_cost_units(model) * (1 + stats.mean_replans) + latency_weight * latency_seconds
+
+
+def train_policy(
+    outcomes: Iterable[SessionOutcome],
+    *,
+    min_sessions: int = 5,
+    success_tolerance: float = 0.05,
+    latency_weight: float = 1.0,
+) -> LearnedPolicy:
+    """
+    Pick, for every (app, intent class), the cheapest model among those whose
+    success lower bound is within `success_tolerance` of the best one.
+
+    Arms with fewer than `min_sessions` sessions are ignored. An app row that
+    would repeat its `ANY_APP` row is dropped to keep the table small.
+    """
+    outcomes = list(outcomes)
+    candidates: dict[tuple[str, str], list[tuple[str, ArmStats]]] = {}
+    for (app, intent_class, model), stats in aggregate_outcomes(outcomes).items():
+        if stats.sessions >= min_sessions:
+            candidates.setdefault((app, intent_class), []).append((model, stats))
+
+    chosen: dict[tuple[str, str], str] = {}
+    for key, arms in candidates.items():
+        best = max(stats.success_lower_bound for _, stats in arms)
+        eligible = [(model, stats) for model, stats in arms if stats.success_lower_bound >= best - success_tolerance]
+        chosen[key] = min(eligible, key=lambda arm: (_arm_score(arm[0], arm[1], latency_weight=latency_weight), arm[0]))[0]
+
+    routes = {
+        _route_key(app, intent_class): model
+        for (app, intent_class), model in chosen.items()
+        if app == ANY_APP or chosen.get((ANY_APP, intent_class)) != model
+    }
+    return LearnedPolicy(routes=MappingProxyType(routes), trained_on=len(outcomes))
+
+
+def shadow_report(policy: LearnedPolicy, outcomes: Iterable[SessionOutcome]) -> dict[str, Any]:
+    """
+    Compare `policy` with the models actually used on `outcomes` (ideally
+    sessions held out from training).
+
+    Policy success, latency and cost are estimated from the same outcomes'
+    per-model stats, so switches to a model never observed for that intent
+    class count as unestimated rather than as wins.
+    """
+    outcomes = list(outcomes)
+    arms = aggregate_outcomes(outcomes)
+    covered = agreements = estimated = 0
+    switches: Counter[str] = Counter()
+    observed = {"success": 0.0, "latency_ms": 0.0, "latency_samples": 0, "cost_units": 0.0}
+    learned = {"success": 0.0, "latency_ms": 0.0, "latency_samples": 0, "cost_units": 0.0}
+
+    for outcome in outcomes:
+        pick = policy.select(outcome.app, outcome.intent_class)
+        if pick is None:
+            continue
+        covered += 1
+        if pick == outcome.model:
+            agreements += 1
+        else:
+            switches[f"{outcome.model} -> {pick}"] += 1
+        stats = arms.get((outcome.app, outcome.intent_class, pick)) or arms.get((ANY_APP, outcome.intent_class, pick))
+        if stats is None:
+            continue
+        estimated += 1
+        observed["success"] += int(outcome.success)
+        observed["cost_units"] += model_cost_units(outcome.model) * (1 + outcome.replans)
+        learned["success"] += stats.success_rate
+        learned["cost_units"] += model_cost_units(pick) * (1 + stats.mean_replans)
+        if outcome.latency_ms is not None and stats.mean_latency_ms is not None:
+            observed["latency_ms"] += outcome.latency_ms
+            learned["latency_ms"] += stats.mean_latency_ms
+            observed["latency_samples"] += 1
+            learned["latency_samples"] += 1
+
+    def summary(totals: dict[str, float]) -> dict[str, float | None]:
+        samples = totals["latency_samples"]
+        return {
+            "success_rate": round(totals["success"] / estimated, 4) if estimated else None,
+            "mean_latency_ms": round(totals["latency_ms"] / samples, 1) if samples else None,
+            "mean_cost_units": round(totals["cost_units"] / estimated, 3) if estimated else None,
+        }
+
+    return {
+        "sessions": len(outcomes),
+        "covered": covered,
+        "agreement_rate": round(agreements / covered, 4) if covered else None,
+        "estimated": estimated,
+        "switches": dict(switches.most_common()),
+        "observed": summary(observed),
+        "policy": summary(learned),
+    }
+
+
+@dataclass
+class ShadowStats:
+    decisions: int = 0
+    agreements: int = 0
+    disagreements: int = 0
+    uncovered: int = 0
+    switches: Counter[str] = field(default_factory=Counter)
+
+
+class LearnedRouter:
+    """
+    Online scorer for a `LearnedPolicy`.
+
+    `route` returns the model to call: the learned pick in "on" mode when the
+    policy covers the request and the app has no explicit override, the
+    heuristic pick otherwise. Every decision is counted in `stats`, which is
+    what makes "shadow" mode useful before switching to "on".
+    """
+
+    def __init__(self, policy: LearnedPolicy, *, mode: str = "shadow") -> None:
+        if mode not in LEARNED_ROUTING_MODES:
+            raise ValueError(f"Learned routing mode must be one of {', '.join(LEARNED_ROUTING_MODES)}.")
+        self.policy = policy
+        self.mode = mode
+        self.stats = ShadowStats()
+
+    def route(
+        self,
+        transcript: str,
+        *,
+        app_name: str | None,
+        heuristic_model: str,
+        pinned: bool = False,
+        intent_class: str | None = None,
+    ) -> str:
+        if self.mode == "off":
+            return heuristic_model
+        pick = self.policy.select(app_name, intent_class or classify_intent(transcript))
+        stats = self.stats
+        stats.decisions += 1
+        if pick is None:
+            stats.uncovered += 1
+            return heuristic_model
+        if pick == heuristic_model:
+            stats.agreements += 1
+        else:
+            stats.disagreements += 1
+            stats.switches[f"{heuristic_model} -> {pick}"] += 1
+        if self.mode == "on" and not pinned:
+            return pick
+        return heuristic_model
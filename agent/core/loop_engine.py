@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+from typing import Literal
+
+from core.planner_service import PlannerService
+from core.schemas import (
+    ActionPlan,
+    LoopContext,
+    LoopResultMessage,
+    LoopStartMessage,
+    LoopStepMessage,
+    PlanRequest,
+    VerifyRequest,
+    VerifyResponse,
+)
+from core.session_store import SessionStateError, SessionStore
+from core.speculative_planner import SpeculativePlanner
+from core.verifier_service import VerifierService
+from macos_use_adapter.adapter import ProviderConfigurationError
+
+
+LoopPhase = Literal["idle", "executing", "done"]
+
+
+class LoopSession:
+    """
+    Sidecar-driven plan -> execute -> verify -> replan loop for one session.
+
+    The client only reports execution results; planning, verification and
+    loop bookkeeping happen in-process. With `speculate` set, the next
+    micro-step is prepared by the `SpeculativePlanner` while the client
+    executes the current plan.
+    """
+
+    def __init__(
+        self,
+        *,
+        session_id: str,
+        start: LoopStartMessage,
+        planner: PlannerService,
+        verifier: VerifierService,
+        sessions: SessionStore,
+        speculator: SpeculativePlanner | None = None,
+    ) -> None:
+        self.session_id = session_id
+        self.phase: LoopPhase = "idle"
+        self._planner = planner
+        self._verifier = verifier
+        self._sessions = sessions
+        self._transcript = start.transcript
+        self._app = start.app
+        self._ax_tree_summary = start.ax_tree_summary
+        self._speculator = speculator if start.speculate else None
+        self._loop_context = LoopContext(
+            goal_transcript=start.transcript,
+            cycle_index=0,
+            replan_count=0,
+            max_cycles=start.max_cycles,
+            max_replans=start.max_replans,
+        )
+        self._plan: ActionPlan | None = None
+        # Verified outcome whose replan hit a retry-after error; resending the
+        # result retries just the replan.
+        self._pending_replan: tuple[LoopContext, VerifyResponse] | None = None
+
+    @property
+    def loop_context(self) -> LoopContext:
+        return self._loop_context
+
+    async def start(self) -> LoopStepMessage:
+        if self.phase != "idle":
+            raise SessionStateError("Loop already started.", status_code=409, error_code="loop_already_started")
+        return await self._plan_step(self._loop_context, verification=None)
+
+    async def submit(self, result: LoopResultMessage) -> LoopStepMessage:
+        if self.phase != "executing" or self._plan is None:
+            raise SessionStateError("No actions are awaiting results.", status_code=409, error_code="loop_not_executing")
+        if result.plan_id and result.plan_id != self._plan.plan_id:
+            raise SessionStateError(
+                f"Result refers to plan '{result.plan_id}', expected '{self._plan.plan_id}'.",
+                status_code=409,
+                error_code="stale_plan_result",
+            )
+        if result.app is not None:
+            self._app = result.app
+        if result.ax_tree_summary is not None:
+            self._ax_tree_summary = result.ax_tree_summary
+        if self._pending_replan is not None:
+            next_context, verification = self._pending_replan
+            self._pending_replan = None
+            return await self._plan_step(next_context, verification=verification)
+
+        request = self._sessions.resolve_verify_request(
+            VerifyRequest(
+                session_id=self.session_id,
+                action_plan=self._plan,
+                execution_result=result.execution_result,
+                failed_action_id=result.failed_action_id,
+                completed_actions=result.completed_actions,
+                reason=result.reason,
+                before_context=result.before_context,
+                after_context=result.after_context,
+                loop_context=self._loop_context,
+            )
+        )
+        verification = self._verifier.verify(request)
+        self._sessions.record_verify(request, verification)
+        stored = self._sessions.get(self.session_id)
+        base = stored.loop_context if stored is not None and stored.loop_context is not None else self._loop_context
+        next_context = self._advance(base, verification)
+
+        exhausted = self._budget_exhausted(next_context)
+        if exhausted is not None:
+            self._discard_speculation()
+            self._loop_context = next_context
+            self.phase = "done"
+            return self._step("done", status="blocked", verification=verification, reason=exhausted)
+
+        prepared = None
+        if self._speculator is not None:
+            prepared = await self._speculator.take(self._plan_request(next_context))
+        return await self._plan_step(next_context, verification=verification, prepared=prepared)
+
+    def close(self) -> None:
+        self._discard_speculation()
+        self.phase = "done"
+
+    async def _plan_step(
+        self,
+        loop_context: LoopContext,
+        *,
+        verification: VerifyResponse | None,
+        prepared: ActionPlan | None = None,
+    ) -> LoopStepMessage:
+        self._loop_context = loop_context
+        request = self._plan_request(loop_context)
+        try:
+            plan = prepared or await self._planner.plan(request)
+        except ProviderConfigurationError as exc:
+            # A failed first plan can be retried with a new `start`. A replan
+            # rejected with a retry-after (rate limited, provider busy) stays
+            # executing so the client can resend its result; any other failed
+            # replan leaves the loop without actions, so it ends here.
+            if verification is None:
+                self.phase = "idle"
+            elif exc.retry_after is not None:
+                self._pending_replan = (loop_context, verification)
+            else:
+                self.phase = "done"
+            raise
+        self._sessions.record_plan(plan, loop_context)
+        self._plan = plan
+        if plan.goal_state != "in_progress":
+            self.phase = "done"
+            return self._step(
+                "done",
+                status=plan.goal_state,
+                plan=plan,
+                verification=verification,
+                reason=plan.planner_note or plan.summary,
+                speculative_hit=prepared is not None,
+            )
+
+        self.phase = "executing"
+        if self._speculator is not None:
+            self._speculator.prepare(plan, request)
+        return self._step("actions", plan=plan, verification=verification, speculative_hit=prepared is not None)
+
+    def _plan_request(self, loop_context: LoopContext) -> PlanRequest:
+        return PlanRequest(
+            session_id=self.session_id,
+            transcript=self._transcript,
+            app=self._app,
+            ax_tree_summary=self._ax_tree_summary,
+            loop_context=loop_context,
+        )
+
+    def _step(self, kind: Literal["actions", "done"], **fields) -> LoopStepMessage:
+        return LoopStepMessage(
+            type=kind,
+            session_id=self.session_id,
+            cycle_index=self._loop_context.cycle_index,
+            **fields,
+        )
+
+    @staticmethod
+    def _advance(loop_context: LoopContext, verification: VerifyResponse) -> LoopContext:
+        if verification.status == "success":
+            return loop_context.model_copy(
+                update={
+                    "cycle_index": loop_context.cycle_index + 1,
+                    "current_state": verification.state,
+                    "last_state": loop_context.current_state,
+                    "next_required_state": None,
+                }
+            )
+        return loop_context.model_copy(
+            update={
+                "cycle_index": loop_context.cycle_index + 1,
+                "replan_count": loop_context.replan_count + 1,
+                "next_required_state": verification.required_transition,
+            }
+        )
+
+    @staticmethod
+    def _budget_exhausted(loop_context: LoopContext) -> str | None:
+        if loop_context.cycle_index >= loop_context.max_cycles:
+            return f"Loop cycle budget exhausted ({loop_context.max_cycles} cycles)"
+        if loop_context.replan_count > loop_context.max_replans:
+            return f"Replan budget exhausted ({loop_context.max_replans} replans)"
+        return None
+
+    def _discard_speculation(self) -> None:
+        if self._speculator is not None:
+            self._speculator.discard(self.session_id)
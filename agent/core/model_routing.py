@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import time
+from types import MappingProxyType
+from typing import Callable, Mapping
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from core.policy_matcher import PolicyMatcher, compile_policy_matcher, normalize_term
+from macos_use_adapter.rules import COMPLEXITY_MARKERS
+
+
+DEFAULT_FALLBACK_MODELS = (
+    "claude-3-5-sonnet-latest",
+    "claude-3-5-haiku-latest",
+    "claude-3-5-sonnet-20241022",
+    "claude-3-5-haiku-20241022",
+    "claude-3-opus-20240229",
+    "claude-3-sonnet-20240229",
+    "claude-3-haiku-20240307",
+)
+DEFAULT_MAX_SIMPLE_WORDS = 10
+
+
+def parse_model_overrides(raw: str) -> dict[str, str]:
+    """Parse per-app model overrides in the ORANGE_MODEL_OVERRIDES form ("mail:model-a,slack:model-b")."""
+    result: dict[str, str] = {}
+    for part in raw.split(","):
+        item = part.strip()
+        if not item or ":" not in item:
+            continue
+        app, model = item.split(":", 1)
+        app_key = app.strip().lower()
+        model_value = model.strip()
+        if app_key and model_value:
+            result[app_key] = model_value
+    return result
+
+
+class ModelRoutingConfig(BaseModel):
+    """Routing config file. Omitted keys keep the environment defaults."""
+
+    model_config = ConfigDict(extra="forbid", protected_namespaces=())
+
+    model_simple: str | None = Field(default=None, min_length=1)
+    model_complex: str | None = Field(default=None, min_length=1)
+    app_overrides: dict[str, str] | None = None
+    max_simple_words: int | None = Field(default=None, ge=0)
+    complexity_markers: list[str] | None = None
+    fallbacks: list[str] | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class ModelRoute:
+    app: str | None
+    model: str
+    reason: str
+
+
+@dataclass(frozen=True, slots=True)
+class RoutingTable:
+    """Compiled, immutable model routing; swapped as a whole on reload."""
+
+    model_simple: str
+    model_complex: str
+    app_overrides: Mapping[str, str]
+    max_simple_words: int
+    complexity_markers: tuple[str, ...]
+    fallbacks: tuple[str, ...]
+    routes: tuple[ModelRoute, ...]
+    matcher: PolicyMatcher
+    version: int = 1
+    source: str = "env"
+
+    def override_for(self, app_name: str | None) -> str | None:
+        return self.app_overrides.get(app_name.lower()) if app_name else None
+
+    def select(self, transcript: str, *, app_name: str | None) -> str:
+        override = self.override_for(app_name)
+        if override:
+            return override
+        hits = self.matcher.scan(transcript)
+        is_complex = hits.word_count > self.max_simple_words or bool(hits.complexity)
+        return self.model_complex if is_complex else self.model_simple
+
+    def candidates(self, primary_model: str) -> list[str]:
+        """`primary_model` followed by the fallbacks, without duplicates."""
+        return list(dict.fromkeys((primary_model, *self.fallbacks)))
+
+
+def compile_routing_table(
+    *,
+    model_simple: str,
+    model_complex: str,
+    app_overrides: Mapping[str, str],
+    max_simple_words: int = DEFAULT_MAX_SIMPLE_WORDS,
+    complexity_markers: tuple[str, ...] = COMPLEXITY_MARKERS,
+    fallbacks: tuple[str, ...] = DEFAULT_FALLBACK_MODELS,
+    version: int = 1,
+    source: str = "env",
+) -> RoutingTable:
+    overrides = {app.strip().lower(): model.strip() for app, model in app_overrides.items() if app.strip() and model.strip()}
+    markers = tuple(dict.fromkeys(marker for marker in map(normalize_term, complexity_markers) if marker))
+    routes = (
+        ModelRoute(app=None, model=model_simple, reason="Default model for short/simple tasks"),
+        ModelRoute(app=None, model=model_complex, reason="Default model for complex multi-step tasks"),
+        *(ModelRoute(app=app, model=model, reason="App-specific override") for app, model in overrides.items()),
+    )
+    return RoutingTable(
+        model_simple=model_simple,
+        model_complex=model_complex,
+        app_overrides=MappingProxyType(overrides),
+        max_simple_words=max_simple_words,
+        complexity_markers=markers,
+        fallbacks=tuple(fallbacks),
+        routes=routes,
+        matcher=compile_policy_matcher(markers),
+        version=version,
+        source=source,
+    )
+
+
+class ModelRouter:
+    """
+    Holds the current `RoutingTable` and swaps it atomically on reload.
+
+    The base table comes from the environment. When `config_path` is set, the
+    file's keys are layered on top of it; `current()` re-checks the file's
+    mtime at most every `poll_seconds` and swaps in the recompiled table when
+    it changed. A config that fails to load leaves the previous table in place
+    (and is reported through `last_error`).
+    """
+
+    def __init__(
+        self,
+        base: RoutingTable,
+        *,
+        config_path: Path | None = None,
+        poll_seconds: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._base = base
+        self._table = base
+        self._config_path = config_path
+        self._poll_seconds = max(0.0, poll_seconds)
+        self._clock = clock
+        self._next_check = 0.0
+        self._loaded_mtime_ns: int | None = None
+        self.last_error: str | None = None
+        if config_path is not None:
+            self._reload_if_changed()
+
+    @property
+    def config_path(self) -> Path | None:
+        return self._config_path
+
+    def current(self) -> RoutingTable:
+        if self._config_path is not None and self._clock() >= self._next_check:
+            self._reload_if_changed()
+        return self._table
+
+    def reload(self) -> RoutingTable:
+        """Recompile from the config file now. Raises ValueError if it cannot be loaded."""
+        if self._config_path is None:
+            raise ValueError("No model routing file is configured (set ORANGE_MODEL_ROUTING_FILE).")
+        try:
+            mtime_ns = self._config_path.stat().st_mtime_ns
+            raw = self._config_path.read_text(encoding="utf-8")
+        except OSError as exc:
+            raise ValueError(f"Cannot read model routing file: {exc}") from exc
+        self._swap(self._compile_file(raw), mtime_ns)
+        return self._table
+
+    def _reload_if_changed(self) -> None:
+        self._next_check = self._clock() + self._poll_seconds
+        try:
+            mtime_ns = self._config_path.stat().st_mtime_ns  # type: ignore[union-attr]
+        except OSError:
+            return
+        if mtime_ns == self._loaded_mtime_ns:
+            return
+        try:
+            self.reload()
+        except ValueError as exc:
+            # Do not retry the same broken file until it changes again.
+            self._loaded_mtime_ns = mtime_ns
+            self.last_error = str(exc)
+
+    def _compile_file(self, raw: str) -> RoutingTable:
+        try:
+            config = ModelRoutingConfig.model_validate(json.loads(raw))
+        except (ValueError, ValidationError) as exc:
+            raise ValueError(f"Invalid model routing file: {exc}") from exc
+        base = self._base
+        return compile_routing_table(
+            model_simple=config.model_simple or base.model_simple,
+            model_complex=config.model_complex or base.model_complex,
+            app_overrides=config.app_overrides if config.app_overrides is not None else base.app_overrides,
+            max_simple_words=config.max_simple_words if config.max_simple_words is not None else base.max_simple_words,
+            complexity_markers=(
+                tuple(config.complexity_markers) if config.complexity_markers is not None else base.complexity_markers
+            ),
+            fallbacks=tuple(config.fallbacks) if config.fallbacks is not None else base.fallbacks,
+            version=self._table.version + 1,
+            source=str(self._config_path),
+        )
+
+    def _swap(self, table: RoutingTable, mtime_ns: int) -> None:
+        self._table = table
+        self._loaded_mtime_ns = mtime_ns
+        self.last_error = None
@@ -1,12 +1,21 @@
 from __future__ import annotations
 
+from collections import OrderedDict
+import uuid
+
 from core.config import SCHEMA_VERSION_CURRENT, settings
 from core.event_bus import EventBus
+from core.policy_matcher import PolicyHits, compile_policy_matcher
+from core.rate_limiter import AdmissionRejected, PlanAdmissionController
+from core.screenshots import PreparedScreenshot
+from core.single_flight import SingleFlight, canonical_key
 from core.schemas import (
     Action,
     ActionPlan,
+    LearnedRoutingStatus,
     ModelInfo,
     ModelsResponse,
+    PlannerOutputModeStats,
     ProviderStatusResponse,
     ProviderValidationRequest,
     ProviderValidationResponse,
@@ -15,20 +24,46 @@ from core.schemas import (
     PlanSimulationResponse,
     StreamEvent,
 )
-from macos_use_adapter.adapter import MacOSUseAdapter
+from macos_use_adapter.adapter import (
+    AdapterResult,
+    MacOSUseAdapter,
+    ProviderConfigurationError,
+    ProviderDeadlineExceeded,
+)
+from macos_use_adapter.fast_path import LOOP_BATCH_SIZE
 
 
 RISKY_ACTIONS = {"run_applescript"}
 RISKY_KEY_COMBOS = {"enter"}
-HIGH_RISK_TERMS = {"send", "delete", "purchase", "buy", "post", "submit"}
+# Fields that differ between otherwise identical plan requests and do not
+# influence adapter output.
+COALESCE_EXCLUDED_FIELDS = {
+    "schema_version": True,
+    "session_id": True,
+    "screenshot_base64": True,
+    "loop_context": {"remaining_budget_ms"},
+}
 
 
 class PlannerService:
     def __init__(self, event_bus: EventBus, adapter: MacOSUseAdapter | None = None) -> None:
         self._event_bus = event_bus
         self._adapter = adapter or MacOSUseAdapter()
+        self._admission = PlanAdmissionController(
+            session_rate_per_minute=settings.plan_session_rate_per_minute,
+            session_burst=settings.plan_session_burst,
+            global_rate_per_minute=settings.plan_global_rate_per_minute,
+            global_burst=settings.plan_global_burst,
+        )
+        self._plan_flights: SingleFlight[AdapterResult] = SingleFlight()
+        # Session -> fast-path rule that planned its loop's cycle 0. Only those
+        # loops may be continued by the fast path on later cycles.
+        self._fast_path_loops: OrderedDict[str, str] = OrderedDict()
+        # Same instance as the default routing table's, so its scan is reused.
+        self._policy = compile_policy_matcher()
 
-    async def plan(self, request: PlanRequest) -> ActionPlan:
+    async def plan(self, request: PlanRequest, *, screenshot: PreparedScreenshot | None = None) -> ActionPlan:
+        self._admit(request.session_id)
         await self._event_bus.publish(
             StreamEvent(
                 session_id=request.session_id,
@@ -59,15 +94,54 @@ class PlannerService:
                     )
                 )
 
-        adapter_result = await self._adapter.plan_actions(
-            transcript=request.transcript,
-            active_app_name=(request.app.name if request.app else None),
-            _ax_tree_summary=request.ax_tree_summary,
-            loop_context=request.loop_context,
-        )
+        fast_path_intent = self._fast_path_loop_intent(request)
+        try:
+            adapter_result, coalesced = await self._plan_flights.do(
+                self._coalesce_key(request, fast_path_intent),
+                lambda: self._adapter.plan_actions(
+                    transcript=request.transcript,
+                    active_app_name=(request.app.name if request.app else None),
+                    _ax_tree_summary=request.ax_tree_summary,
+                    loop_context=request.loop_context,
+                    screenshot=screenshot if settings.planner_vision else None,
+                    fast_path_intent=fast_path_intent,
+                ),
+            )
+        except ProviderDeadlineExceeded as exc:
+            await self._event_bus.publish(
+                StreamEvent(
+                    session_id=request.session_id,
+                    event="planning_deadline_exceeded",
+                    message=str(exc),
+                    progress=40,
+                    severity="warning",
+                )
+            )
+            raise
+        self._record_fast_path_loop(request, adapter_result)
+        if adapter_result.source == "fast_path":
+            await self._event_bus.publish(
+                StreamEvent(
+                    session_id=request.session_id,
+                    event="planning_fast_path",
+                    message=adapter_result.planner_note or "Planned locally",
+                    progress=30,
+                    severity="info",
+                )
+            )
+        if coalesced:
+            await self._event_bus.publish(
+                StreamEvent(
+                    session_id=request.session_id,
+                    event="planning_coalesced",
+                    message="Joined an identical in-flight planning request",
+                    progress=30,
+                    severity="info",
+                )
+            )
         actions = adapter_result.actions
-        if request.loop_context is not None and len(actions) > 3:
-            actions = actions[:3]
+        if request.loop_context is not None and len(actions) > LOOP_BATCH_SIZE:
+            actions = actions[:LOOP_BATCH_SIZE]
             await self._event_bus.publish(
                 StreamEvent(
                     session_id=request.session_id,
@@ -99,11 +173,13 @@ class PlannerService:
             )
         )
 
-        risk_level, requires_confirmation = self._compute_risk(actions, transcript=request.transcript)
+        policy_hits = self._policy.scan(request.transcript)
+        risk_level, requires_confirmation = self._compute_risk(actions, policy_hits=policy_hits)
 
         plan = ActionPlan(
             schema_version=SCHEMA_VERSION_CURRENT,
             session_id=request.session_id,
+            plan_id=uuid.uuid4().hex[:16],
             actions=actions,
             confidence=adapter_result.confidence,
             risk_level=risk_level,
@@ -111,6 +187,9 @@ class PlannerService:
             summary=adapter_result.summary if not getattr(adapter_result, "recovery_guidance", None) else f"{adapter_result.summary}. {adapter_result.recovery_guidance}",
             goal_state=adapter_result.goal_state,  # type: ignore[arg-type]
             planner_note=adapter_result.planner_note,
+            model=adapter_result.model,
+            provider_latency_ms=adapter_result.latency_ms,
+            intent_class=policy_hits.intent_class,
         )
 
         if plan.goal_state == "complete":
@@ -146,13 +225,16 @@ class PlannerService:
         return plan
 
     async def simulate(self, request: PlanSimulationRequest) -> PlanSimulationResponse:
+        self._admit(request.session_id)
         adapter_result = await self._adapter.plan_actions(
             transcript=request.transcript,
             active_app_name=(request.app.name if request.app else None),
             _ax_tree_summary=None,
             loop_context=None,
         )
-        risk_level, requires_confirmation = self._compute_risk(adapter_result.actions, transcript=request.transcript)
+        risk_level, requires_confirmation = self._compute_risk(
+            adapter_result.actions, policy_hits=self._policy.scan(request.transcript)
+        )
         warnings = getattr(adapter_result, "warnings", [])
         recovery_guidance = getattr(adapter_result, "recovery_guidance", None)
         return PlanSimulationResponse(
@@ -177,33 +259,112 @@ class PlannerService:
         )
 
     def provider_status(self) -> ProviderStatusResponse:
+        breaker = self._adapter.breaker
+        fast_path = self._adapter.fast_path
+        circuit_state = breaker.state
+        routing = self._adapter.router.current()
         return ProviderStatusResponse(
             provider="anthropic",
             key_configured=self._adapter.current_api_key() is not None,
-            model_simple=settings.model_simple,
-            model_complex=settings.model_complex,
-            health=True,
+            model_simple=routing.model_simple,
+            model_complex=routing.model_complex,
+            health=circuit_state != "open",
+            circuit_state=circuit_state,
+            circuit_retry_after_seconds=breaker.retry_after(),
+            last_provider_failure=breaker.last_failure,
+            fast_path_hits=dict(fast_path.hits),
+            provider_calls=fast_path.provider_calls,
+            provider_calls_saved_ratio=round(fast_path.saved_ratio, 4),
+            planner_output_mode=settings.planner_output_mode,
+            output_modes={
+                mode: PlannerOutputModeStats(
+                    requests=stats.requests,
+                    parse_failures=stats.parse_failures,
+                    parse_failure_rate=round(stats.parse_failures / stats.requests, 4) if stats.requests else 0.0,
+                    avg_latency_ms=round(stats.total_latency_seconds * 1000 / stats.requests) if stats.requests else None,
+                )
+                for mode, stats in self._adapter.output_mode_stats.items()
+            },
+            learned_routing=self._learned_routing_status(),
+        )
+
+    def _learned_routing_status(self) -> LearnedRoutingStatus | None:
+        router = self._adapter.learned_router
+        if router is None:
+            error = self._adapter.learned_routing_error
+            return LearnedRoutingStatus(mode="off", error=error) if error else None
+        stats = router.stats
+        return LearnedRoutingStatus(
+            mode=router.mode,
+            policy_routes=len(router.policy.routes),
+            trained_on=router.policy.trained_on,
+            decisions=stats.decisions,
+            agreements=stats.agreements,
+            disagreements=stats.disagreements,
+            uncovered=stats.uncovered,
+            switches=dict(stats.switches),
         )
 
     def models(self) -> ModelsResponse:
-        routing: list[ModelInfo] = [
-            ModelInfo(app=None, model=settings.model_simple, reason="Default model for short/simple tasks"),
-            ModelInfo(app=None, model=settings.model_complex, reason="Default model for complex multi-step tasks"),
-        ]
-        for app, model in settings.model_overrides.items():
-            routing.append(ModelInfo(app=app, model=model, reason="App-specific override"))
+        router = self._adapter.router
+        table = router.current()
         return ModelsResponse(
             schema_version=SCHEMA_VERSION_CURRENT,
-            routing=routing,
+            routing=[ModelInfo(app=route.app, model=route.model, reason=route.reason) for route in table.routes],
             feature_flags={
                 "enable_remote_llm": "true" if settings.enable_remote_llm else "false",
                 "safety_strictness": settings.safety_strictness,
                 "provider": settings.provider,
             },
+            routing_version=table.version,
+            routing_source=table.source,
+            routing_error=router.last_error,
         )
 
+    def reload_models(self) -> ModelsResponse:
+        try:
+            self._adapter.router.reload()
+        except ValueError as exc:
+            raise ProviderConfigurationError(str(exc), status_code=400, error_code="invalid_routing_config") from exc
+        return self.models()
+
+    @staticmethod
+    def _coalesce_key(request: PlanRequest, fast_path_intent: str | None = None) -> str:
+        key = canonical_key(request.model_dump(mode="json", exclude=COALESCE_EXCLUDED_FIELDS))
+        # Loops continued by the fast path plan differently from identical provider-led ones.
+        return key if fast_path_intent is None else f"{key}|fast_path:{fast_path_intent}"
+
+    def _fast_path_loop_intent(self, request: PlanRequest) -> str | None:
+        if request.loop_context is None or request.loop_context.cycle_index == 0:
+            return None
+        return self._fast_path_loops.get(request.session_id)
+
+    def _record_fast_path_loop(self, request: PlanRequest, adapter_result: AdapterResult) -> None:
+        if request.loop_context is None:
+            return
+        intent = getattr(adapter_result, "fast_path_intent", None)
+        if request.loop_context.cycle_index == 0 and intent is not None:
+            self._fast_path_loops[request.session_id] = intent
+            self._fast_path_loops.move_to_end(request.session_id)
+            while len(self._fast_path_loops) > settings.session_max_count:
+                self._fast_path_loops.popitem(last=False)
+        elif intent is None:
+            # The provider took over; the fast path's batch offsets no longer apply.
+            self._fast_path_loops.pop(request.session_id, None)
+
+    def _admit(self, session_id: str) -> None:
+        try:
+            self._admission.admit(session_id)
+        except AdmissionRejected as exc:
+            raise ProviderConfigurationError(
+                str(exc),
+                status_code=429,
+                error_code="rate_limited",
+                retry_after=exc.retry_after,
+            ) from exc
+
     @staticmethod
-    def _compute_risk(actions: list[Action], *, transcript: str) -> tuple[str, bool]:
+    def _compute_risk(actions: list[Action], *, policy_hits: PolicyHits) -> tuple[str, bool]:
         high = False
         medium = False
         for action in actions:
@@ -215,11 +376,10 @@ class PlannerService:
                 continue
             if action.kind == "key_combo" and (action.key_combo or "").lower() in RISKY_KEY_COMBOS:
                 medium = True
-        lowered = transcript.lower()
-        if any(term in lowered for term in HIGH_RISK_TERMS):
+        strictness = settings.safety_strictness.lower()
+        if policy_hits.risk_terms(strictness):
             medium = True
 
-        strictness = settings.safety_strictness.lower()
         if strictness == "strict" and medium:
             high = True
 
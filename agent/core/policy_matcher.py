@@ -0,0 +1,130 @@
+"""
+Single-pass transcript policy matching.
+
+Risk scoring, model routing and intent classification each used to lowercase
+the transcript and run their own substring or regex checks, so "send" also
+matched "sender" and "after" matched "afternoon". `PolicyMatcher` compiles
+every policy term into one word-level lookup table and reports all risk,
+complexity and intent hits from a single tokenizing scan. Scans are memoized per
+transcript, so the planner, the router and risk scoring share one pass.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+import re
+
+from macos_use_adapter.rules import (
+    COMPLEXITY_MARKERS,
+    DEFAULT_INTENT_CLASS,
+    INTENT_CLASS_TERMS,
+    RISK_TERMS,
+    STRICT_RISK_TERMS,
+)
+
+
+_RISK = "risk"
+_STRICT_RISK = "strict_risk"
+_COMPLEXITY = "complexity"
+_INTENT_PREFIX = "intent:"
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(_WORD_RE.findall(term.lower()))
+
+
+@dataclass(frozen=True, slots=True)
+class PolicyHits:
+    """Distinct matched terms per category (sorted), and intent classes in priority order."""
+
+    risk: tuple[str, ...] = ()
+    strict_risk: tuple[str, ...] = ()
+    complexity: tuple[str, ...] = ()
+    intents: tuple[str, ...] = ()
+    word_count: int = 0
+
+    @property
+    def intent_class(self) -> str:
+        return self.intents[0] if self.intents else DEFAULT_INTENT_CLASS
+
+    def risk_terms(self, strictness: str) -> tuple[str, ...]:
+        return self.risk + self.strict_risk if strictness.lower() == "strict" else self.risk
+
+
+class PolicyMatcher:
+    """
+    Word-level automaton over all policy terms.
+
+    A scan tokenizes the transcript once and intersects its words with the
+    first words of every term (a C-level set operation). Only terms whose
+    first word is present are checked further; multi-word terms are then
+    confirmed against the space-joined words, so "look  up" and "Look up"
+    both match "look up". Terms are whole words by construction.
+    """
+
+    def __init__(
+        self,
+        *,
+        risk_terms: tuple[str, ...] = RISK_TERMS,
+        strict_risk_terms: tuple[str, ...] = STRICT_RISK_TERMS,
+        complexity_terms: tuple[str, ...] = COMPLEXITY_MARKERS,
+        intent_terms: tuple[tuple[str, tuple[str, ...]], ...] = INTENT_CLASS_TERMS,
+        cache_size: int = 256,
+    ) -> None:
+        groups: list[tuple[str, tuple[str, ...]]] = [
+            (_RISK, risk_terms),
+            (_STRICT_RISK, strict_risk_terms),
+            (_COMPLEXITY, complexity_terms),
+            *((f"{_INTENT_PREFIX}{name}", terms) for name, terms in intent_terms),
+        ]
+        categories: dict[str, set[str]] = {}
+        for category, terms in groups:
+            for term in terms:
+                normalized = normalize_term(term)
+                if normalized:
+                    categories.setdefault(normalized, set()).add(category)
+
+        self._intent_order = tuple(name for name, _ in intent_terms)
+        self._categories = {term: frozenset(found) for term, found in categories.items()}
+        by_first_word: dict[str, list[str]] = {}
+        for term in self._categories:
+            by_first_word.setdefault(term.split(" ", 1)[0], []).append(term)
+        self._terms_by_first_word = {word: tuple(terms) for word, terms in by_first_word.items()}
+        self._first_words = frozenset(self._terms_by_first_word)
+        self.scan = lru_cache(maxsize=cache_size)(self._scan)
+
+    def _scan(self, transcript: str) -> PolicyHits:
+        words = _WORD_RE.findall(transcript.lower())
+        joined: str | None = None
+        found: dict[str, set[str]] = {}
+        for word in self._first_words.intersection(words):
+            for term in self._terms_by_first_word[word]:
+                if term != word:
+                    if joined is None:
+                        joined = f" {' '.join(words)} "
+                    if f" {term} " not in joined:
+                        continue
+                for category in self._categories[term]:
+                    found.setdefault(category, set()).add(term)
+        return PolicyHits(
+            risk=tuple(sorted(found.get(_RISK, ()))),
+            strict_risk=tuple(sorted(found.get(_STRICT_RISK, ()))),
+            complexity=tuple(sorted(found.get(_COMPLEXITY, ()))),
+            intents=tuple(name for name in self._intent_order if f"{_INTENT_PREFIX}{name}" in found),
+            # Whitespace-separated, as the routing word limit has always counted.
+            word_count=len(transcript.split()),
+        )
+
+
+def compile_policy_matcher(complexity_terms: tuple[str, ...] = COMPLEXITY_MARKERS) -> PolicyMatcher:
+    """Shared matcher per complexity term set, so routing tables with the same terms share scans."""
+    return _shared_matcher(tuple(dict.fromkeys(term for term in map(normalize_term, complexity_terms) if term)))
+
+
+@lru_cache(maxsize=8)
+def _shared_matcher(complexity_terms: tuple[str, ...]) -> PolicyMatcher:
+    return PolicyMatcher(complexity_terms=complexity_terms)
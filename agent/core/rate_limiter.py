@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import time
+from typing import AsyncIterator
+
+
+class AdmissionRejected(RuntimeError):
+    def __init__(self, message: str, *, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket; `rate` is tokens per second, `capacity` the burst size."""
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated_at")
+
+    def __init__(self, *, rate: float, capacity: int) -> None:
+        self.rate = max(rate, 1e-9)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def try_acquire(self, now: float | None = None) -> float:
+        """Take one token. Returns 0.0 on success, otherwise seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+    def refund(self) -> None:
+        self._tokens = min(self.capacity, self._tokens + 1.0)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= self.capacity
+
+
+class PlanAdmissionController:
+    """Per-session and global token buckets guarding planner entry points."""
+
+    def __init__(
+        self,
+        *,
+        session_rate_per_minute: float,
+        session_burst: int,
+        global_rate_per_minute: float,
+        global_burst: int,
+        max_tracked_sessions: int = 1_024,
+    ) -> None:
+        self._session_rate = session_rate_per_minute / 60.0
+        self._session_burst = session_burst
+        self._global = TokenBucket(rate=global_rate_per_minute / 60.0, capacity=global_burst)
+        self._sessions: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._max_tracked_sessions = max_tracked_sessions
+
+    def admit(self, session_id: str) -> None:
+        now = time.monotonic()
+        bucket = self._session_bucket(session_id, now)
+        wait = bucket.try_acquire(now)
+        if wait > 0:
+            raise AdmissionRejected(
+                "Too many planning requests for this session; slow down.",
+                retry_after=wait,
+            )
+        wait = self._global.try_acquire(now)
+        if wait > 0:
+            bucket.refund()
+            raise AdmissionRejected(
+                "Planner is handling too many requests; retry shortly.",
+                retry_after=wait,
+            )
+
+    def _session_bucket(self, session_id: str, now: float) -> TokenBucket:
+        bucket = self._sessions.get(session_id)
+        if bucket is not None:
+            self._sessions.move_to_end(session_id)
+            return bucket
+        if len(self._sessions) >= self._max_tracked_sessions:
+            # Full buckets carry no state worth keeping; drop the oldest of them first.
+            idle = [key for key, value in self._sessions.items() if value.is_full(now)]
+            for key in idle[: max(1, len(idle) // 2)]:
+                del self._sessions[key]
+            while len(self._sessions) >= self._max_tracked_sessions:
+                self._sessions.popitem(last=False)
+        bucket = TokenBucket(rate=self._session_rate, capacity=self._session_burst)
+        self._sessions[session_id] = bucket
+        return bucket
+
+
+class ConcurrencyLimiter:
+    """Bounded concurrency with a bounded wait queue for outbound provider calls."""
+
+    def __init__(self, *, max_concurrency: int, max_waiters: int, wait_timeout: float) -> None:
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._max_waiters = max(0, max_waiters)
+        self._wait_timeout = wait_timeout
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._semaphore.locked() and self._waiting >= self._max_waiters:
+            raise AdmissionRejected("Provider call queue is full; retry shortly.", retry_after=1.0)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self._wait_timeout)
+        except TimeoutError as exc:
+            raise AdmissionRejected(
+                "Timed out waiting for a provider call slot.",
+                retry_after=1.0,
+            ) from exc
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Literal
 
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 
 from .config import SCHEMA_VERSION_CURRENT, SCHEMA_VERSION_MIN
 
@@ -34,6 +34,7 @@ LoopState = Literal[
 ]
 EventSeverity = Literal["info", "warning", "error"]
 ProviderName = Literal["anthropic"]
+CircuitState = Literal["closed", "open", "half_open"]
 
 
 class AppMetadata(BaseModel):
@@ -51,6 +52,7 @@ class PlannerPreferences(BaseModel):
     preferred_model: str | None = None
     locale: str | None = None
     low_latency: bool = True
+    speculative_next_step: bool = False
 
 
 class LoopActionOutcome(BaseModel):
@@ -77,6 +79,26 @@ class LoopContext(BaseModel):
     last_verify_status: str | None = None
     last_verify_reason: str | None = None
     recent_action_results: list[LoopActionOutcome] = Field(default_factory=list)
+    remaining_budget_ms: int | None = Field(default=None, ge=0)
+
+
+class LoopContextDelta(BaseModel):
+    """Partial loop context merged into the sidecar's stored session state."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    goal_transcript: str | None = Field(default=None, min_length=1, max_length=4000)
+    cycle_index: int | None = Field(default=None, ge=0, le=100)
+    replan_count: int | None = Field(default=None, ge=0, le=100)
+    max_cycles: int | None = Field(default=None, ge=1, le=100)
+    max_replans: int | None = Field(default=None, ge=0, le=100)
+    current_state: LoopState | None = None
+    next_required_state: LoopState | None = None
+    last_state: LoopState | None = None
+    last_verify_status: str | None = None
+    last_verify_reason: str | None = None
+    append_action_results: list[LoopActionOutcome] = Field(default_factory=list)
+    remaining_budget_ms: int | None = Field(default=None, ge=0)
 
 
 class Action(BaseModel):
@@ -98,6 +120,7 @@ class ActionPlan(BaseModel):
 
     schema_version: int = SCHEMA_VERSION_CURRENT
     session_id: str = Field(min_length=1)
+    plan_id: str | None = None
     actions: list[Action] = Field(default_factory=list)
     confidence: float = Field(ge=0.0, le=1.0)
     risk_level: RiskLevel
@@ -105,6 +128,10 @@ class ActionPlan(BaseModel):
     summary: str | None = None
     goal_state: GoalState = "in_progress"
     planner_note: str | None = None
+    # Provider model that produced the plan (None for fast-path and local plans).
+    model: str | None = None
+    provider_latency_ms: int | None = Field(default=None, ge=0)
+    intent_class: str | None = None
 
 
 class PlanRequest(BaseModel):
@@ -114,8 +141,11 @@ class PlanRequest(BaseModel):
     session_id: str = Field(min_length=1)
     transcript: str = Field(min_length=1, max_length=4000)
     screenshot_base64: str | None = None
+    # Id returned by `PUT /v1/screenshots/{session_id}`; preferred over screenshot_base64.
+    screenshot_id: str | None = None
     ax_tree_summary: str | None = None
     loop_context: LoopContext | None = None
+    loop_context_delta: LoopContextDelta | None = None
     app: AppMetadata | None = None
     preferences: PlannerPreferences | None = None
 
@@ -167,7 +197,8 @@ class VerifyRequest(BaseModel):
 
     schema_version: int = SCHEMA_VERSION_CURRENT
     session_id: str = Field(min_length=1)
-    action_plan: ActionPlan
+    action_plan: ActionPlan | None = None
+    plan_id: str | None = None
     execution_result: ExecutionStatus
     failed_action_id: str | None = None
     completed_actions: list[str] = Field(default_factory=list)
@@ -185,6 +216,28 @@ class VerifyRequest(BaseModel):
             )
         return value
 
+    @model_validator(mode="after")
+    def plan_or_reference(self) -> VerifyRequest:
+        if self.action_plan is None and not self.plan_id:
+            raise ValueError("Either action_plan or plan_id is required")
+        return self
+
+
+class VerifyBatchRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    schema_version: int = SCHEMA_VERSION_CURRENT
+    requests: list[VerifyRequest] = Field(min_length=1, max_length=500)
+
+    @field_validator("schema_version")
+    @classmethod
+    def schema_version_supported(cls, value: int) -> int:
+        if value < SCHEMA_VERSION_MIN or value > SCHEMA_VERSION_CURRENT:
+            raise ValueError(
+                f"Unsupported schema_version={value}; supported=[{SCHEMA_VERSION_MIN}, {SCHEMA_VERSION_CURRENT}]"
+            )
+        return value
+
 
 class VerifyResponse(BaseModel):
     model_config = ConfigDict(extra="forbid")
@@ -200,6 +253,56 @@ class VerifyResponse(BaseModel):
     corrective_actions: list[Action] = Field(default_factory=list)
 
 
+class VerifyBatchResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    schema_version: int = SCHEMA_VERSION_CURRENT
+    results: list[VerifyResponse]
+    failures: int = 0
+
+
+class LoopStartMessage(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    type: Literal["start"]
+    transcript: str = Field(min_length=1, max_length=4000)
+    app: AppMetadata | None = None
+    ax_tree_summary: str | None = None
+    max_cycles: int = Field(default=8, ge=1, le=100)
+    max_replans: int = Field(default=3, ge=0, le=100)
+    speculate: bool = True
+
+
+class LoopResultMessage(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    type: Literal["result"]
+    plan_id: str | None = None
+    execution_result: ExecutionStatus
+    failed_action_id: str | None = None
+    completed_actions: list[str] = Field(default_factory=list)
+    reason: str | None = None
+    before_context: str | None = None
+    after_context: str | None = None
+    ax_tree_summary: str | None = None
+    app: AppMetadata | None = None
+
+
+class LoopStepMessage(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    type: Literal["actions", "done", "error"]
+    session_id: str
+    cycle_index: int = 0
+    status: GoalState = "in_progress"
+    plan: ActionPlan | None = None
+    verification: VerifyResponse | None = None
+    reason: str | None = None
+    error_code: str | None = None
+    retry_after: float | None = None
+    speculative_hit: bool = False
+
+
 class StreamEvent(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
@@ -226,6 +329,9 @@ class ModelsResponse(BaseModel):
     schema_version: int = SCHEMA_VERSION_CURRENT
     routing: list[ModelInfo]
     feature_flags: dict[str, str]
+    routing_version: int = 1
+    routing_source: str = "env"
+    routing_error: str | None = None
 
 
 class TelemetryEvent(BaseModel):
@@ -247,6 +353,21 @@ class TelemetryEvent(BaseModel):
     action_fingerprint: str | None = None
     fingerprint_repeat_count: int | None = Field(default=None, ge=0)
     reason_no_progress: str | None = None
+    model: str | None = None
+    intent_class: str | None = None
+
+
+class ScreenshotUploadResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    session_id: str
+    screenshot_id: str
+    width: int
+    height: int
+    bytes: int
+    source_bytes: int
+    # The upload was byte-identical to the session's previous one, whose id is returned.
+    duplicate: bool = False
 
 
 class ProviderValidationRequest(BaseModel):
@@ -265,6 +386,29 @@ class ProviderValidationResponse(BaseModel):
     account_hint: str | None = None
 
 
+class PlannerOutputModeStats(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    requests: int = 0
+    parse_failures: int = 0
+    parse_failure_rate: float = Field(default=0.0, ge=0.0, le=1.0)
+    avg_latency_ms: int | None = None
+
+
+class LearnedRoutingStatus(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    mode: str
+    policy_routes: int = 0
+    trained_on: int = 0
+    decisions: int = 0
+    agreements: int = 0
+    disagreements: int = 0
+    uncovered: int = 0
+    switches: dict[str, int] = Field(default_factory=dict)
+    error: str | None = None
+
+
 class ProviderStatusResponse(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
@@ -273,3 +417,12 @@ class ProviderStatusResponse(BaseModel):
     model_simple: str
     model_complex: str
     health: bool
+    circuit_state: CircuitState = "closed"
+    circuit_retry_after_seconds: float | None = None
+    last_provider_failure: str | None = None
+    fast_path_hits: dict[str, int] = Field(default_factory=dict)
+    provider_calls: int = 0
+    provider_calls_saved_ratio: float = Field(default=0.0, ge=0.0, le=1.0)
+    planner_output_mode: str = "tool"
+    output_modes: dict[str, PlannerOutputModeStats] = Field(default_factory=dict)
+    learned_routing: LearnedRoutingStatus | None = None
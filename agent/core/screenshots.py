@@ -0,0 +1,130 @@
+"""
+Screenshot preparation for vision-assisted planning.
+
+Uploads arrive as raw image bytes (`PUT /v1/screenshots/{session_id}`) or,
+from older clients, as `PlanRequest.screenshot_base64`. Either way the image
+is decoded once, optionally cropped, downscaled so its long edge fits the
+provider's recommended size and re-encoded as JPEG. Each prepared screenshot
+records a digest of its source bytes and preparation options; an upload
+that is byte-identical to the session's previous one reuses it without
+decoding again. Anything else, however small the change (a typed character,
+a moved caret), is prepared afresh, so the planner always sees the newest
+screen.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+from dataclasses import dataclass
+import hashlib
+import io
+import uuid
+
+from PIL import Image, UnidentifiedImageError
+
+
+SCREENSHOT_MEDIA_TYPE = "image/jpeg"
+# Anthropic downsizes anything with a longer edge, so larger uploads only cost bandwidth.
+PROVIDER_MAX_EDGE = 1568
+# Refuse decompression bombs well before Pillow's own (much larger) limit.
+MAX_SOURCE_PIXELS = 40_000_000
+
+
+class ScreenshotError(ValueError):
+    def __init__(self, message: str, *, status_code: int, error_code: str) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+        self.retry_after: float | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedScreenshot:
+    screenshot_id: str
+    data: bytes
+    width: int
+    height: int
+    source_digest: str
+    source_bytes: int
+    media_type: str = SCREENSHOT_MEDIA_TYPE
+
+    def image_block(self) -> dict[str, object]:
+        # Encoded per provider call only; most screenshots never reach the provider.
+        data = base64.b64encode(self.data).decode("ascii")
+        return {"type": "image", "source": {"type": "base64", "media_type": self.media_type, "data": data}}
+
+
+def source_digest(
+    raw: bytes,
+    *,
+    max_edge: int = PROVIDER_MAX_EDGE,
+    quality: int = 80,
+    crop: tuple[int, int, int, int] | None = None,
+) -> str:
+    """Identity of an upload and the options it is prepared with; equal digests prepare to equal images."""
+    digest = hashlib.blake2b(raw, digest_size=16)
+    digest.update(repr((max_edge, quality, crop)).encode("ascii"))
+    return digest.hexdigest()
+
+
+def decode_base64_screenshot(encoded: str) -> bytes:
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError) as exc:
+        raise ScreenshotError(
+            "screenshot_base64 is not valid base64.", status_code=422, error_code="invalid_screenshot"
+        ) from exc
+
+
+def prepare_screenshot(
+    raw: bytes,
+    *,
+    max_edge: int = PROVIDER_MAX_EDGE,
+    quality: int = 80,
+    crop: tuple[int, int, int, int] | None = None,
+) -> PreparedScreenshot:
+    """
+    Decode, crop to `crop` (left, top, width, height in source pixels), shrink
+    to `max_edge` and re-encode. CPU-bound: call it off the event loop.
+    """
+    try:
+        image = Image.open(io.BytesIO(raw))
+        if image.width * image.height > MAX_SOURCE_PIXELS:
+            raise ScreenshotError(
+                f"Screenshot is {image.width}x{image.height}; at most {MAX_SOURCE_PIXELS} pixels are accepted.",
+                status_code=413,
+                error_code="screenshot_too_large",
+            )
+        if crop is None and image.format == "JPEG":
+            # Let the JPEG decoder skip detail that the downscale would discard.
+            scale = max_edge / max(image.width, image.height)
+            if scale < 1:
+                image.draft("RGB", (round(image.width * scale), round(image.height * scale)))
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        raise ScreenshotError(
+            f"Screenshot could not be decoded: {exc}", status_code=422, error_code="invalid_screenshot"
+        ) from exc
+
+    if crop is not None:
+        left, top, width, height = crop
+        box = (max(0, left), max(0, top), min(image.width, left + width), min(image.height, top + height))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            raise ScreenshotError(
+                "Crop rectangle does not overlap the screenshot.", status_code=422, error_code="invalid_screenshot"
+            )
+        image = image.crop(box)
+
+    image = image.convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    return PreparedScreenshot(
+        screenshot_id=uuid.uuid4().hex[:16],
+        data=output.getvalue(),
+        width=image.width,
+        height=image.height,
+        source_digest=source_digest(raw, max_edge=max_edge, quality=quality, crop=crop),
+        source_bytes=len(raw),
+    )
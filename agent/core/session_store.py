@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import time
+from typing import Callable
+
+from .schemas import ActionPlan, LoopActionOutcome, LoopContext, PlanRequest, VerifyRequest, VerifyResponse
+from .screenshots import PreparedScreenshot
+
+
+MAX_PLANS_PER_SESSION = 4
+MAX_RECENT_OUTCOMES = 12
+
+
+class SessionStateError(RuntimeError):
+    def __init__(self, message: str, *, status_code: int, error_code: str) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+        self.retry_after: float | None = None
+
+
+@dataclass
+class SessionState:
+    plans: OrderedDict[str, ActionPlan] = field(default_factory=OrderedDict)
+    loop_context: LoopContext | None = None
+    last_before_context: str | None = None
+    last_after_context: str | None = None
+    screenshot: PreparedScreenshot | None = None
+    touched_at: float = 0.0
+
+    @property
+    def last_plan(self) -> ActionPlan | None:
+        if not self.plans:
+            return None
+        return next(reversed(self.plans.values()))
+
+
+class SessionStore:
+    """
+    Per-session planner/verifier state so clients can send references and
+    deltas instead of re-posting full plans and loop context every cycle.
+
+    Sessions idle longer than `ttl_seconds` are evicted lazily; the least
+    recently used session is dropped once `max_sessions` is reached.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_seconds: float,
+        max_sessions: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._ttl = ttl_seconds
+        self._max_sessions = max(1, max_sessions)
+        self._clock = clock
+        self._sessions: OrderedDict[str, SessionState] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> SessionState | None:
+        state = self._sessions.get(session_id)
+        if state is None:
+            return None
+        if self._clock() - state.touched_at > self._ttl:
+            del self._sessions[session_id]
+            return None
+        return state
+
+    def _touch(self, session_id: str) -> SessionState:
+        now = self._clock()
+        state = self.get(session_id)
+        if state is None:
+            self._evict_expired(now)
+            while len(self._sessions) >= self._max_sessions:
+                self._sessions.popitem(last=False)
+            state = SessionState()
+            self._sessions[session_id] = state
+        else:
+            self._sessions.move_to_end(session_id)
+        state.touched_at = now
+        return state
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [key for key, state in self._sessions.items() if now - state.touched_at > self._ttl]
+        for key in expired:
+            del self._sessions[key]
+
+    def record_plan(self, plan: ActionPlan, loop_context: LoopContext | None) -> None:
+        state = self._touch(plan.session_id)
+        if plan.plan_id:
+            state.plans[plan.plan_id] = plan
+            while len(state.plans) > MAX_PLANS_PER_SESSION:
+                state.plans.popitem(last=False)
+        if loop_context is not None:
+            state.loop_context = loop_context
+
+    def reusable_screenshot(self, session_id: str, digest: str) -> PreparedScreenshot | None:
+        """The session's latest screenshot if it was prepared from the same bytes and options."""
+        state = self.get(session_id)
+        screenshot = state.screenshot if state is not None else None
+        if screenshot is None or screenshot.source_digest != digest:
+            return None
+        self._touch(session_id)
+        return screenshot
+
+    def record_screenshot(self, session_id: str, screenshot: PreparedScreenshot) -> None:
+        self._touch(session_id).screenshot = screenshot
+
+    def resolve_screenshot(self, session_id: str, screenshot_id: str) -> PreparedScreenshot:
+        state = self.get(session_id)
+        screenshot = state.screenshot if state is not None else None
+        if screenshot is None or screenshot.screenshot_id != screenshot_id:
+            raise SessionStateError(
+                f"Screenshot '{screenshot_id}' is unknown or was replaced; upload it again.",
+                status_code=409,
+                error_code="screenshot_not_found",
+            )
+        return screenshot
+
+    def record_verify(self, request: VerifyRequest, result: VerifyResponse) -> None:
+        state = self._touch(request.session_id)
+        if request.before_context is not None:
+            state.last_before_context = request.before_context
+        if request.after_context is not None:
+            state.last_after_context = request.after_context
+        if state.loop_context is None:
+            return
+        outcomes = self._outcomes_from_verify(request)
+        recent = [*state.loop_context.recent_action_results, *outcomes][-MAX_RECENT_OUTCOMES:]
+        state.loop_context = state.loop_context.model_copy(
+            update={
+                "last_verify_status": result.status,
+                "last_verify_reason": result.reason,
+                "recent_action_results": recent,
+            }
+        )
+
+    def resolve_plan_request(self, request: PlanRequest) -> PlanRequest:
+        delta = request.loop_context_delta
+        if delta is None:
+            return request
+        if request.loop_context is not None:
+            base = request.loop_context
+        else:
+            state = self.get(request.session_id)
+            if state is None or state.loop_context is None:
+                raise SessionStateError(
+                    "No stored loop context for this session; send the full loop_context.",
+                    status_code=409,
+                    error_code="session_state_missing",
+                )
+            base = state.loop_context
+
+        updates = delta.model_dump(exclude_unset=True, exclude={"append_action_results"})
+        recent = [*base.recent_action_results, *delta.append_action_results][-MAX_RECENT_OUTCOMES:]
+        merged = base.model_copy(update={**updates, "recent_action_results": recent})
+        return request.model_copy(update={"loop_context": merged, "loop_context_delta": None})
+
+    def resolve_verify_request(self, request: VerifyRequest) -> VerifyRequest:
+        updates: dict[str, object] = {}
+        state = self.get(request.session_id)
+        if request.action_plan is None:
+            plan = state.plans.get(request.plan_id or "") if state is not None else None
+            if plan is None:
+                raise SessionStateError(
+                    f"Plan '{request.plan_id}' is unknown or expired; send the full action_plan.",
+                    status_code=409,
+                    error_code="plan_not_found",
+                )
+            updates["action_plan"] = plan
+        if state is not None:
+            if request.loop_context is None and state.loop_context is not None:
+                updates["loop_context"] = state.loop_context
+            if request.before_context is None and state.last_after_context is not None:
+                # The previous cycle's "after" is this cycle's "before".
+                updates["before_context"] = state.last_after_context
+        if not updates:
+            return request
+        return request.model_copy(update=updates)
+
+    @staticmethod
+    def _outcomes_from_verify(request: VerifyRequest) -> list[LoopActionOutcome]:
+        if request.action_plan is None:
+            return []
+        completed = set(request.completed_actions)
+        outcomes: list[LoopActionOutcome] = []
+        for action in request.action_plan.actions:
+            if action.id == request.failed_action_id:
+                status = "failure"
+            elif action.id in completed or (request.execution_result == "success" and not completed):
+                status = "success"
+            else:
+                continue
+            outcomes.append(
+                LoopActionOutcome(
+                    action_id=action.id,
+                    kind=action.kind,
+                    status=status,
+                    action_hint=request.reason if status == "failure" else None,
+                )
+            )
+        return outcomes
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from core.event_bus import EventBus
+from core.planner_service import PlannerService
+from core.schemas import ActionPlan, LoopActionOutcome, LoopContext, PlanRequest, StreamEvent
+from core.session_store import MAX_RECENT_OUTCOMES
+from core.verifier_service import PlanFeatures, VerifierService
+from macos_use_adapter.adapter import ProviderConfigurationError
+
+
+# Speculative plans run under a derived session id so their progress events
+# and per-session admission tokens never mix with the live session.
+SPECULATIVE_SESSION_SUFFIX = "#speculative"
+# Loop context fields that must agree for a speculative plan to be served.
+SPECULATION_MATCH_FIELDS = ("cycle_index", "replan_count", "current_state", "next_required_state", "last_verify_status")
+
+
+def predict_success_context(plan: ActionPlan, loop_context: LoopContext) -> LoopContext:
+    """Loop context the next cycle will most likely see if every action in `plan` succeeds."""
+    predicted_state = VerifierService._infer_state_transition(PlanFeatures.from_actions(plan.actions))
+    outcomes = [
+        LoopActionOutcome(action_id=action.id, kind=action.kind, status="success")
+        for action in plan.actions
+    ]
+    expected = [action.expected_outcome for action in plan.actions if action.expected_outcome]
+    return loop_context.model_copy(
+        update={
+            "cycle_index": loop_context.cycle_index + 1,
+            "current_state": predicted_state,
+            "last_state": loop_context.current_state,
+            "next_required_state": None,
+            "last_verify_status": "success",
+            "last_verify_reason": "; ".join(expected) or None,
+            "recent_action_results": [*loop_context.recent_action_results, *outcomes][-MAX_RECENT_OUTCOMES:],
+        }
+    )
+
+
+def contexts_match(predicted: LoopContext, actual: LoopContext) -> bool:
+    return all(getattr(predicted, name) == getattr(actual, name) for name in SPECULATION_MATCH_FIELDS)
+
+
+@dataclass(slots=True)
+class _Speculation:
+    request: PlanRequest
+    task: asyncio.Task[ActionPlan]
+
+
+class SpeculativePlanner:
+    """
+    Pre-computes the next micro-step while the client executes the current one.
+
+    After a plan is returned, `prepare` plans the following cycle assuming
+    every action succeeds (state from the verifier's transition rules, verify
+    reason from the actions' `expected_outcome`). `take` serves that plan when
+    the next request carries the predicted loop state for the same goal and
+    app; anything else discards it.
+    """
+
+    def __init__(self, planner: PlannerService, event_bus: EventBus, *, max_sessions: int = 64) -> None:
+        self._planner = planner
+        self._event_bus = event_bus
+        self._max_sessions = max(1, max_sessions)
+        self._pending: OrderedDict[str, _Speculation] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def prepare(self, plan: ActionPlan, request: PlanRequest) -> bool:
+        self.discard(request.session_id)
+        loop_context = request.loop_context
+        if loop_context is None or plan.goal_state != "in_progress" or not plan.actions:
+            return False
+        predicted = predict_success_context(plan, loop_context)
+        if predicted.cycle_index >= predicted.max_cycles:
+            return False
+
+        while len(self._pending) >= self._max_sessions:
+            oldest = next(iter(self._pending))
+            self.discard(oldest)
+        speculative_request = request.model_copy(
+            update={
+                "session_id": f"{request.session_id}{SPECULATIVE_SESSION_SUFFIX}",
+                "loop_context": predicted,
+                "loop_context_delta": None,
+            }
+        )
+        task = asyncio.create_task(self._planner.plan(speculative_request))
+        self._pending[request.session_id] = _Speculation(request=speculative_request, task=task)
+        return True
+
+    async def take(self, request: PlanRequest) -> ActionPlan | None:
+        speculation = self._pending.pop(request.session_id, None)
+        if speculation is None:
+            return None
+        if not self._matches(speculation.request, request):
+            self.misses += 1
+            self._cancel(speculation)
+            return None
+        try:
+            plan = await speculation.task
+        except ProviderConfigurationError:
+            # Speculation is best-effort; the caller plans live instead.
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        await self._event_bus.publish(
+            StreamEvent(
+                session_id=request.session_id,
+                event="planning_speculative_hit",
+                message="Served pre-computed plan for the predicted state",
+                progress=100,
+                severity="info",
+            )
+        )
+        return plan.model_copy(update={"session_id": request.session_id})
+
+    def discard(self, session_id: str) -> None:
+        speculation = self._pending.pop(session_id, None)
+        if speculation is not None:
+            self._cancel(speculation)
+
+    @staticmethod
+    def _matches(predicted: PlanRequest, actual: PlanRequest) -> bool:
+        if actual.loop_context is None or predicted.loop_context is None:
+            return False
+        if actual.transcript != predicted.transcript:
+            return False
+        predicted_app = predicted.app.name if predicted.app else None
+        actual_app = actual.app.name if actual.app else None
+        if actual_app != predicted_app:
+            return False
+        return contexts_match(predicted.loop_context, actual.loop_context)
+
+    @staticmethod
+    def _cancel(speculation: _Speculation) -> None:
+        task = speculation.task
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            # Mark any failure as retrieved.
+            task.exception()
@@ -1,81 +1,236 @@
 from __future__ import annotations
 
-from difflib import SequenceMatcher
-import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable
+
+from core.config import SCHEMA_VERSION_CURRENT, settings
+from core.context_delta import DeltaEngine, resolve_delta_engine
+from core.context_parser import ParsedContext, parse_context
+from core.schemas import LoopContext, VerifyBatchRequest, VerifyBatchResponse, VerifyRequest, VerifyResponse
+from macos_use_adapter.rules import is_commit_key_combo
+
+
+LOOP_STATES = frozenset(
+    {
+        "APP_ACTIVE",
+        "UI_CONTEXT_CHANGED",
+        "EDITOR_OPEN",
+        "FIELD_FOCUSED",
+        "DATA_ENTERED",
+        "COMMIT_ATTEMPTED",
+        "COMPLETED",
+        "BLOCKED",
+    }
+)
+STATE_RANKS = MappingProxyType(
+    {
+        "APP_ACTIVE": 0,
+        "UI_CONTEXT_CHANGED": 1,
+        "EDITOR_OPEN": 2,
+        "FIELD_FOCUSED": 3,
+        "DATA_ENTERED": 4,
+        "COMMIT_ATTEMPTED": 5,
+        "COMPLETED": 6,
+        "BLOCKED": 6,
+    }
+)
+CLICK_LIKE_KINDS = frozenset({"click", "double_click", "select_menu_item"})
+NO_DELTA_THRESHOLD = 0.01
+
+
+@dataclass(frozen=True, slots=True)
+class PlanFeatures:
+    """Per-plan facts every rule needs, computed once per verify call."""
+
+    kinds: frozenset[str]
+    has_commit: bool
+    first_kind: str | None
+    first_target: str
 
-from core.config import SCHEMA_VERSION_CURRENT
-from core.schemas import VerifyRequest, VerifyResponse
+    @classmethod
+    def from_actions(cls, actions: list) -> PlanFeatures:
+        if not actions:
+            return cls(kinds=frozenset(), has_commit=False, first_kind=None, first_target="")
+        first = actions[0]
+        return cls(
+            kinds=frozenset(action.kind for action in actions),
+            has_commit=any(
+                action.kind == "key_combo" and is_commit_key_combo(action.key_combo) for action in actions
+            ),
+            first_kind=first.kind,
+            first_target=(first.target or first.app_bundle_id or "").strip().lower(),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class VerifyFacts:
+    request: VerifyRequest
+    loop_context: LoopContext | None
+    before: ParsedContext
+    after: ParsedContext
+    delta_score: float
+    features: PlanFeatures
+    current_state: str | None
+    expected_next_state: str | None
+    observed_state: str | None
+    is_noop: bool
+
+
+StateRule = tuple[Callable[[PlanFeatures], bool], str]
+NoProgressRule = Callable[[VerifyFacts], str | None]
+
+# Ordered (predicate, state) tables; the first matching rule wins and
+# APP_ACTIVE is the fallback.
+ACTION_STATE_RULES: tuple[StateRule, ...] = (
+    (lambda features: "type" in features.kinds, "DATA_ENTERED"),
+    (lambda features: features.has_commit, "COMMIT_ATTEMPTED"),
+)
+TRANSITION_RULES: tuple[StateRule, ...] = (
+    *ACTION_STATE_RULES,
+    (lambda features: bool(features.kinds & CLICK_LIKE_KINDS), "UI_CONTEXT_CHANGED"),
+)
+
+
+def _match_state(rules: tuple[StateRule, ...], features: PlanFeatures) -> str:
+    for predicate, state in rules:
+        if predicate(features):
+            return state
+    return "APP_ACTIVE"
+
+
+def is_transition_sufficient(*, expected_next_state: str | None, observed_state: str | None) -> bool:
+    if expected_next_state is None:
+        return True
+
+    if observed_state == expected_next_state:
+        return True
+
+    # Completing a form is often observed first as a commit attempt
+    # before UI has reflected a final completion state.
+    if expected_next_state == "COMPLETED" and observed_state == "COMMIT_ATTEMPTED":
+        return True
+
+    expected_rank = STATE_RANKS.get(expected_next_state)
+    observed_rank = STATE_RANKS.get(observed_state or "")
+    if expected_rank is None or observed_rank is None:
+        return observed_state == expected_next_state
+    return observed_rank >= expected_rank
+
+
+def _rule_expected_transition(facts: VerifyFacts) -> str | None:
+    if is_transition_sufficient(expected_next_state=facts.expected_next_state, observed_state=facts.observed_state):
+        return None
+    return f"Expected state transition to '{facts.expected_next_state}' but observed '{facts.observed_state}'"
+
+
+def _rule_state_unchanged(facts: VerifyFacts) -> str | None:
+    if facts.observed_state != facts.current_state or facts.delta_score >= NO_DELTA_THRESHOLD:
+        return None
+    if facts.expected_next_state == "COMPLETED" and facts.observed_state == "COMMIT_ATTEMPTED":
+        return None
+    return (
+        f"No meaningful state transition after success from {facts.current_state or 'UNKNOWN'} "
+        f"to {facts.observed_state or 'UNKNOWN'}"
+    )
+
+
+def _rule_no_context_delta(facts: VerifyFacts) -> str | None:
+    request = facts.request
+    if facts.loop_context is not None or facts.delta_score >= NO_DELTA_THRESHOLD:
+        return None
+    if not (request.before_context and request.after_context):
+        return None
+    return f"No meaningful UI/context delta detected after success ({facts.delta_score:.2f})"
+
+
+def _rule_noop_open(facts: VerifyFacts) -> str | None:
+    if not facts.is_noop:
+        return None
+    return "Open-app action did not change active app or window"
+
+
+def _unless_noop(rule: NoProgressRule) -> NoProgressRule:
+    return lambda facts: None if facts.is_noop else rule(facts)
+
+
+# Evaluated in order for successful executions; the first reason returned
+# turns the result into a failure.
+NO_PROGRESS_RULES: tuple[NoProgressRule, ...] = (
+    _unless_noop(_rule_expected_transition),
+    _unless_noop(_rule_state_unchanged),
+    _unless_noop(_rule_no_context_delta),
+    _rule_noop_open,
+)
 
 
 class VerifierService:
-    """Deterministic verifier baseline with corrective hints."""
+    """Deterministic, table-driven verifier with corrective hints."""
+
+    def __init__(self, delta_engine: DeltaEngine | None = None) -> None:
+        self._delta_engine = delta_engine or resolve_delta_engine(settings.verifier_delta_mode)
 
-    def verify(self, request: VerifyRequest) -> VerifyResponse:
+    def verify_batch(self, batch: VerifyBatchRequest) -> VerifyBatchResponse:
+        # Recorded sessions repeat the same before/after pairs; compute each delta once.
+        delta_cache: dict[tuple[str, str], float] = {}
+        results = [self.verify(request, delta_cache=delta_cache) for request in batch.requests]
+        return VerifyBatchResponse(
+            schema_version=SCHEMA_VERSION_CURRENT,
+            results=results,
+            failures=sum(1 for result in results if result.status == "failure"),
+        )
+
+    def verify(
+        self,
+        request: VerifyRequest,
+        *,
+        delta_cache: dict[tuple[str, str], float] | None = None,
+    ) -> VerifyResponse:
         before_context = (request.before_context or "").strip()
         after_context = (request.after_context or "").strip()
-        delta_score = self._context_delta(before_context, after_context)
-        no_progress_reason: str | None = None
+        if delta_cache is None:
+            delta_score = self._context_delta(before_context, after_context)
+        else:
+            pair = (before_context, after_context)
+            delta_score = delta_cache.get(pair)
+            if delta_score is None:
+                delta_score = delta_cache[pair] = self._context_delta(before_context, after_context)
+        before_parsed = parse_context(before_context)
+        after_parsed = parse_context(after_context)
+        actions = request.action_plan.actions
+        features = PlanFeatures.from_actions(actions)
 
         loop_context = request.loop_context
         current_state = self._coerce_state(loop_context.current_state if loop_context else None)
         expected_next_state = self._coerce_state(loop_context.next_required_state if loop_context else None)
-        observed_state = self._infer_state_from_context(before_context, after_context, request.action_plan.actions)
+        observed_state = self._infer_state_from_context(before_parsed, after_parsed, features)
+        state_transition = self._infer_state_transition(features)
 
-        state_transition = self._infer_state_transition(request.action_plan.actions)
-        state_reason = self._state_reason(
-            before_context=before_context,
-            after_context=after_context,
-            previous_state=current_state,
-            observed_state=observed_state,
-            execution_result=request.execution_result,
+        facts = VerifyFacts(
+            request=request,
+            loop_context=loop_context,
+            before=before_parsed,
+            after=after_parsed,
             delta_score=delta_score,
+            features=features,
+            current_state=current_state,
             expected_next_state=expected_next_state,
-            first_action_kind=request.action_plan.actions[0].kind if request.action_plan.actions else None,
+            observed_state=observed_state,
+            is_noop=self._is_noop_open_or_redundant(request, features, before_parsed, after_parsed, delta_score),
         )
+        state_reason = self._state_reason(facts)
 
-        if request.execution_result == "success" and not self._is_noop_open_or_redundant(
-            request=request,
-            before_context=before_context,
-            after_context=after_context,
-            delta_score=delta_score,
-        ):
-            expected_advance = self._is_transition_sufficient(
-                expected_next_state=expected_next_state,
-                observed_state=observed_state,
-                previous_state=current_state,
-            )
-
-            if not expected_advance:
-                no_progress_reason = (
-                    f"Expected state transition to '{expected_next_state}' but observed '{observed_state}'"
-                )
-            elif (
-                observed_state == current_state
-                and delta_score < 0.01
-                and not (expected_next_state == "COMPLETED" and observed_state == "COMMIT_ATTEMPTED")
-            ):
-                no_progress_reason = (
-                    f"No meaningful state transition after success from {current_state or 'UNKNOWN'} "
-                    f"to {observed_state or 'UNKNOWN'}"
-                )
-            elif loop_context is None and delta_score < 0.01 and request.before_context and request.after_context:
-                no_progress_reason = (
-                    f"No meaningful UI/context delta detected after success ({delta_score:.2f})"
-                )
-
-        if no_progress_reason is None and request.execution_result == "success":
-            if self._is_noop_open_or_redundant(
-                request=request,
-                before_context=before_context,
-                after_context=after_context,
-                delta_score=delta_score,
-            ):
-                no_progress_reason = "Open-app action did not change active app or window"
+        no_progress_reason: str | None = None
+        if request.execution_result == "success":
+            for rule in NO_PROGRESS_RULES:
+                no_progress_reason = rule(facts)
+                if no_progress_reason is not None:
+                    break
 
         corrective_actions = []
-        if request.execution_result in {"failure", "partial"} and request.action_plan.actions:
+        if request.execution_result in {"failure", "partial"} and actions:
             corrective_actions = self._build_corrective_suffix(
-                actions=request.action_plan.actions,
+                actions=actions,
                 failed_action_id=request.failed_action_id,
                 completed_actions=request.completed_actions,
                 skip_first_open_app=False,
@@ -139,181 +294,48 @@ class VerifierService:
         return [action.model_copy(update={"id": f"retry_{idx}"}) for idx, action in enumerate(suffix, start=1)]
 
     @staticmethod
-    def _parse_context_field(context: str, field: str) -> str | None:
-        match = re.search(rf"{re.escape(field)}=(.*?)(?:, [a-z_]+=[^,]*|$)", context)
-        if not match:
-            return None
-        return match.group(1).strip()
-
-    @classmethod
     def _is_noop_open_or_redundant(
-        cls,
-        *,
         request: VerifyRequest,
-        before_context: str,
-        after_context: str,
+        features: PlanFeatures,
+        before: ParsedContext,
+        after: ParsedContext,
         delta_score: float,
     ) -> bool:
-        if request.execution_result != "success":
-            return False
-        if not request.action_plan.actions:
+        if request.execution_result != "success" or features.first_kind is None:
             return False
 
-        first_action = request.action_plan.actions[0]
-        if first_action.kind != "open_app":
-            if delta_score >= 0.01:
+        if features.first_kind != "open_app":
+            if delta_score >= NO_DELTA_THRESHOLD:
                 return False
-            if first_action.kind in {"click", "double_click", "select_menu_item"} and request.reason:
-                return True
-            return False
-
-        target = (first_action.target or first_action.app_bundle_id or "").strip().lower()
-        if not target:
-            return False
+            return features.first_kind in CLICK_LIKE_KINDS and bool(request.reason)
 
-        before_app = (cls._parse_context_field(before_context, "app") or "").lower()
-        after_app = (cls._parse_context_field(after_context, "app") or "").lower()
-        before_window = (cls._parse_context_field(before_context, "window") or "").lower()
-        after_window = (cls._parse_context_field(after_context, "window") or "").lower()
-        if not before_app or not after_app:
+        target = features.first_target
+        if not target or not before.app or not after.app:
             return False
-
-        if target not in before_app and target not in after_app:
+        if target not in before.app and target not in after.app:
             return False
-        return before_app == after_app and before_window == after_window
+        return before.app == after.app and before.window == after.window
 
-    @staticmethod
-    def _context_delta(before: str, after: str) -> float:
-        if not before and not after:
-            return 0.0
-        if before and not after:
-            return 0.0
-        if not before and after:
-            return 1.0
-        ratio = SequenceMatcher(a=before, b=after).ratio()
-        return max(0.0, 1.0 - ratio)
+    def _context_delta(self, before: str, after: str) -> float:
+        return self._delta_engine(before, after)
 
     @staticmethod
     def _coerce_state(raw_state: str | None) -> str | None:
-        if not raw_state:
-            return None
-        if raw_state in {
-            "APP_ACTIVE",
-            "UI_CONTEXT_CHANGED",
-            "EDITOR_OPEN",
-            "FIELD_FOCUSED",
-            "DATA_ENTERED",
-            "COMMIT_ATTEMPTED",
-            "COMPLETED",
-            "BLOCKED",
-        }:
+        if raw_state in LOOP_STATES:
             return raw_state
         return None
 
     @staticmethod
-    def _infer_state_from_context(before_context: str, after_context: str, actions: list) -> str | None:
-        before_app = (VerifierService._parse_context_field(before_context, "app") or "").lower()
-        after_app = (VerifierService._parse_context_field(after_context, "app") or "").lower()
-        before_window = (VerifierService._parse_context_field(before_context, "window") or "").lower()
-        after_window = (VerifierService._parse_context_field(after_context, "window") or "").lower()
-
-        if after_app and before_app and after_app != before_app:
-            return "APP_ACTIVE"
-        if after_window and before_window and after_window != before_window:
-            return "UI_CONTEXT_CHANGED"
-
-        kinds = {action.kind for action in actions}
-        if "type" in kinds:
-            return "DATA_ENTERED"
-        if any(
-            action.kind == "key_combo" and VerifierService._is_commit_key_combo(action.key_combo)
-            for action in actions
-        ):
-            return "COMMIT_ATTEMPTED"
-
-        return "APP_ACTIVE"
-
-    @staticmethod
-    def _infer_state_transition(actions: list) -> str:
-        if not actions:
+    def _infer_state_from_context(before: ParsedContext, after: ParsedContext, features: PlanFeatures) -> str:
+        if after.app and before.app and after.app != before.app:
             return "APP_ACTIVE"
-
-        kinds = {action.kind for action in actions}
-        if "type" in kinds:
-            return "DATA_ENTERED"
-        if any(
-            action.kind == "key_combo" and VerifierService._is_commit_key_combo(action.key_combo)
-            for action in actions
-        ):
-            return "COMMIT_ATTEMPTED"
-        if "click" in kinds or "double_click" in kinds or "select_menu_item" in kinds:
+        if after.window and before.window and after.window != before.window:
             return "UI_CONTEXT_CHANGED"
-        if "open_app" in kinds:
-            return "APP_ACTIVE"
-        if "run_applescript" in kinds:
-            return "APP_ACTIVE"
-        return "APP_ACTIVE"
+        return _match_state(ACTION_STATE_RULES, features)
 
     @staticmethod
-    def _is_commit_key_combo(combo: str | None) -> bool:
-        if not combo:
-            return False
-        normalized = combo.lower().replace(" ", "")
-        commit_tokens = {
-            "enter",
-            "return",
-            "cmd+enter",
-            "command+enter",
-            "cmd+return",
-            "command+return",
-            "cmd+s",
-            "command+s",
-        }
-        return normalized in commit_tokens
-
-    @staticmethod
-    def _state_rank(state: str | None) -> int | None:
-        ranks = {
-            "APP_ACTIVE": 0,
-            "UI_CONTEXT_CHANGED": 1,
-            "EDITOR_OPEN": 2,
-            "FIELD_FOCUSED": 3,
-            "DATA_ENTERED": 4,
-            "COMMIT_ATTEMPTED": 5,
-            "COMPLETED": 6,
-            "BLOCKED": 6,
-        }
-        return ranks.get(state or "", None)
-
-    @classmethod
-    def _is_transition_sufficient(
-        cls,
-        *,
-        expected_next_state: str | None,
-        observed_state: str | None,
-        previous_state: str | None,
-    ) -> bool:
-        if expected_next_state is None:
-            return True
-
-        if observed_state == expected_next_state:
-            return True
-
-        # Completing a form is often observed first as a commit attempt
-        # before UI has reflected a final completion state.
-        if expected_next_state == "COMPLETED" and observed_state == "COMMIT_ATTEMPTED":
-            return True
-
-        expected_rank = cls._state_rank(expected_next_state)
-        observed_rank = cls._state_rank(observed_state)
-        if expected_rank is None or observed_rank is None:
-            return observed_state == expected_next_state
-
-        if observed_rank >= expected_rank:
-            return True
-
-        _ = previous_state
-        return False
+    def _infer_state_transition(features: PlanFeatures) -> str:
+        return _match_state(TRANSITION_RULES, features)
 
     @staticmethod
     def _default_failure_reason(execution_result: str, delta_score: float) -> str:
@@ -321,37 +343,25 @@ class VerifierService:
             return f"No meaningful UI/context delta detected after success report ({delta_score:.2f})"
         return "Execution did not complete successfully"
 
-    @classmethod
-    def _state_reason(
-        cls,
-        *,
-        before_context: str,
-        after_context: str,
-        previous_state: str | None,
-        observed_state: str | None,
-        execution_result: str,
-        delta_score: float,
-        expected_next_state: str | None,
-        first_action_kind: str | None,
-    ) -> str:
-        if execution_result != "success":
+    @staticmethod
+    def _state_reason(facts: VerifyFacts) -> str:
+        if facts.request.execution_result != "success":
             return "Execution did not complete successfully"
 
+        expected_next_state = facts.expected_next_state
+        observed_state = facts.observed_state
+        previous_state = facts.current_state
         if expected_next_state and observed_state and observed_state != expected_next_state:
-            if not cls._is_transition_sufficient(
-                expected_next_state=expected_next_state,
-                observed_state=observed_state,
-                previous_state=previous_state,
-            ):
+            if not is_transition_sufficient(expected_next_state=expected_next_state, observed_state=observed_state):
                 return (
                     f"Expected state transition to '{expected_next_state}' but observed '{observed_state}' "
                     f"(previous '{previous_state or 'UNKNOWN'}')"
                 )
 
-        if observed_state == previous_state and delta_score < 0.01:
-            return f"State remained '{observed_state}' after {first_action_kind or 'action'}"
+        if observed_state == previous_state and facts.delta_score < NO_DELTA_THRESHOLD:
+            return f"State remained '{observed_state}' after {facts.features.first_kind or 'action'}"
 
-        if "app=" not in before_context and "app=" not in after_context:
+        if not facts.before.has_app and not facts.after.has_app:
             return "Context missing app information"
 
         return "State transition observed"
@@ -1,17 +1,45 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime
+import asyncio
 import json
-from pathlib import Path
-import re
-import sys
+import random
+import time
 from typing import Any
 
 import httpx
 
+from core.circuit_breaker import CircuitBreaker
 from core.config import settings
+from core.latency_budget import LatencyBudget
+from core.learned_routing import LearnedPolicy, LearnedRouter
+from core.model_routing import ModelRouter, RoutingTable, compile_routing_table, parse_model_overrides
+from core.rate_limiter import AdmissionRejected, ConcurrencyLimiter
 from core.schemas import Action, LoopContext
+from core.screenshots import PreparedScreenshot
+from macos_use_adapter.fast_path import FastPathPlanner
+from macos_use_adapter.payload import (
+    PROVIDER_ACTIONS_ADAPTER,
+    PLAN_TOOL,
+    PLAN_TOOL_NAME,
+    PROVIDER_PAYLOAD_ADAPTER,
+    extract_json_object,
+    extract_tool_input,
+    split_actions,
+)
+from macos_use_adapter.rules import (
+    ALLOWED_ACTION_KINDS,
+    COMMIT_MENU_TOKENS,
+    COMMIT_PHASE_STATES,
+    DETERMINISTIC_BROWSERS,
+    GOAL_STATES,
+    NON_COMMIT_KEY_COMBOS,
+    URL_RE,
+    app_prompt_pack,
+    is_commit_key_combo,
+    normalize_key_combo,
+)
+from macos_use_adapter.vendor_rules import VendorRules, load_vendor_rules
 
 
 @dataclass
@@ -23,6 +51,11 @@ class AdapterResult:
     goal_state: str = "in_progress"
     planner_note: str | None = None
     recovery_guidance: str | None = None
+    source: str = "provider"
+    model: str | None = None
+    latency_ms: int | None = None
+    # Rule that produced a fast-path plan (source == "fast_path").
+    fast_path_intent: str | None = None
 
 
 @dataclass
@@ -32,11 +65,53 @@ class ProviderValidationResult:
     account_hint: str | None = None
 
 
+@dataclass
+class OutputModeStats:
+    """Parse outcomes and latency of 2xx planner responses for one output mode."""
+
+    requests: int = 0
+    parse_failures: int = 0
+    total_latency_seconds: float = 0.0
+
+    def record(self, latency_seconds: float, *, parsed: bool) -> None:
+        self.requests += 1
+        self.total_latency_seconds += latency_seconds
+        if not parsed:
+            self.parse_failures += 1
+
+
+PLANNER_OUTPUT_MODES = ("tool", "json_text")
+PLANNER_SYSTEM_PROMPT_JSON = "You are Orange planner. Return only valid JSON. Do not include markdown."
+PLANNER_SYSTEM_PROMPT_TOOL = f"You are Orange planner. Always respond by calling the {PLAN_TOOL_NAME} tool."
+
+# Error codes that indicate the provider itself is degraded (as opposed to a
+# caller problem such as a bad key) and therefore count against the breaker.
+BREAKER_FAILURE_CODES = {
+    "provider_network_error",
+    "provider_unavailable",
+    "provider_bad_response",
+    "provider_deadline_exceeded",
+}
+
+
 class ProviderConfigurationError(RuntimeError):
-    def __init__(self, message: str, *, status_code: int, error_code: str) -> None:
+    def __init__(
+        self,
+        message: str,
+        *,
+        status_code: int,
+        error_code: str,
+        retry_after: float | None = None,
+    ) -> None:
         super().__init__(message)
         self.status_code = status_code
         self.error_code = error_code
+        self.retry_after = retry_after
+
+
+class ProviderDeadlineExceeded(ProviderConfigurationError):
+    def __init__(self, message: str, *, error_code: str = "provider_deadline_exceeded") -> None:
+        super().__init__(message, status_code=504, error_code=error_code)
 
 
 class MacOSUseAdapter:
@@ -48,31 +123,45 @@ class MacOSUseAdapter:
     """
 
     def __init__(self) -> None:
-        self._vendor_loaded = False
-        self._important_rules = ""
-        self._load_vendor_prompt_rules()
-
-    _allowed_action_kinds = {
-        "click",
-        "double_click",
-        "type",
-        "key_combo",
-        "scroll",
-        "open_app",
-        "run_applescript",
-        "select_menu_item",
-        "wait",
-    }
-
-    _fallback_model_candidates = (
-        "claude-3-5-sonnet-latest",
-        "claude-3-5-haiku-latest",
-        "claude-3-5-sonnet-20241022",
-        "claude-3-5-haiku-20241022",
-        "claude-3-opus-20240229",
-        "claude-3-sonnet-20240229",
-        "claude-3-haiku-20240307",
-    )
+        # Loaded on first use; see `vendor_rules`.
+        self._vendor_rules: VendorRules | None = None
+        self._provider_slots = ConcurrencyLimiter(
+            max_concurrency=settings.provider_max_concurrency,
+            max_waiters=settings.provider_max_queue,
+            wait_timeout=settings.provider_queue_timeout_seconds,
+        )
+        self._breaker = CircuitBreaker(
+            failure_threshold=settings.provider_breaker_failure_threshold,
+            open_seconds=settings.provider_breaker_open_seconds,
+            slow_call_seconds=settings.provider_breaker_slow_call_seconds,
+            slow_call_ratio=settings.provider_breaker_slow_call_ratio,
+            window=settings.provider_breaker_window,
+        )
+        self._latency = LatencyBudget(
+            ceiling_seconds=settings.anthropic_plan_timeout_seconds,
+            floor_seconds=settings.anthropic_plan_min_timeout_seconds,
+            multiplier=settings.adaptive_timeout_multiplier,
+            min_samples=settings.adaptive_timeout_min_samples,
+        )
+        self._output_stats = {mode: OutputModeStats() for mode in PLANNER_OUTPUT_MODES}
+        self._fast_path = FastPathPlanner(
+            min_confidence=settings.fast_path_min_confidence,
+            thresholds=settings.fast_path_thresholds,
+        )
+        self._router = ModelRouter(
+            compile_routing_table(
+                model_simple=settings.model_simple,
+                model_complex=settings.model_complex,
+                app_overrides=parse_model_overrides(settings.model_overrides_raw),
+            ),
+            config_path=settings.model_routing_file,
+            poll_seconds=settings.model_routing_poll_seconds,
+        )
+        self._learned_router: LearnedRouter | None = None
+        self._learned_routing_error: str | None = None
+        self._load_learned_router()
+
+    _allowed_action_kinds = ALLOWED_ACTION_KINDS
 
     @property
     def provider_name(self) -> str:
@@ -81,6 +170,30 @@ class MacOSUseAdapter:
     def current_api_key(self) -> str | None:
         return settings.provider_api_key()
 
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    @property
+    def fast_path(self) -> FastPathPlanner:
+        return self._fast_path
+
+    @property
+    def router(self) -> ModelRouter:
+        return self._router
+
+    @property
+    def learned_router(self) -> LearnedRouter | None:
+        return self._learned_router
+
+    @property
+    def learned_routing_error(self) -> str | None:
+        return self._learned_routing_error
+
+    @property
+    def output_mode_stats(self) -> dict[str, OutputModeStats]:
+        return self._output_stats
+
     async def validate_provider_key(self, api_key: str) -> ProviderValidationResult:
         key = api_key.strip()
         if not key:
@@ -131,58 +244,31 @@ class MacOSUseAdapter:
             return base[:-3]
         return base
 
-    def _model_candidates(self, primary_model: str) -> list[str]:
-        candidates = [primary_model]
-        for model in self._fallback_model_candidates:
-            if model not in candidates:
-                candidates.append(model)
-        return candidates
-
     @staticmethod
     def _looks_like_model_not_found(body: dict[str, Any]) -> bool:
         flattened = json.dumps(body).lower()
         return "not_found" in flattened or "not found" in flattened
 
-    def _load_vendor_prompt_rules(self) -> None:
-        vendor_path = settings.vendor_macos_use
-        if not vendor_path.exists():
-            return
-
-        sys.path.insert(0, str(vendor_path))
-        try:
-            from mlx_use.agent.prompts import SystemPrompt  # type: ignore
-
-            prompt = SystemPrompt(
-                action_description=(
-                    "open_app, click, double_click, type, key_combo, scroll, run_applescript, select_menu_item, wait"
-                ),
-                current_date=datetime.now(),
-                max_actions_per_step=4,
-            )
-            self._important_rules = prompt.important_rules()
-            self._vendor_loaded = True
-        except Exception:
-            self._important_rules = self._load_rules_from_source(vendor_path)
-            self._vendor_loaded = bool(self._important_rules)
-        finally:
-            if str(vendor_path) in sys.path:
-                sys.path.remove(str(vendor_path))
-
     @staticmethod
-    def _load_rules_from_source(vendor_path: Path) -> str:
-        prompt_file = vendor_path / "mlx_use" / "agent" / "prompts.py"
-        if not prompt_file.exists():
-            return ""
-
-        content = prompt_file.read_text(encoding="utf-8")
-        match = re.search(
-            r"def important_rules\\(self\\) -> str:\\n\\s+\"\"\".*?\"\"\"\\n\\s+text = \"\"\"(.*?)\"\"\"",
-            content,
-            flags=re.DOTALL,
-        )
-        if not match:
-            return ""
-        return match.group(1).strip()
+    def _provider_error_message(body: dict[str, Any]) -> str:
+        error = body.get("error") if isinstance(body, dict) else None
+        message = error.get("message") if isinstance(error, dict) else None
+        return str(message) if message else "invalid request"
+
+    @classmethod
+    def _looks_like_tool_rejection(cls, body: dict[str, Any]) -> bool:
+        """A 400 about `tools`, `tool_choice` or the tool's input schema, as opposed to the rest of the request."""
+        message = cls._provider_error_message(body).lower()
+        return "tool" in message or "input_schema" in message
+
+    def _load_vendor_prompt_rules(self) -> VendorRules:
+        if self._vendor_rules is None:
+            self._vendor_rules = load_vendor_rules(
+                vendor_path=settings.vendor_macos_use,
+                commit_file=settings.vendor_macos_use_commit_file,
+                cache_path=settings.vendor_rules_cache_path,
+            )
+        return self._vendor_rules
 
     async def plan_actions(
         self,
@@ -191,7 +277,13 @@ class MacOSUseAdapter:
         active_app_name: str | None,
         _ax_tree_summary: str | None,
         loop_context: LoopContext | None,
+        screenshot: PreparedScreenshot | None = None,
+        fast_path_intent: str | None = None,
     ) -> AdapterResult:
+        """
+        `fast_path_intent` is the fast-path rule that planned this loop's
+        earlier cycles, if any; only then may later cycles continue locally.
+        """
         if not settings.enable_remote_llm:
             return self._deterministic_plan(
                 transcript=transcript,
@@ -214,13 +306,61 @@ class MacOSUseAdapter:
                 error_code="invalid_api_key_format",
             )
 
-        return await self._plan_with_anthropic(
-            transcript=transcript,
-            active_app_name=active_app_name,
-            ax_tree_summary=_ax_tree_summary,
-            api_key=key,
-            loop_context=loop_context,
-        )
+        if settings.fast_path_planner:
+            fast = self._fast_path.plan(
+                transcript,
+                app_name=active_app_name,
+                loop_context=loop_context,
+                served_intent=fast_path_intent,
+            )
+            if fast is not None:
+                return AdapterResult(
+                    actions=fast.actions,
+                    confidence=fast.confidence,
+                    summary=fast.summary,
+                    warnings=[],
+                    goal_state="in_progress" if fast.actions else "complete",
+                    planner_note=f"[fast path: {fast.intent}]",
+                    source="fast_path",
+                    fast_path_intent=fast.intent,
+                )
+
+        permit = self._breaker.allow_request()
+        if permit is None:
+            return self._deterministic_plan(
+                transcript=transcript,
+                app_name=active_app_name,
+                warnings=[
+                    "Provider circuit is open after repeated failures; using local fallback plan "
+                    f"({self._breaker.last_failure or 'provider degraded'})"
+                ],
+                loop_context=loop_context,
+            )
+
+        self._fast_path.record_provider_call()
+        started = time.monotonic()
+        try:
+            result = await self._plan_with_anthropic(
+                transcript=transcript,
+                active_app_name=active_app_name,
+                ax_tree_summary=_ax_tree_summary,
+                api_key=key,
+                loop_context=loop_context,
+                screenshot=screenshot,
+            )
+        except ProviderConfigurationError as exc:
+            if exc.error_code in BREAKER_FAILURE_CODES:
+                self._breaker.record_failure(permit, str(exc))
+            else:
+                self._breaker.release_probe(permit)
+            raise
+        except BaseException:
+            self._breaker.release_probe(permit)
+            raise
+        # Provider time only; slot waits and backoff say nothing about its health.
+        latency = result.latency_ms / 1000 if result.latency_ms is not None else time.monotonic() - started
+        self._breaker.record_success(permit, latency)
+        return result
 
     async def _plan_with_anthropic(
         self,
@@ -230,8 +370,11 @@ class MacOSUseAdapter:
         ax_tree_summary: str | None,
         api_key: str,
         loop_context: LoopContext | None,
+        screenshot: PreparedScreenshot | None = None,
     ) -> AdapterResult:
-        model = self._select_model(transcript, active_app_name=active_app_name)
+        # One table snapshot per request, so a concurrent reload cannot mix routes.
+        routing = self._router.current()
+        model = self._select_model(transcript, active_app_name=active_app_name, routing=routing)
         prompt = self._build_provider_prompt(
             transcript=transcript,
             active_app_name=active_app_name,
@@ -242,9 +385,14 @@ class MacOSUseAdapter:
         payload: dict[str, Any] = {
             "temperature": 0,
             "max_tokens": 900,
-            "system": "You are Orange planner. Return only valid JSON. Do not include markdown.",
+            "system": PLANNER_SYSTEM_PROMPT_JSON,
             "messages": [
-                {"role": "user", "content": prompt},
+                {
+                    "role": "user",
+                    "content": (
+                        [screenshot.image_block(), {"type": "text", "text": prompt}] if screenshot is not None else prompt
+                    ),
+                },
             ],
         }
 
@@ -255,19 +403,46 @@ class MacOSUseAdapter:
             "content-type": "application/json",
         }
 
-        planning_timeout = httpx.Timeout(
-            timeout=settings.anthropic_plan_timeout_seconds,
-            connect=min(10.0, settings.anthropic_plan_timeout_seconds),
-        )
+        loop_deadline: float | None = None
+        if loop_context is not None and loop_context.remaining_budget_ms is not None:
+            loop_deadline = time.monotonic() + loop_context.remaining_budget_ms / 1000.0
 
-        model_candidates = self._model_candidates(model)
+        # (model, output mode) pairs; a tool-mode rejection queues a JSON-text retry.
+        attempts = [(candidate, settings.planner_output_mode) for candidate in routing.candidates(model)]
         parse_warnings: list[str] = []
 
-        for idx, attempt_model in enumerate(model_candidates):
+        for idx, (attempt_model, attempt_mode) in enumerate(attempts):
             payload["model"] = attempt_model
+            self._apply_output_mode(payload, attempt_mode)
+            request_timeout, loop_bound = self._request_timeout(attempt_model, len(prompt), loop_deadline)
+            # `request_timeout` bounds each HTTP request; slot waits and 429
+            # backoff are bounded only by the loop budget, if there is one.
+            loop_timer = asyncio.timeout(None if loop_deadline is None else loop_deadline - time.monotonic())
             try:
-                async with httpx.AsyncClient(timeout=planning_timeout) as client:
-                    response = await client.post(url, headers=headers, json=payload)
+                async with loop_timer:
+                    response, attempt_latency = await self._post_provider(
+                        url,
+                        headers=headers,
+                        payload=payload,
+                        timeout=request_timeout,
+                    )
+            except (TimeoutError, httpx.TimeoutException) as exc:
+                if loop_bound or loop_timer.expired():
+                    raise ProviderDeadlineExceeded(
+                        f"Loop deadline reached while waiting for {attempt_model}.",
+                        error_code="loop_deadline_exceeded",
+                    ) from exc
+                self._latency.observe_timeout(attempt_model, len(prompt), request_timeout)
+                raise ProviderDeadlineExceeded(
+                    f"Anthropic did not respond within {request_timeout:.1f}s.",
+                ) from exc
+            except AdmissionRejected as exc:
+                raise ProviderConfigurationError(
+                    str(exc),
+                    status_code=429,
+                    error_code="provider_busy",
+                    retry_after=exc.retry_after,
+                ) from exc
             except httpx.RequestError as exc:
                 raise ProviderConfigurationError(
                     f"Network error while contacting Anthropic: {exc.__class__.__name__}",
@@ -280,6 +455,9 @@ class MacOSUseAdapter:
             except Exception:
                 response_body = {}
 
+            if response.status_code < 300:
+                self._latency.observe(attempt_model, len(prompt), attempt_latency)
+
             if response.status_code in {401, 403}:
                 raise ProviderConfigurationError(
                     "Anthropic API key is invalid or unauthorized.",
@@ -291,6 +469,7 @@ class MacOSUseAdapter:
                     "Anthropic quota or rate limit exceeded.",
                     status_code=429,
                     error_code="provider_quota_exceeded",
+                    retry_after=self._retry_after_seconds(response),
                 )
             if response.status_code >= 500:
                 raise ProviderConfigurationError(
@@ -299,8 +478,20 @@ class MacOSUseAdapter:
                     error_code="provider_unavailable",
                 )
 
+            if response.status_code == 400:
+                if attempt_mode == "tool" and self._looks_like_tool_rejection(response_body):
+                    parse_warnings.append(f"Model {attempt_model} rejected tool-use output, retrying with JSON text")
+                    attempts.insert(idx + 1, (attempt_model, "json_text"))
+                    continue
+                # Oversized images, bad parameters or too-long prompts fail the same way in any mode.
+                raise ProviderConfigurationError(
+                    f"Anthropic rejected the planning request: {self._provider_error_message(response_body)}",
+                    status_code=400,
+                    error_code="provider_bad_request",
+                )
+
             if response.status_code == 404:
-                if idx < len(model_candidates) - 1:
+                if idx < len(attempts) - 1:
                     parse_warnings.append(f"Model {attempt_model} unavailable, trying fallback model")
                     continue
                 warning_reason = (
@@ -324,16 +515,21 @@ class MacOSUseAdapter:
                 )
 
             body = response_body
-            content_text = self._extract_text_content(body)
-            if not content_text:
-                return self._deterministic_plan(
-                    transcript=transcript,
-                    app_name=active_app_name,
-                    warnings=["Provider returned empty content", *parse_warnings],
-                    loop_context=loop_context,
-                )
+            latency = attempt_latency
+            parsed_payload = extract_tool_input(body) if attempt_mode == "tool" else None
+            if parsed_payload is None:
+                content_text = self._extract_text_content(body)
+                if not content_text:
+                    self._output_stats[attempt_mode].record(latency, parsed=False)
+                    return self._deterministic_plan(
+                        transcript=transcript,
+                        app_name=active_app_name,
+                        warnings=["Provider returned empty content", *parse_warnings],
+                        loop_context=loop_context,
+                    )
+                parsed_payload = self._extract_json_payload(content_text)
 
-            parsed_payload = self._extract_json_payload(content_text)
+            self._output_stats[attempt_mode].record(latency, parsed=parsed_payload is not None)
             if parsed_payload is None:
                 return self._deterministic_plan(
                     transcript=transcript,
@@ -342,7 +538,8 @@ class MacOSUseAdapter:
                     loop_context=loop_context,
                 )
 
-            actions, plan_warnings = self._coerce_actions(parsed_payload.get("actions", []))
+            plan_payload = PROVIDER_PAYLOAD_ADAPTER.validate_python(parsed_payload)
+            actions, plan_warnings = split_actions(plan_payload.actions)
             actions = self._enforce_loop_state_actions(
                 actions=actions,
                 loop_context=loop_context,
@@ -366,12 +563,14 @@ class MacOSUseAdapter:
                     goal_state="blocked",
                     planner_note="Planner output could not be parsed safely.",
                     recovery_guidance="Try a shorter command or mention the app and target explicitly.",
+                    model=attempt_model,
+                    latency_ms=round(attempt_latency * 1000),
                 )
 
-            confidence = self._clamp_confidence(parsed_payload.get("confidence"))
-            summary = str(parsed_payload.get("summary") or "Anthropic generated plan")
+            confidence = self._clamp_confidence(plan_payload.confidence)
+            summary = plan_payload.summary or "Anthropic generated plan"
             goal_state = self._coerce_goal_state(parsed_payload, actions=actions, loop_context=loop_context)
-            planner_note = cast_optional_str(parsed_payload.get("planner_note"))
+            planner_note = plan_payload.planner_note
             if attempt_model != model:
                 fallback_note = f"[fallback model: {attempt_model}]"
                 planner_note = (
@@ -384,6 +583,8 @@ class MacOSUseAdapter:
                 warnings=parse_warnings + plan_warnings,
                 goal_state=goal_state,
                 planner_note=planner_note,
+                model=attempt_model,
+                latency_ms=round(attempt_latency * 1000),
             )
 
         return self._deterministic_plan(
@@ -393,6 +594,86 @@ class MacOSUseAdapter:
             loop_context=loop_context,
         )
 
+    def _request_timeout(
+        self,
+        model: str,
+        prompt_chars: int,
+        loop_deadline: float | None,
+    ) -> tuple[float, bool]:
+        """Return (timeout_seconds, bounded_by_loop_deadline) for one provider attempt."""
+        if settings.adaptive_plan_timeouts:
+            timeout = self._latency.timeout_for(model, prompt_chars)
+        else:
+            timeout = settings.anthropic_plan_timeout_seconds
+        if loop_deadline is None:
+            return timeout, False
+        remaining = loop_deadline - time.monotonic()
+        if remaining <= 0:
+            raise ProviderDeadlineExceeded(
+                "Loop deadline exhausted before contacting Anthropic.",
+                error_code="loop_deadline_exceeded",
+            )
+        if remaining < timeout:
+            return remaining, True
+        return timeout, False
+
+    async def _post_provider(
+        self,
+        url: str,
+        *,
+        headers: dict[str, str],
+        payload: dict[str, Any],
+        timeout: float,
+    ) -> tuple[httpx.Response, float]:
+        """
+        POST to the provider inside a concurrency slot, retrying 429s.
+
+        `timeout` applies to each HTTP request alone, and the returned latency
+        is that of the final request: time spent queued for a slot or backing
+        off is neither a provider timeout nor a latency sample. The slot is
+        released while backing off so a throttled request does not starve
+        other sessions. The final response is returned as-is, including a 429
+        once retries are exhausted.
+        """
+        http_timeout = httpx.Timeout(timeout=timeout, connect=min(10.0, timeout))
+        attempt = 0
+        while True:
+            async with self._provider_slots.slot():
+                started = time.monotonic()
+                async with asyncio.timeout(timeout):
+                    async with httpx.AsyncClient(timeout=http_timeout) as client:
+                        response = await client.post(url, headers=headers, json=payload)
+                latency = time.monotonic() - started
+            if response.status_code != 429 or attempt >= settings.provider_rate_limit_retries:
+                return response, latency
+            delay = self._retry_after_seconds(response)
+            if delay is None:
+                delay = 0.5 * (2**attempt)
+            delay = min(delay, settings.provider_max_retry_after_seconds)
+            await asyncio.sleep(delay + random.uniform(0.0, 0.1 + delay * 0.25))
+            attempt += 1
+
+    @staticmethod
+    def _retry_after_seconds(response: httpx.Response) -> float | None:
+        raw = response.headers.get("retry-after")
+        if not raw:
+            return None
+        try:
+            return max(0.0, float(raw))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _apply_output_mode(payload: dict[str, Any], mode: str) -> None:
+        if mode == "tool":
+            payload["system"] = PLANNER_SYSTEM_PROMPT_TOOL
+            payload["tools"] = [dict(PLAN_TOOL)]
+            payload["tool_choice"] = {"type": "tool", "name": PLAN_TOOL_NAME}
+        else:
+            payload["system"] = PLANNER_SYSTEM_PROMPT_JSON
+            payload.pop("tools", None)
+            payload.pop("tool_choice", None)
+
     def _extract_text_content(self, payload: dict[str, Any]) -> str | None:
         content = payload.get("content")
         if not isinstance(content, list):
@@ -405,119 +686,10 @@ class MacOSUseAdapter:
         return joined or None
 
     def _extract_json_payload(self, text: str) -> dict[str, Any] | None:
-        stripped = text.strip()
-        try:
-            parsed = json.loads(stripped)
-            if isinstance(parsed, dict):
-                return parsed
-        except json.JSONDecodeError:
-            pass
-
-        match = re.search(r"\{[\s\S]*\}", stripped)
-        if not match:
-            return None
-        try:
-            parsed = json.loads(match.group(0))
-            if isinstance(parsed, dict):
-                return parsed
-        except json.JSONDecodeError:
-            return None
-        return None
+        return extract_json_object(text)
 
     def _coerce_actions(self, raw_actions: list[dict[str, Any]]) -> tuple[list[Action], list[str]]:
-        actions: list[Action] = []
-        warnings: list[str] = []
-        for idx, raw in enumerate(raw_actions, start=1):
-            if not isinstance(raw, dict):
-                warnings.append(f"Action #{idx} is not an object")
-                continue
-            kind = str(raw.get("kind") or "").strip()
-            if kind not in self._allowed_action_kinds:
-                warnings.append(f"Rejected unknown action kind '{kind or 'missing'}' at index {idx}")
-                continue
-            try:
-                target = cast_optional_str(raw.get("target"))
-                text = cast_optional_str(raw.get("text"))
-                key_combo = cast_optional_str(raw.get("key_combo"))
-                app_bundle_id = cast_optional_str(raw.get("app_bundle_id"))
-                invalid_fields = self._missing_required_fields(
-                    kind=kind,
-                    target=target,
-                    text=text,
-                    key_combo=key_combo,
-                    app_bundle_id=app_bundle_id,
-                )
-                if invalid_fields:
-                    warnings.append(
-                        f"Rejected invalid action at index {idx}: missing required field(s) {', '.join(invalid_fields)} for kind '{kind}'"
-                    )
-                    continue
-                if kind in {"click", "double_click", "select_menu_item", "scroll"} and self._looks_like_placeholder_target(
-                    target
-                ):
-                    warnings.append(
-                        f"Rejected invalid action at index {idx}: placeholder target '{target}' for kind '{kind}'"
-                    )
-                    continue
-                actions.append(
-                    Action(
-                        id=str(raw.get("id") or f"a{idx}"),
-                        kind=kind,  # type: ignore[arg-type]
-                        target=target,
-                        text=text,
-                        key_combo=key_combo,
-                        app_bundle_id=app_bundle_id,
-                        timeout_ms=cast_int(raw.get("timeout_ms"), default=3000),
-                        destructive=bool(raw.get("destructive", False)),
-                        expected_outcome=cast_optional_str(raw.get("expected_outcome")),
-                    )
-                )
-            except Exception as exc:
-                warnings.append(f"Rejected invalid action at index {idx}: {exc}")
-                continue
-        return actions, warnings
-
-    @staticmethod
-    def _looks_like_placeholder_target(target: str | None) -> bool:
-        if not target:
-            return True
-        normalized = re.sub(r"\s+", " ", target.strip().lower())
-        explicit_placeholders = {
-            "first_search_result",
-            "search_result",
-            "first result",
-            "top result",
-            "search bar",
-            "search field",
-            "current field",
-            "focused field",
-            "input field",
-        }
-        if normalized in explicit_placeholders:
-            return True
-        if normalized.startswith("first_") and normalized.endswith("_result"):
-            return True
-        return False
-
-    @staticmethod
-    def _missing_required_fields(
-        *,
-        kind: str,
-        target: str | None,
-        text: str | None,
-        key_combo: str | None,
-        app_bundle_id: str | None,
-    ) -> list[str]:
-        missing: list[str] = []
-        if kind in {"click", "double_click", "select_menu_item", "scroll"} and not target:
-            missing.append("target")
-        if kind == "open_app" and not target and not app_bundle_id:
-            missing.append("target|app_bundle_id")
-        if kind in {"type", "run_applescript"} and not text:
-            missing.append("text")
-        if kind == "key_combo" and not key_combo:
-            missing.append("key_combo")
-        return missing
+        return split_actions(PROVIDER_ACTIONS_ADAPTER.validate_python(raw_actions))
 
     def _enforce_loop_state_actions(
         self,
@@ -529,7 +701,7 @@ class MacOSUseAdapter:
             return actions
 
         expected_state = loop_context.next_required_state
-        if expected_state not in {"COMMIT_ATTEMPTED", "COMPLETED"}:
+        if expected_state not in COMMIT_PHASE_STATES:
             return actions
 
         filtered: list[Action] = []
@@ -538,10 +710,8 @@ class MacOSUseAdapter:
                 continue
             if action.kind == "type":
                 continue
-            if action.kind == "key_combo":
-                combo = (action.key_combo or "").strip().lower().replace(" ", "")
-                if combo in {"cmd+n", "command+n", "tab"}:
-                    continue
+            if action.kind == "key_combo" and normalize_key_combo(action.key_combo) in NON_COMMIT_KEY_COMBOS:
+                continue
             filtered.append(action)
 
         if expected_state == "COMPLETED":
@@ -565,25 +735,21 @@ class MacOSUseAdapter:
     @staticmethod
     def _is_commit_action(action: Action) -> bool:
         if action.kind == "key_combo":
-            combo = (action.key_combo or "").strip().lower().replace(" ", "")
-            return combo in {
-                "enter",
-                "return",
-                "cmd+enter",
-                "command+enter",
-                "cmd+return",
-                "command+return",
-                "cmd+s",
-                "command+s",
-            }
+            return is_commit_key_combo(action.key_combo)
         if action.kind == "select_menu_item":
             target = (action.target or "").strip().lower()
-            return any(token in target for token in ("save", "done", "ok", "confirm"))
+            return any(token in target for token in COMMIT_MENU_TOKENS)
         return False
 
     @staticmethod
     def _reindex_actions(actions: list[Action]) -> list[Action]:
-        return [action.model_copy(update={"id": f"a{idx}"}) for idx, action in enumerate(actions, start=1)]
+        # Actions are treated as immutable once validated, so ones already
+        # carrying the right id are shared instead of copied.
+        reindexed: list[Action] = []
+        for idx, action in enumerate(actions, start=1):
+            action_id = f"a{idx}"
+            reindexed.append(action if action.id == action_id else action.model_copy(update={"id": action_id}))
+        return reindexed
 
     def _build_provider_prompt(
         self,
@@ -596,7 +762,7 @@ class MacOSUseAdapter:
         app_name = active_app_name or "Unknown"
         ax_preview = (ax_tree_summary or "")[:3500]
         app_pack = self._app_prompt_pack(app_name)
-        vendor_rules = self._important_rules[:2400] if self._important_rules else ""
+        vendor_rules = self.vendor_rules[:2400]
         loop_text = "none"
         if loop_context:
             recent_outcomes = self._format_recent_outcomes(loop_context.recent_action_results)
@@ -667,27 +833,36 @@ class MacOSUseAdapter:
             )
         return " | ".join(rendered)
 
-    def _select_model(self, transcript: str, *, active_app_name: str | None) -> str:
-        if active_app_name:
-            override = settings.model_overrides.get(active_app_name.lower())
-            if override:
-                return override
-        complexity_markers = [" and ", " then ", "after", "before", "reply", "send", "purchase"]
-        lower = transcript.lower()
-        is_complex = len(lower.split()) > 10 or any(marker in lower for marker in complexity_markers)
-        return settings.model_complex if is_complex else settings.model_simple
+    def _select_model(
+        self,
+        transcript: str,
+        *,
+        active_app_name: str | None,
+        routing: RoutingTable | None = None,
+    ) -> str:
+        table = routing or self._router.current()
+        model = table.select(transcript, app_name=active_app_name)
+        if self._learned_router is None:
+            return model
+        return self._learned_router.route(
+            transcript,
+            app_name=active_app_name,
+            heuristic_model=model,
+            pinned=table.override_for(active_app_name) is not None,
+            intent_class=table.matcher.scan(transcript).intent_class,
+        )
+
+    def _load_learned_router(self) -> None:
+        path = settings.learned_routing_file
+        if path is None or settings.learned_routing_mode == "off":
+            return
+        try:
+            self._learned_router = LearnedRouter(LearnedPolicy.load(path), mode=settings.learned_routing_mode)
+        except ValueError as exc:
+            self._learned_routing_error = str(exc)
 
     def _app_prompt_pack(self, app_name: str) -> str:
-        key = app_name.lower()
-        packs = {
-            "mail": "Prefer semantic compose/reply flows; require confirmation before send.",
-            "gmail": "Focus reply box detection and avoid pressing send without explicit user confirmation.",
-            "slack": "Prioritize active thread composer; avoid posting to wrong channel.",
-            "safari": "Use cmd+l for address bar and confirm page load target.",
-            "google chrome": "Use cmd+l for omnibox and verify URL matches intent.",
-            "finder": "Prefer menu actions for create/rename/move and avoid destructive operations by default.",
-        }
-        return packs.get(key, "Use safest deterministic actions and avoid irreversible operations.")
+        return app_prompt_pack(app_name)
 
     @staticmethod
     def _clamp_confidence(value: Any) -> float:
@@ -736,11 +911,11 @@ class MacOSUseAdapter:
                 recovery_guidance="Fell back to deterministic planner due to provider output issues.",
             )
 
-        url_match = re.search(r"(https?://\S+|\b\w+\.com\b)", text)
+        url_match = URL_RE.search(text)
         if "go to" in text and url_match:
             raw_url = url_match.group(1)
             url = raw_url if raw_url.startswith("http") else f"https://{raw_url}"
-            browser_target = app_name if app_name in {"Safari", "Google Chrome"} else "Safari"
+            browser_target = app_name if app_name in DETERMINISTIC_BROWSERS else "Safari"
             return AdapterResult(
                 actions=[
                     Action(id="a1", kind="open_app", target=browser_target, expected_outcome="Browser opened"),
@@ -779,7 +954,7 @@ class MacOSUseAdapter:
         loop_context: LoopContext | None,
     ) -> str:
         raw = str(payload.get("goal_state") or "").strip().lower()
-        if raw in {"in_progress", "complete", "blocked"}:
+        if raw in GOAL_STATES:
             return raw
 
         if isinstance(payload.get("done"), bool) and payload.get("done") is True:
@@ -806,24 +981,8 @@ class MacOSUseAdapter:
 
     @property
     def vendor_loaded(self) -> bool:
-        return self._vendor_loaded
+        return self._load_vendor_prompt_rules().loaded
 
     @property
     def vendor_rules(self) -> str:
-        return self._important_rules
-
-
-
-def cast_optional_str(value: Any) -> str | None:
-    if value is None:
-        return None
-    text = str(value).strip()
-    return text or None
-
-
-
-def cast_int(value: Any, *, default: int) -> int:
-    try:
-        return int(value)
-    except Exception:
-        return default
+        return self._load_vendor_prompt_rules().text
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass
+import re
+from typing import Callable, Mapping
+
+from core.schemas import Action, LoopContext
+
+
+BROWSER_APPS = frozenset({"safari", "google chrome", "arc", "firefox", "microsoft edge", "brave browser"})
+DEFAULT_BROWSER = "Safari"
+# Loop cycles execute at most this many actions (PlannerService trims longer plans).
+LOOP_BATCH_SIZE = 3
+
+_POLITE_PREFIX_RE = re.compile(r"^(?:please\s+|can you\s+|could you\s+|hey orange,?\s+)+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s.!?]+$")
+_SPACE_RE = re.compile(r"\s+")
+# Bare domains must end in a common web TLD so "report.pdf" or "notes.txt" stay
+# file names; TLDs that double as file extensions or bundle suffixes (md, py, sh,
+# rs, app) are left out.
+_WEB_TLDS = "|".join(
+    (
+        "com", "org", "net", "edu", "gov", "io", "ai", "dev", "co", "me", "us", "uk", "ca", "au", "de",
+        "fr", "es", "it", "nl", "jp", "in", "info", "biz", "tv", "ly", "gg", "so", "xyz", "news", "blog", "tech",
+        "cloud", "site", "page",
+    )
+)
+# Words that chain a second step ("open mail then reply") or pad the command.
+_MULTI_STEP_RE = r"(?!.*\b(?:and|then|also|after|before|plus|please)\b)"
+
+ActionBuilder = Callable[[re.Match[str], str], list[Action]]
+
+
+@dataclass(frozen=True, slots=True)
+class IntentRule:
+    """
+    One trivially plannable command.
+
+    `pattern` runs case-insensitively against the normalized transcript
+    (see `normalize_command`), so captured names keep the user's casing;
+    `build` receives the match and the active app name.
+    """
+
+    name: str
+    pattern: re.Pattern[str]
+    build: ActionBuilder
+    confidence: float
+    summary: str
+    apps: frozenset[str] | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class FastPathMatch:
+    intent: str
+    actions: list[Action]
+    confidence: float
+    summary: str
+
+
+def normalize_command(transcript: str) -> str:
+    text = _SPACE_RE.sub(" ", transcript.strip())
+    text = _TRAILING_PUNCT_RE.sub("", text)
+    prefix = _POLITE_PREFIX_RE.match(text.lower())
+    return text[prefix.end() :] if prefix else text
+
+
+def _browser_for(app_name: str) -> str:
+    return app_name if app_name.lower() in BROWSER_APPS else DEFAULT_BROWSER
+
+
+def _navigate(url: str, browser: str) -> list[Action]:
+    if not url.startswith(("http://", "https://")):
+        url = f"https://{url}"
+    return [
+        Action(id="a1", kind="open_app", target=browser, expected_outcome="Browser opened"),
+        Action(id="a2", kind="key_combo", key_combo="cmd+l", expected_outcome="Address bar focused"),
+        Action(id="a3", kind="type", text=url, expected_outcome=f"URL entered: {url}"),
+        Action(id="a4", kind="key_combo", key_combo="enter", expected_outcome="Page loads"),
+    ]
+
+
+def _shortcut(combo: str, outcome: str) -> ActionBuilder:
+    def build(match: re.Match[str], app_name: str) -> list[Action]:  # noqa: ARG001
+        return [Action(id="a1", kind="key_combo", key_combo=combo, expected_outcome=outcome)]
+
+    return build
+
+
+def _build_open_app(match: re.Match[str], app_name: str) -> list[Action]:  # noqa: ARG001
+    target = match.group("app")
+    return [Action(id="a1", kind="open_app", target=target, expected_outcome=f"{target} is frontmost")]
+
+
+def _build_navigate(match: re.Match[str], app_name: str) -> list[Action]:
+    return _navigate(match.group("url"), _browser_for(app_name))
+
+
+def _build_search(match: re.Match[str], app_name: str) -> list[Action]:  # noqa: ARG001
+    query = match.group("query")
+    return [
+        Action(id="a1", kind="key_combo", key_combo="cmd+l", expected_outcome="Address bar focused"),
+        Action(id="a2", kind="type", text=query, expected_outcome=f"Search entered: {query}"),
+        Action(id="a3", kind="key_combo", key_combo="enter", expected_outcome="Search results shown"),
+    ]
+
+
+# Order matters: the first matching rule wins, so specific intents precede
+# the generic "open <app>".
+INTENT_RULES: tuple[IntentRule, ...] = (
+    IntentRule(
+        name="navigate_url",
+        pattern=re.compile(
+            rf"^(?:go to|open|navigate to|visit)\s+(?P<url>https?://\S+|(?:[\w-]+\.)+(?:{_WEB_TLDS})(?:/\S*)?)$",
+            re.IGNORECASE,
+        ),
+        build=_build_navigate,
+        confidence=0.9,
+        summary="Navigate to {url}",
+    ),
+    IntentRule(
+        name="new_tab",
+        pattern=re.compile(r"^(?:open\s+)?(?:a\s+)?new tab$", re.IGNORECASE),
+        build=_shortcut("cmd+t", "New tab opened"),
+        confidence=0.92,
+        summary="Open a new tab",
+        apps=BROWSER_APPS,
+    ),
+    IntentRule(
+        name="search",
+        pattern=re.compile(r"^(?:search|google|look up)(?:\s+for)?\s+(?P<query>.{1,200})$", re.IGNORECASE),
+        build=_build_search,
+        confidence=0.85,
+        summary="Search for {query}",
+        apps=BROWSER_APPS,
+    ),
+    IntentRule(
+        name="save",
+        pattern=re.compile(r"^save(?:\s+(?:it|this|the (?:file|document|note)))?$", re.IGNORECASE),
+        build=_shortcut("cmd+s", "Document saved"),
+        confidence=0.9,
+        summary="Save",
+    ),
+    IntentRule(
+        name="undo",
+        pattern=re.compile(r"^undo(?:\s+(?:that|it|the last change))?$", re.IGNORECASE),
+        build=_shortcut("cmd+z", "Last change undone"),
+        confidence=0.9,
+        summary="Undo",
+    ),
+    IntentRule(
+        name="open_app",
+        # Names only: "open the report", "open a new note" or "open report.pdf"
+        # need the provider. "start" is left out: "start recording" is not an app.
+        pattern=re.compile(
+            rf"^(?:open|launch)\s+(?!(?:a|an|the|my|new|this|that)\b){_MULTI_STEP_RE}"
+            r"(?P<app>[A-Za-z][\w&'-]*(?: [\w&'-]+){0,2})$",
+            re.IGNORECASE,
+        ),
+        build=_build_open_app,
+        confidence=0.9,
+        summary="Open {app}",
+    ),
+)
+
+
+class FastPathPlanner:
+    """
+    Local intent matcher for trivial commands, consulted before the provider.
+
+    A rule's plan is used only when its confidence clears the per-intent
+    threshold (falling back to `min_confidence`). Counters record how many
+    plans were served locally versus sent to the provider.
+    """
+
+    def __init__(
+        self,
+        *,
+        rules: tuple[IntentRule, ...] = INTENT_RULES,
+        min_confidence: float = 0.8,
+        thresholds: Mapping[str, float] | None = None,
+    ) -> None:
+        self._rules = rules
+        self._min_confidence = min_confidence
+        self._thresholds = dict(thresholds or {})
+        self.hits: Counter[str] = Counter()
+        self.provider_calls = 0
+
+    def match(self, transcript: str, *, app_name: str | None) -> FastPathMatch | None:
+        command = normalize_command(transcript)
+        app = (app_name or "").strip()
+        app_key = app.lower()
+        for rule in self._rules:
+            if rule.apps is not None and app_key not in rule.apps:
+                continue
+            found = rule.pattern.match(command)
+            if found is None:
+                continue
+            if rule.confidence < self._thresholds.get(rule.name, self._min_confidence):
+                return None
+            return FastPathMatch(
+                intent=rule.name,
+                actions=rule.build(found, app),
+                confidence=rule.confidence,
+                summary=rule.summary.format(**found.groupdict()),
+            )
+        return None
+
+    def plan(
+        self,
+        transcript: str,
+        *,
+        app_name: str | None,
+        loop_context: LoopContext | None,
+        served_intent: str | None = None,
+    ) -> FastPathMatch | None:
+        """
+        In loop mode a matched plan is served in batches of at most
+        `LOOP_BATCH_SIZE` actions, one per cycle, each after the previous
+        batch verified successfully. Once every batch has run the command is
+        done; that is returned as a match with no actions. Later batches are
+        only served when `served_intent` says this session's earlier cycles
+        came from the same rule; a command that first matches mid-loop (the
+        provider opened Safari, now "search for cats" matches) is left to the
+        provider, as is anything after a failed verify or a replan.
+        """
+        if loop_context is None:
+            matched = self.match(transcript, app_name=app_name)
+            if matched is None:
+                return None
+        else:
+            if loop_context.cycle_index > 0 and (
+                served_intent is None
+                or loop_context.last_verify_status != "success"
+                or loop_context.replan_count > 0
+            ):
+                return None
+            found = self.match(transcript, app_name=app_name)
+            if found is None or (loop_context.cycle_index > 0 and found.intent != served_intent):
+                return None
+            start = loop_context.cycle_index * LOOP_BATCH_SIZE
+            matched = FastPathMatch(
+                intent=found.intent,
+                actions=found.actions[start : start + LOOP_BATCH_SIZE],
+                confidence=found.confidence,
+                summary=found.summary,
+            )
+        self.hits[matched.intent] += 1
+        return matched
+
+    def record_provider_call(self) -> None:
+        self.provider_calls += 1
+
+    @property
+    def saved_ratio(self) -> float:
+        local = sum(self.hits.values())
+        total = local + self.provider_calls
+        return local / total if total else 0.0
@@ -0,0 +1,302 @@
+"""
+Provider output parsing: locate the planner JSON in free text and validate it
+in one pass.
+
+In tool-use mode the plan arrives as the `PLAN_TOOL_NAME` tool input instead
+and skips text extraction. `extract_json_object` scans the text once, tracking string/escape state, and
+only hands balanced `{...}` spans to `json.loads`; the spans it tries never
+overlap, so total work stays linear in the response size. The payload is then
+validated by a single precompiled `TypeAdapter`; invalid actions are turned
+into `ActionRejection`s instead of failing the whole payload.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import json
+import re
+from types import MappingProxyType
+from typing import Annotated, Any, Callable
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, TypeAdapter, ValidationError, WrapValidator
+
+from core.schemas import Action
+from macos_use_adapter.rules import (
+    ALLOWED_ACTION_KINDS,
+    GOAL_STATES,
+    TARGET_REQUIRED_KINDS,
+    TEXT_REQUIRED_KINDS,
+    is_placeholder_target,
+)
+
+_STRUCTURAL_CHAR_RE = re.compile(r'[{}"\\]')
+
+
+def cast_optional_str(value: Any) -> str | None:
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def cast_int(value: Any, *, default: int) -> int:
+    try:
+        return int(value)
+    except Exception:
+        return default
+
+
+def _loads_object(text: str) -> dict[str, Any] | None:
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def extract_json_object(text: str) -> dict[str, Any] | None:
+    """
+    Return the first decodable top-level JSON object in `text`.
+
+    Tolerates code fences and prose around the object. If the outermost
+    braces never balance (or do not decode), the outermost balanced objects
+    nested inside them are tried in order.
+    """
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        parsed = _loads_object(stripped)
+        if parsed is not None:
+            return parsed
+
+    open_braces: list[int] = []
+    # Outermost balanced spans completed while an enclosing brace is still open.
+    nested_spans: list[tuple[int, int]] = []
+    in_string = False
+    escaped_until = -1
+    # Only braces, quotes and backslashes change state; skip everything else.
+    for match in _STRUCTURAL_CHAR_RE.finditer(stripped):
+        idx = match.start()
+        if idx < escaped_until:
+            continue
+        char = match.group()
+        if in_string:
+            if char == "\\":
+                escaped_until = idx + 2
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            if open_braces:
+                in_string = True
+        elif char == "{":
+            open_braces.append(idx)
+        elif char == "}" and open_braces:
+            start = open_braces.pop()
+            if open_braces:
+                while nested_spans and nested_spans[-1][0] > start:
+                    nested_spans.pop()
+                nested_spans.append((start, idx + 1))
+                continue
+            parsed = _loads_object(stripped[start : idx + 1])
+            if parsed is not None:
+                return parsed
+            parsed = _first_decodable(stripped, nested_spans)
+            if parsed is not None:
+                return parsed
+            nested_spans.clear()
+
+    return _first_decodable(stripped, nested_spans)
+
+
+def _first_decodable(text: str, spans: list[tuple[int, int]]) -> dict[str, Any] | None:
+    for start, end in spans:
+        parsed = _loads_object(text[start:end])
+        if parsed is not None:
+            return parsed
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class ActionRejection:
+    """A provider action that failed validation; formatted into a plan warning."""
+
+    code: str
+    detail: str = ""
+
+    def message(self, index: int) -> str:
+        if self.code == "not_object":
+            return f"Action #{index} is not an object"
+        if self.code == "unknown_kind":
+            return f"Rejected unknown action kind '{self.detail}' at index {index}"
+        return f"Rejected invalid action at index {index}: {self.detail}"
+
+
+class _Rejected(Exception):
+    def __init__(self, rejection: ActionRejection) -> None:
+        super().__init__(rejection.detail)
+        self.rejection = rejection
+
+
+def missing_required_fields(
+    *,
+    kind: str,
+    target: str | None,
+    text: str | None,
+    key_combo: str | None,
+    app_bundle_id: str | None,
+) -> list[str]:
+    missing: list[str] = []
+    if kind in TARGET_REQUIRED_KINDS and not target:
+        missing.append("target")
+    if kind == "open_app" and not target and not app_bundle_id:
+        missing.append("target|app_bundle_id")
+    if kind in TEXT_REQUIRED_KINDS and not text:
+        missing.append("text")
+    if kind == "key_combo" and not key_combo:
+        missing.append("key_combo")
+    return missing
+
+
+def _prepare_action(raw: Any) -> dict[str, Any]:
+    if not isinstance(raw, dict):
+        raise _Rejected(ActionRejection("not_object"))
+    kind = str(raw.get("kind") or "").strip()
+    if kind not in ALLOWED_ACTION_KINDS:
+        raise _Rejected(ActionRejection("unknown_kind", kind or "missing"))
+
+    target = cast_optional_str(raw.get("target"))
+    text = cast_optional_str(raw.get("text"))
+    key_combo = cast_optional_str(raw.get("key_combo"))
+    app_bundle_id = cast_optional_str(raw.get("app_bundle_id"))
+    missing = missing_required_fields(
+        kind=kind,
+        target=target,
+        text=text,
+        key_combo=key_combo,
+        app_bundle_id=app_bundle_id,
+    )
+    if missing:
+        raise _Rejected(
+            ActionRejection("invalid", f"missing required field(s) {', '.join(missing)} for kind '{kind}'")
+        )
+    if kind in TARGET_REQUIRED_KINDS and is_placeholder_target(target):
+        raise _Rejected(ActionRejection("invalid", f"placeholder target '{target}' for kind '{kind}'"))
+
+    return {
+        "id": str(raw.get("id")),
+        "kind": kind,
+        "target": target,
+        "text": text,
+        "key_combo": key_combo,
+        "app_bundle_id": app_bundle_id,
+        "timeout_ms": cast_int(raw.get("timeout_ms"), default=3000),
+        "destructive": bool(raw.get("destructive", False)),
+        "expected_outcome": cast_optional_str(raw.get("expected_outcome")),
+    }
+
+
+def _collect_rejection(value: Any, handler: Callable[[Any], Action]) -> Action | ActionRejection:
+    try:
+        return handler(value)
+    except _Rejected as exc:
+        return exc.rejection
+    except ValidationError as exc:
+        detail = "; ".join(
+            f"{'.'.join(str(part) for part in error['loc']) or 'action'}: {error['msg']}" for error in exc.errors()
+        )
+        return ActionRejection("invalid", detail)
+
+
+def _number_actions(value: Any) -> list[Any]:
+    """Default missing ids to their 1-based position, as the prompt's a1, a2, ..."""
+    if not isinstance(value, list):
+        return []
+    return [
+        {**raw, "id": f"a{idx}"} if isinstance(raw, dict) and not raw.get("id") else raw
+        for idx, raw in enumerate(value, start=1)
+    ]
+
+
+ProviderAction = Annotated[Action, BeforeValidator(_prepare_action), WrapValidator(_collect_rejection)]
+ProviderActions = Annotated[list[ProviderAction], BeforeValidator(_number_actions)]
+
+
+class ProviderPlanPayload(BaseModel):
+    """Lenient view of the planner JSON; unknown keys are ignored."""
+
+    model_config = ConfigDict(extra="ignore")
+
+    summary: Annotated[str | None, BeforeValidator(cast_optional_str)] = None
+    confidence: Any = None
+    goal_state: Any = None
+    done: Any = None
+    planner_note: Annotated[str | None, BeforeValidator(cast_optional_str)] = None
+    actions: ProviderActions = Field(default_factory=list)
+
+
+PROVIDER_PAYLOAD_ADAPTER = TypeAdapter(ProviderPlanPayload)
+PROVIDER_ACTIONS_ADAPTER = TypeAdapter(ProviderActions)
+
+
+def split_actions(items: list[Action | ActionRejection]) -> tuple[list[Action], list[str]]:
+    actions: list[Action] = []
+    warnings: list[str] = []
+    for idx, item in enumerate(items, start=1):
+        if isinstance(item, ActionRejection):
+            warnings.append(item.message(idx))
+        else:
+            actions.append(item)
+    return actions, warnings
+
+
+PLAN_TOOL_NAME = "submit_action_plan"
+PLAN_TOOL = MappingProxyType(
+    {
+        "name": PLAN_TOOL_NAME,
+        "description": "Submit the next micro-step plan (1-3 safe macOS actions).",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "summary": {"type": "string"},
+                "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+                "goal_state": {"type": "string", "enum": sorted(GOAL_STATES)},
+                "planner_note": {"type": "string"},
+                "actions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "string"},
+                            "kind": {"type": "string", "enum": sorted(ALLOWED_ACTION_KINDS)},
+                            "target": {"type": ["string", "null"]},
+                            "text": {"type": ["string", "null"]},
+                            "key_combo": {"type": ["string", "null"]},
+                            "app_bundle_id": {"type": ["string", "null"]},
+                            "timeout_ms": {"type": "integer", "minimum": 100, "maximum": 120000},
+                            "destructive": {"type": "boolean"},
+                            "expected_outcome": {"type": ["string", "null"]},
+                        },
+                        "required": ["kind"],
+                    },
+                },
+            },
+            "required": ["summary", "confidence", "goal_state", "actions"],
+        },
+    }
+)
+
+
+def extract_tool_input(body: dict[str, Any]) -> dict[str, Any] | None:
+    """Return the input of the first `PLAN_TOOL_NAME` tool_use block, if any."""
+    content = body.get("content")
+    if not isinstance(content, list):
+        return None
+    for block in content:
+        if (
+            isinstance(block, dict)
+            and block.get("type") == "tool_use"
+            and block.get("name") == PLAN_TOOL_NAME
+            and isinstance(block.get("input"), dict)
+        ):
+            return block["input"]
+    return None
@@ -0,0 +1,131 @@
+"""
+Compiled patterns and lookup tables shared by the adapter's per-action paths.
+
+Everything here is built once at import. Key combos and labels go through
+`normalize_key_combo` / `normalize_label` before any table lookup so callers
+never re-implement the normalization.
+"""
+
+from __future__ import annotations
+
+import re
+from types import MappingProxyType
+
+
+WHITESPACE_RE = re.compile(r"\s+")
+URL_RE = re.compile(r"(https?://\S+|\b\w+\.com\b)")
+VENDOR_IMPORTANT_RULES_RE = re.compile(
+    r'def important_rules\(self\) -> str:\n\s+""".*?"""\n\s+text = """(.*?)"""',
+    flags=re.DOTALL,
+)
+PLACEHOLDER_PATTERN_RE = re.compile(r"^first_(?:.*_)?result$")
+
+ALLOWED_ACTION_KINDS = frozenset(
+    {
+        "click",
+        "double_click",
+        "type",
+        "key_combo",
+        "scroll",
+        "open_app",
+        "run_applescript",
+        "select_menu_item",
+        "wait",
+    }
+)
+TARGET_REQUIRED_KINDS = frozenset({"click", "double_click", "select_menu_item", "scroll"})
+TEXT_REQUIRED_KINDS = frozenset({"type", "run_applescript"})
+
+PLACEHOLDER_TARGETS = frozenset(
+    {
+        "first_search_result",
+        "search_result",
+        "first result",
+        "top result",
+        "search bar",
+        "search field",
+        "current field",
+        "focused field",
+        "input field",
+    }
+)
+
+COMMIT_KEY_COMBOS = frozenset(
+    {
+        "enter",
+        "return",
+        "cmd+enter",
+        "command+enter",
+        "cmd+return",
+        "command+return",
+        "cmd+s",
+        "command+s",
+    }
+)
+# Shortcuts that start a new item or move on instead of committing the current one.
+NON_COMMIT_KEY_COMBOS = frozenset({"cmd+n", "command+n", "tab"})
+COMMIT_MENU_TOKENS = ("save", "done", "ok", "confirm")
+COMMIT_PHASE_STATES = frozenset({"COMMIT_ATTEMPTED", "COMPLETED"})
+GOAL_STATES = frozenset({"in_progress", "complete", "blocked"})
+
+DETERMINISTIC_BROWSERS = frozenset({"Safari", "Google Chrome"})
+# Transcript policy terms, matched as whole words by `core.policy_matcher`.
+COMPLEXITY_MARKERS = ("and", "then", "after", "before", "reply", "send", "sending", "purchase")
+# Terms that make a plan require confirmation at any strictness...
+RISK_TERMS = (
+    # Every inflection is listed: whole-word matching has no stemming, and the
+    # old substring checks caught "posted" or "deleted" through their stems.
+    "send", "sends", "sending", "sent", "resend", "resends", "resending",
+    "delete", "deletes", "deleted", "deleting",
+    "purchase", "purchases", "purchased", "purchasing",
+    "buy", "buys", "buying", "bought",
+    "post", "posts", "posted", "posting", "repost", "reposts", "reposted", "reposting",
+    "submit", "submits", "submitted", "submitting",
+)
+# ...and the ones that only count under ORANGE_SAFETY_STRICTNESS=strict.
+STRICT_RISK_TERMS = ("pay", "payment", "transfer", "checkout", "publish", "erase", "empty trash")
+# Intent classes for routing; the first class with a hit wins.
+INTENT_CLASS_TERMS = (
+    ("purchase", ("buy", "purchase", "order", "checkout", "pay")),
+    ("compose", ("reply", "send", "write", "draft", "compose", "email", "message", "post")),
+    ("multi_step", ("and then", "then", "after", "before", "and")),
+    ("search", ("search", "find", "look up", "google")),
+    ("navigate", ("open", "go to", "visit", "navigate", "launch", "switch to")),
+    ("edit", ("type", "paste", "copy", "rename", "delete", "save", "format", "insert")),
+)
+DEFAULT_INTENT_CLASS = "general"
+
+APP_PROMPT_PACKS = MappingProxyType(
+    {
+        "mail": "Prefer semantic compose/reply flows; require confirmation before send.",
+        "gmail": "Focus reply box detection and avoid pressing send without explicit user confirmation.",
+        "slack": "Prioritize active thread composer; avoid posting to wrong channel.",
+        "safari": "Use cmd+l for address bar and confirm page load target.",
+        "google chrome": "Use cmd+l for omnibox and verify URL matches intent.",
+        "finder": "Prefer menu actions for create/rename/move and avoid destructive operations by default.",
+    }
+)
+DEFAULT_APP_PROMPT_PACK = "Use safest deterministic actions and avoid irreversible operations."
+
+
+def normalize_key_combo(combo: str | None) -> str:
+    return (combo or "").lower().replace(" ", "").strip()
+
+
+def normalize_label(label: str | None) -> str:
+    return WHITESPACE_RE.sub(" ", (label or "").strip().lower())
+
+
+def is_commit_key_combo(combo: str | None) -> bool:
+    return normalize_key_combo(combo) in COMMIT_KEY_COMBOS
+
+
+def is_placeholder_target(target: str | None) -> bool:
+    if not target:
+        return True
+    normalized = normalize_label(target)
+    return normalized in PLACEHOLDER_TARGETS or PLACEHOLDER_PATTERN_RE.match(normalized) is not None
+
+
+def app_prompt_pack(app_name: str) -> str:
+    return APP_PROMPT_PACKS.get(app_name.lower(), DEFAULT_APP_PROMPT_PACK)
@@ -0,0 +1,116 @@
+"""
+Extraction and caching of the vendored macOS-use safety rules.
+
+Extracting the rules imports `mlx_use.agent.prompts` from the vendor checkout
+(falling back to scanning its source), which is too slow for sidecar start.
+`load_vendor_rules` is therefore only called on first use, and a successful
+extraction is persisted to a small JSON cache keyed by the pinned vendor
+commit, so later launches read one file instead.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import sys
+
+from macos_use_adapter.rules import VENDOR_IMPORTANT_RULES_RE
+
+
+VENDOR_ACTION_DESCRIPTION = (
+    "open_app, click, double_click, type, key_combo, scroll, run_applescript, select_menu_item, wait"
+)
+
+
+@dataclass(frozen=True, slots=True)
+class VendorRules:
+    text: str
+    # "cache", "import", "source" or "missing".
+    origin: str
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.text)
+
+
+def read_vendor_commit(commit_file: Path) -> str | None:
+    try:
+        commit = commit_file.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return commit or None
+
+
+def load_vendor_rules(*, vendor_path: Path, commit_file: Path, cache_path: Path) -> VendorRules:
+    commit = read_vendor_commit(commit_file)
+    if commit is not None:
+        cached = _read_cache(cache_path, commit)
+        if cached is not None:
+            return VendorRules(text=cached, origin="cache")
+
+    rules = extract_vendor_rules(vendor_path)
+    # Empty results are not cached: the submodule may be checked out later at
+    # the same pinned commit.
+    if commit is not None and rules.loaded:
+        _write_cache(cache_path, commit, rules.text)
+    return rules
+
+
+def extract_vendor_rules(vendor_path: Path) -> VendorRules:
+    if not vendor_path.exists():
+        return VendorRules(text="", origin="missing")
+
+    sys.path.insert(0, str(vendor_path))
+    try:
+        from mlx_use.agent.prompts import SystemPrompt  # type: ignore
+
+        prompt = SystemPrompt(
+            action_description=VENDOR_ACTION_DESCRIPTION,
+            current_date=datetime.now(),
+            max_actions_per_step=4,
+        )
+        return VendorRules(text=prompt.important_rules(), origin="import")
+    except Exception:
+        text = load_rules_from_source(vendor_path)
+        return VendorRules(text=text, origin="source" if text else "missing")
+    finally:
+        if str(vendor_path) in sys.path:
+            sys.path.remove(str(vendor_path))
+
+
+def load_rules_from_source(vendor_path: Path) -> str:
+    prompt_file = vendor_path / "mlx_use" / "agent" / "prompts.py"
+    if not prompt_file.exists():
+        return ""
+
+    content = prompt_file.read_text(encoding="utf-8")
+    match = VENDOR_IMPORTANT_RULES_RE.search(content)
+    if not match:
+        return ""
+    return match.group(1).strip()
+
+
+def _read_cache(cache_path: Path, commit: str) -> str | None:
+    try:
+        payload = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(payload, dict) or payload.get("commit") != commit:
+        return None
+    text = payload.get("rules")
+    return text if isinstance(text, str) and text else None
+
+
+def _write_cache(cache_path: Path, commit: str, text: str) -> None:
+    # Best effort: a read-only or missing cache directory only costs the
+    # extraction again on the next launch.
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(json.dumps({"commit": commit, "rules": text}), encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
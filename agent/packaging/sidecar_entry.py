@@ -3,7 +3,7 @@ from __future__ import annotations
 import argparse
 
 import uvicorn
-from app.main import app as fastapi_app
+from app.startup import app as sidecar_app
 
 
 def main() -> None:
@@ -13,8 +13,10 @@ def main() -> None:
     parser.add_argument("--log-level", default="info")
     args = parser.parse_args()
 
+    # `sidecar_app` binds and answers /health before the FastAPI app is
+    # imported; see app/startup.py.
     uvicorn.run(
-        fastapi_app,
+        sidecar_app,
         host=args.host,
         port=args.port,
         log_level=args.log_level,
@@ -1,14 +1,50 @@
 from __future__ import annotations
 
+import asyncio
+import io
+import json
 import os
-
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import time
+from types import MappingProxyType
+
+import httpx
 from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw
 
 from app import main as app_main
 from app.main import app
-from core.schemas import Action, LoopContext
+from app.responses import ModelJSONResponse
+from app.startup import PROFILE_PATH, LazySidecarApp
+from core.circuit_breaker import CircuitBreaker
+from core.context_delta import exact_context_delta, fast_context_delta
+from core.context_parser import parse_context
+from core.event_bus import EventBus
+from core.latency_budget import LatencyBudget
+from core.learned_routing import (
+    LearnedPolicy,
+    LearnedRouter,
+    classify_intent,
+    outcomes_from_telemetry,
+    shadow_report,
+    train_policy,
+)
+from core.model_routing import ModelRouter, compile_routing_table, parse_model_overrides
+from core.planner_service import PlannerService
+from core.policy_matcher import PolicyMatcher, compile_policy_matcher
+from core.rate_limiter import PlanAdmissionController
+from core.schemas import Action, ActionPlan, LoopContext, PlanRequest, TelemetryEvent
+from core.screenshots import prepare_screenshot
+from core.verifier_service import PlanFeatures, VerifierService
 from macos_use_adapter.adapter import AdapterResult
 from macos_use_adapter.adapter import MacOSUseAdapter
+from macos_use_adapter.adapter import ProviderConfigurationError
+from macos_use_adapter.fast_path import FastPathPlanner
+from macos_use_adapter.payload import extract_json_object
+from macos_use_adapter.vendor_rules import VendorRules, load_vendor_rules
 
 
 client = TestClient(app)
@@ -58,6 +94,7 @@ def test_plan_returns_actions_with_valid_key(monkeypatch) -> None:
         ax_tree_summary: str | None,
         api_key: str,
         loop_context,
+        screenshot=None,
     ) -> AdapterResult:  # noqa: ARG001
         return AdapterResult(
             actions=[Action(id="a1", kind="open_app", target="Safari", expected_outcome="Safari opened")],
@@ -245,6 +282,7 @@ def test_plan_accepts_loop_context_and_complete_goal_state(monkeypatch) -> None:
         ax_tree_summary: str | None,
         api_key: str,
         loop_context,
+        screenshot=None,
     ) -> AdapterResult:  # noqa: ARG001
         assert loop_context is not None
         return AdapterResult(
@@ -292,6 +330,7 @@ def test_plan_trims_loop_actions_to_micro_batch(monkeypatch) -> None:
         ax_tree_summary: str | None,
         api_key: str,
         loop_context,
+        screenshot=None,
     ) -> AdapterResult:  # noqa: ARG001
         return AdapterResult(
             actions=[
@@ -594,3 +633,1294 @@ def test_verify_no_progress_for_redundant_open_app() -> None:
     assert body["status"] == "failure"
     assert body["state"] == "APP_ACTIVE"
     assert "Open-app action did not change active app or window" in body["reason"]
+
+
+def test_plan_rate_limited_per_session(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    monkeypatch.setattr(
+        app_main._planner,
+        "_admission",
+        PlanAdmissionController(
+            session_rate_per_minute=1,
+            session_burst=1,
+            global_rate_per_minute=600,
+            global_burst=100,
+        ),
+    )
+
+    async def fake_plan_with_anthropic(**kwargs) -> AdapterResult:  # noqa: ARG001
+        return AdapterResult(
+            actions=[Action(id="a1", kind="open_app", target="Safari")],
+            confidence=0.9,
+            summary="Open Safari",
+            warnings=[],
+        )
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+
+    payload = {"schema_version": 1, "session_id": "session-rate-limited", "transcript": "open Safari"}
+    assert client.post("/v1/plan", json=payload).status_code == 200
+
+    limited = client.post("/v1/plan", json=payload)
+    assert limited.status_code == 429
+    assert limited.json()["detail"]["error_code"] == "rate_limited"
+    assert int(limited.headers["retry-after"]) >= 1
+
+    other_session = client.post("/v1/plan", json={**payload, "session_id": "session-rate-other"})
+    assert other_session.status_code == 200
+
+
+def test_provider_429_retries_with_retry_after(monkeypatch) -> None:
+    calls: list[int] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(1)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after": "0"}, json={"error": {"type": "rate_limit_error"}})
+        return httpx.Response(
+            200,
+            json={"content": [{"type": "text", "text": '{"summary":"Open Safari","confidence":0.9,"actions":[{"id":"a1","kind":"open_app","target":"Safari"}]}'}]},
+        )
+
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        lambda **kwargs: real_async_client(transport=httpx.MockTransport(handler), **kwargs),
+    )
+
+    adapter = MacOSUseAdapter()
+    result = asyncio.run(
+        adapter._plan_with_anthropic(
+            transcript="open Safari",
+            active_app_name="Finder",
+            ax_tree_summary=None,
+            api_key="sk-ant-test-key",
+            loop_context=None,
+        )
+    )
+
+    assert len(calls) == 2
+    assert result.actions[0].kind == "open_app"
+
+
+def test_provider_backoff_is_not_counted_as_request_time(monkeypatch) -> None:
+    calls: list[int] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(1)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after": "0.3"}, json={"error": {"type": "rate_limit_error"}})
+        return httpx.Response(
+            200,
+            json={"content": [{"type": "text", "text": '{"summary":"Open Safari","confidence":0.9,"actions":[{"id":"a1","kind":"open_app","target":"Safari"}]}'}]},
+        )
+
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        lambda **kwargs: real_async_client(transport=httpx.MockTransport(handler), **kwargs),
+    )
+
+    adapter = MacOSUseAdapter()
+    # A tight adaptive timeout, shorter than the Retry-After backoff.
+    monkeypatch.setattr(adapter, "_request_timeout", lambda model, prompt_chars, loop_deadline: (0.2, False))
+    observed: list[float] = []
+    monkeypatch.setattr(adapter._latency, "observe", lambda model, prompt_chars, seconds: observed.append(seconds))
+
+    result = asyncio.run(
+        adapter._plan_with_anthropic(
+            transcript="open Safari",
+            active_app_name="Finder",
+            ax_tree_summary=None,
+            api_key="sk-ant-test-key",
+            loop_context=None,
+        )
+    )
+
+    assert len(calls) == 2
+    assert result.actions[0].kind == "open_app"
+    assert len(observed) == 1 and observed[0] < 0.2
+    assert result.latency_ms < 200
+
+
+def test_identical_concurrent_plans_share_one_provider_call() -> None:
+    class CountingAdapter:
+        calls = 0
+
+        async def plan_actions(self, **kwargs) -> AdapterResult:  # noqa: ARG002
+            CountingAdapter.calls += 1
+            await asyncio.sleep(0.05)
+            return AdapterResult(
+                actions=[Action(id="a1", kind="open_app", target="Safari")],
+                confidence=0.9,
+                summary="Open Safari",
+                warnings=[],
+            )
+
+    planner = PlannerService(EventBus(), adapter=CountingAdapter())  # type: ignore[arg-type]
+
+    async def run() -> list:
+        requests = [
+            PlanRequest(session_id="session-a", transcript="open Safari", app={"name": "Finder"}),
+            PlanRequest(session_id="session-b", transcript="open Safari", app={"name": "Finder"}),
+            PlanRequest(session_id="session-c", transcript="open Notes", app={"name": "Finder"}),
+        ]
+        return await asyncio.gather(*(planner.plan(request) for request in requests))
+
+    plans = asyncio.run(run())
+
+    assert CountingAdapter.calls == 2
+    assert [plan.session_id for plan in plans] == ["session-a", "session-b", "session-c"]
+    assert plans[0].actions[0].target == plans[1].actions[0].target == "Safari"
+
+
+def test_circuit_breaker_serves_fallback_and_recovers(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    now = [1000.0]
+    breaker = CircuitBreaker(
+        failure_threshold=2,
+        open_seconds=30,
+        slow_call_seconds=20,
+        slow_call_ratio=0.6,
+        window=5,
+        clock=lambda: now[0],
+    )
+    adapter = app_main._planner._adapter
+    monkeypatch.setattr(adapter, "_breaker", breaker)
+    provider_up = [False]
+
+    async def flaky_plan_with_anthropic(**kwargs) -> AdapterResult:  # noqa: ARG001
+        if not provider_up[0]:
+            raise ProviderConfigurationError(
+                "Anthropic service is temporarily unavailable.",
+                status_code=503,
+                error_code="provider_unavailable",
+            )
+        return AdapterResult(
+            actions=[Action(id="a1", kind="open_app", target="Notes")],
+            confidence=0.9,
+            summary="Open Notes",
+            warnings=[],
+        )
+
+    monkeypatch.setattr(adapter, "_plan_with_anthropic", flaky_plan_with_anthropic)
+    payload = {"schema_version": 1, "session_id": "session-breaker", "transcript": "open Notes and start a list"}
+
+    for idx in range(2):
+        failed = client.post("/v1/plan", json={**payload, "session_id": f"session-breaker-{idx}"})
+        assert failed.status_code == 503
+
+    status_body = client.get("/v1/provider/status").json()
+    assert status_body["circuit_state"] == "open"
+    assert status_body["health"] is False
+
+    fallback = client.post("/v1/plan", json={**payload, "session_id": "session-breaker-open"})
+    assert fallback.status_code == 200
+    assert fallback.json()["actions"][0]["kind"] == "open_app"
+
+    now[0] += 31
+    provider_up[0] = True
+    assert client.get("/v1/provider/status").json()["circuit_state"] == "half_open"
+    probe = client.post("/v1/plan", json={**payload, "session_id": "session-breaker-probe"})
+    assert probe.status_code == 200
+    assert client.get("/v1/provider/status").json()["circuit_state"] == "closed"
+
+
+def test_circuit_breaker_ignores_stale_calls_during_half_open() -> None:
+    now = [1000.0]
+    breaker = CircuitBreaker(
+        failure_threshold=2,
+        open_seconds=30,
+        slow_call_seconds=20,
+        slow_call_ratio=0.6,
+        window=5,
+        clock=lambda: now[0],
+    )
+    first, second, stale_success, stale_failure = (breaker.allow_request() for _ in range(4))
+    breaker.record_failure(first, "provider_unavailable")
+    breaker.record_failure(second, "provider_unavailable")
+    assert breaker.state == "open"
+
+    now[0] += 31
+    probe = breaker.allow_request()
+    assert probe is not None and probe.probe
+    # Calls admitted before the trip finish while the probe is in flight.
+    breaker.record_success(stale_success, 0.1)
+    assert breaker.state == "half_open"
+    breaker.record_failure(stale_failure, "provider_unavailable")
+    assert breaker.state == "half_open"
+    assert breaker.allow_request() is None
+
+    breaker.record_success(probe, 0.1)
+    assert breaker.state == "closed"
+
+
+def test_latency_budget_tightens_timeout_from_observed_latency() -> None:
+    budget = LatencyBudget(ceiling_seconds=60, floor_seconds=2, multiplier=1.5, margin_seconds=1, min_samples=4)
+    assert budget.timeout_for("claude-3-5-haiku-latest", 1_500) == 60
+
+    for latency in (1.0, 1.2, 1.4, 2.0):
+        budget.observe("claude-3-5-haiku-latest", 1_500, latency)
+
+    assert budget.timeout_for("claude-3-5-haiku-latest", 1_500) == 4.0
+    # Other models and prompt sizes keep their own distributions.
+    assert budget.timeout_for("claude-3-5-sonnet-latest", 1_500) == 60
+    assert budget.timeout_for("claude-3-5-haiku-latest", 12_000) == 60
+
+
+def test_plan_with_exhausted_loop_budget_returns_deadline_error(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    payload = {
+        "schema_version": 1,
+        "session_id": "session-loop-deadline",
+        "transcript": "continue",
+        "app": {"name": "Notes"},
+        "loop_context": {
+            "goal_transcript": "write a note",
+            "cycle_index": 3,
+            "replan_count": 0,
+            "max_cycles": 6,
+            "max_replans": 2,
+            "remaining_budget_ms": 0,
+        },
+    }
+    response = client.post("/v1/plan", json=payload)
+    assert response.status_code == 504
+    assert response.json()["detail"]["error_code"] == "loop_deadline_exceeded"
+    assert app_main._planner._adapter.breaker.state == "closed"
+
+
+def test_fast_context_delta_agrees_with_exact_on_small_contexts() -> None:
+    before = "app=Safari, window=Window 1, url=about:blank, ax_lines=2"
+    after = "app=Safari, window=Address Bar, url=https://apple.com, ax_lines=2"
+    assert fast_context_delta(before, after) == exact_context_delta(before, after)
+    assert fast_context_delta("same", "same") == 0.0
+    assert fast_context_delta("", "after") == 1.0
+
+
+def test_fast_context_delta_on_large_contexts() -> None:
+    lines = [f"AXButton 'Item {idx}' [{idx}]" for idx in range(400)]
+    before = "\n".join(["app=Notes, window=New Note, url=n/a, ax_lines=400", *lines])
+    assert fast_context_delta(before, before) == 0.0
+
+    small_change = before.replace("'Item 200'", "'Item 9200'")
+    assert 0.0 < fast_context_delta(before, small_change) < 0.05
+
+    rewritten = "\n".join(["app=Mail, window=Inbox, url=n/a, ax_lines=400"] + [f"AXRow 'Mail {i}'" for i in range(400)])
+    assert fast_context_delta(before, rewritten) > 0.5
+
+    # Very different sizes return the length bound that real_quick_ratio() would give.
+    truncated = before[:2_000]
+    assert fast_context_delta(before, truncated) == 1.0 - 2.0 * len(truncated) / (len(before) + len(truncated))
+
+
+def test_parse_context_handles_quoted_and_comma_values() -> None:
+    quoted = parse_context('app=Mail, window="Re: lunch, Friday", url=n/a, ax_lines=3')
+    assert quoted.app == "mail"
+    assert quoted.window == "re: lunch, friday"
+    assert quoted.get("ax_lines") == "3"
+
+    unquoted = parse_context("app=Mail, window=Re: lunch, Friday, url=n/a")
+    assert unquoted.window == "re: lunch, friday"
+    assert unquoted.get("url") == "n/a"
+
+    nested = parse_context("app=Safari, url=https://example.com/?app=evil, window=Home\nAXButton 'Go'")
+    assert nested.app == "safari"
+    assert nested.window == "home"
+
+    assert not parse_context("same").has_app
+
+    # Different AX dumps under the same header share one cached, read-only parse.
+    assert parse_context("app=Safari, window=Home\nAXButton 'Back'") is parse_context("app=Safari, window=Home\nAXLink 'Docs'")
+    assert isinstance(nested.fields, MappingProxyType)
+
+
+def test_plan_features_drive_state_transition_rules() -> None:
+    features = PlanFeatures.from_actions(
+        [
+            Action(id="a1", kind="click", target="Compose"),
+            Action(id="a2", kind="key_combo", key_combo="Cmd + Return"),
+        ]
+    )
+    assert features.kinds == {"click", "key_combo"}
+    assert features.has_commit is True
+    assert features.first_target == "compose"
+    assert VerifierService._infer_state_transition(features) == "COMMIT_ATTEMPTED"
+    assert VerifierService._infer_state_transition(PlanFeatures.from_actions([])) == "APP_ACTIVE"
+
+
+def test_verify_batch_returns_result_per_request() -> None:
+    def make_request(session_id: str, execution_result: str) -> dict:
+        return {
+            "schema_version": 1,
+            "session_id": session_id,
+            "action_plan": {
+                "schema_version": 1,
+                "session_id": session_id,
+                "actions": [{"id": "a1", "kind": "click", "target": "Send button"}],
+                "confidence": 0.8,
+                "risk_level": "low",
+                "requires_confirmation": False,
+            },
+            "execution_result": execution_result,
+            "reason": "Element not found" if execution_result == "failure" else None,
+            "before_context": "app=Mail, window=Inbox, url=n/a, ax_lines=10",
+            "after_context": "app=Mail, window=Compose, url=n/a, ax_lines=12",
+        }
+
+    response = client.post(
+        "/v1/verify/batch",
+        json={
+            "schema_version": 1,
+            "requests": [
+                make_request("session-batch-1", "success"),
+                make_request("session-batch-2", "failure"),
+                make_request("session-batch-3", "success"),
+            ],
+        },
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["session_id"] for item in body["results"]] == [
+        "session-batch-1",
+        "session-batch-2",
+        "session-batch-3",
+    ]
+    assert [item["status"] for item in body["results"]] == ["success", "failure", "success"]
+    assert body["failures"] == 1
+    assert len(body["results"][1]["corrective_actions"]) == 1
+
+    empty = client.post("/v1/verify/batch", json={"schema_version": 1, "requests": []})
+    assert empty.status_code == 422
+
+
+def test_session_store_resolves_plan_reference_and_loop_delta(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    seen_loop_contexts: list[LoopContext] = []
+
+    async def fake_plan_with_anthropic(*, loop_context, **kwargs) -> AdapterResult:  # noqa: ARG001
+        seen_loop_contexts.append(loop_context)
+        return AdapterResult(
+            actions=[Action(id="a1", kind="type", text="Buy milk")],
+            confidence=0.8,
+            summary="Type note",
+            warnings=[],
+        )
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+
+    first = client.post(
+        "/v1/plan",
+        json={
+            "schema_version": 1,
+            "session_id": "session-store",
+            "transcript": "write buy milk",
+            "app": {"name": "Notes"},
+            "loop_context": {
+                "goal_transcript": "write buy milk",
+                "cycle_index": 0,
+                "replan_count": 0,
+                "max_cycles": 6,
+                "max_replans": 2,
+                "current_state": "FIELD_FOCUSED",
+                "next_required_state": "DATA_ENTERED",
+            },
+        },
+    )
+    assert first.status_code == 200
+    plan_id = first.json()["plan_id"]
+    assert plan_id
+
+    verify = client.post(
+        "/v1/verify",
+        json={
+            "schema_version": 1,
+            "session_id": "session-store",
+            "plan_id": plan_id,
+            "execution_result": "success",
+            "before_context": "app=Notes, window=New Note, url=n/a, ax_lines=4",
+            "after_context": "app=Notes, window=New Note, url=n/a, ax_lines=5",
+        },
+    )
+    assert verify.status_code == 200
+    assert verify.json()["state"] == "DATA_ENTERED"
+
+    second = client.post(
+        "/v1/plan",
+        json={
+            "schema_version": 1,
+            "session_id": "session-store",
+            "transcript": "write buy milk",
+            "app": {"name": "Notes"},
+            "loop_context_delta": {"cycle_index": 1, "current_state": "DATA_ENTERED", "next_required_state": "COMMIT_ATTEMPTED"},
+        },
+    )
+    assert second.status_code == 200
+    merged = seen_loop_contexts[-1]
+    assert merged.cycle_index == 1
+    assert merged.goal_transcript == "write buy milk"
+    assert merged.last_verify_status == "success"
+    assert [outcome.kind for outcome in merged.recent_action_results] == ["type"]
+
+    missing = client.post(
+        "/v1/verify",
+        json={"schema_version": 1, "session_id": "session-store", "plan_id": "unknown", "execution_result": "success"},
+    )
+    assert missing.status_code == 409
+    assert missing.json()["detail"]["error_code"] == "plan_not_found"
+
+
+def test_loop_session_serves_speculative_next_step(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    seen_cycles: list[tuple[int, str | None]] = []
+
+    async def fake_plan_with_anthropic(*, loop_context, **kwargs) -> AdapterResult:  # noqa: ARG001
+        seen_cycles.append((loop_context.cycle_index, loop_context.current_state))
+        if loop_context.cycle_index == 0:
+            return AdapterResult(
+                actions=[Action(id="a1", kind="type", text="Buy milk", expected_outcome="Note text entered")],
+                confidence=0.8,
+                summary="Type note",
+                warnings=[],
+            )
+        return AdapterResult(actions=[], confidence=0.9, summary="Note written", warnings=[], goal_state="complete")
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+
+    with client.websocket_connect("/v1/loop/session-loop") as websocket:
+        websocket.send_json({"type": "start", "transcript": "write buy milk", "app": {"name": "Notes"}, "max_cycles": 4})
+        first = websocket.receive_json()
+        assert first["type"] == "actions"
+        assert first["cycle_index"] == 0
+        plan_id = first["plan"]["plan_id"]
+
+        websocket.send_json({"type": "result", "plan_id": "other", "execution_result": "success"})
+        stale = websocket.receive_json()
+        assert stale["type"] == "error"
+        assert stale["error_code"] == "stale_plan_result"
+
+        websocket.send_json(
+            {
+                "type": "result",
+                "plan_id": plan_id,
+                "execution_result": "success",
+                "before_context": "app=Notes, window=New Note, url=n/a, ax_lines=4",
+                "after_context": "app=Notes, window=New Note, url=n/a, ax_lines=5",
+            }
+        )
+        done = websocket.receive_json()
+
+    assert done["type"] == "done"
+    assert done["status"] == "complete"
+    assert done["cycle_index"] == 1
+    assert done["verification"]["state"] == "DATA_ENTERED"
+    assert done["speculative_hit"] is True
+    assert done["plan"]["session_id"] == "session-loop"
+    assert seen_cycles == [(0, None), (1, "DATA_ENTERED")]
+
+
+def test_loop_session_survives_rate_limited_replan_and_malformed_frames(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    replans: list[int] = []
+
+    async def fake_plan_with_anthropic(*, loop_context, **kwargs) -> AdapterResult:  # noqa: ARG001
+        if loop_context.cycle_index == 0:
+            return AdapterResult(
+                actions=[Action(id="a1", kind="type", text="Buy milk", expected_outcome="Note text entered")],
+                confidence=0.8,
+                summary="Type note",
+                warnings=[],
+            )
+        replans.append(loop_context.cycle_index)
+        if len(replans) == 1:
+            raise ProviderConfigurationError(
+                "Anthropic quota or rate limit exceeded.",
+                status_code=429,
+                error_code="provider_quota_exceeded",
+                retry_after=2.0,
+            )
+        return AdapterResult(actions=[], confidence=0.9, summary="Note written", warnings=[], goal_state="complete")
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+    monkeypatch.setattr(
+        app_main._planner,
+        "_admission",
+        PlanAdmissionController(
+            session_rate_per_minute=600,
+            session_burst=10,
+            global_rate_per_minute=600,
+            global_burst=10,
+        ),
+    )
+    result = {
+        "type": "result",
+        "execution_result": "success",
+        "before_context": "app=Notes, window=New Note, url=n/a, ax_lines=4",
+        "after_context": "app=Notes, window=New Note, url=n/a, ax_lines=5",
+    }
+
+    with client.websocket_connect("/v1/loop/session-loop-retry") as websocket:
+        websocket.send_text("{not json")
+        malformed = websocket.receive_json()
+        assert malformed["type"] == "error"
+        assert malformed["error_code"] == "invalid_loop_message"
+
+        websocket.send_json({"type": "start", "transcript": "write buy milk", "app": {"name": "Notes"}, "speculate": False})
+        first = websocket.receive_json()
+        assert first["type"] == "actions"
+
+        websocket.send_json({**result, "plan_id": first["plan"]["plan_id"]})
+        throttled = websocket.receive_json()
+        assert throttled["type"] == "error"
+        assert throttled["error_code"] == "provider_quota_exceeded"
+        assert throttled["retry_after"] == 2.0
+
+        # Still open and executing: resending the result retries only the replan.
+        websocket.send_json({**result, "plan_id": first["plan"]["plan_id"]})
+        done = websocket.receive_json()
+
+    assert done["type"] == "done"
+    assert done["status"] == "complete"
+    assert done["cycle_index"] == 1
+    assert done["verification"]["state"] == "DATA_ENTERED"
+    assert replans == [1, 1]
+
+
+def test_speculative_plan_served_when_next_request_matches_prediction(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    seen_loop_contexts: list[LoopContext] = []
+
+    async def fake_plan_with_anthropic(*, loop_context, **kwargs) -> AdapterResult:  # noqa: ARG001
+        seen_loop_contexts.append(loop_context)
+        if loop_context.cycle_index == 0:
+            return AdapterResult(
+                actions=[Action(id="a1", kind="click", target="New Note", expected_outcome="Editor opened")],
+                confidence=0.8,
+                summary="Open a note",
+                warnings=[],
+            )
+        return AdapterResult(
+            actions=[Action(id="a1", kind="type", text="Buy milk")],
+            confidence=0.8,
+            summary="Type note",
+            warnings=[],
+        )
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+    hits_before = app_main._speculator.hits
+    loop_context = {
+        "goal_transcript": "write buy milk",
+        "cycle_index": 0,
+        "replan_count": 0,
+        "max_cycles": 6,
+        "max_replans": 2,
+        "current_state": "APP_ACTIVE",
+    }
+    payload = {
+        "schema_version": 1,
+        "session_id": "session-speculative",
+        "transcript": "write buy milk",
+        "app": {"name": "Notes"},
+        "preferences": {"speculative_next_step": True},
+        "loop_context": loop_context,
+    }
+
+    with TestClient(app) as scoped_client:
+        first = scoped_client.post("/v1/plan", json=payload)
+        assert first.status_code == 200
+        second = scoped_client.post(
+            "/v1/plan",
+            json={
+                **payload,
+                "loop_context": {
+                    **loop_context,
+                    "cycle_index": 1,
+                    "current_state": "UI_CONTEXT_CHANGED",
+                    "last_state": "APP_ACTIVE",
+                    "last_verify_status": "success",
+                },
+            },
+        )
+
+    assert second.status_code == 200
+    assert second.json()["session_id"] == "session-speculative"
+    assert second.json()["actions"][0]["kind"] == "type"
+    assert app_main._speculator.hits == hits_before + 1
+    # Cycle 1 was planned once, speculatively; the second request did not reach the provider.
+    assert [context.cycle_index for context in seen_loop_contexts].count(1) == 1
+    assert seen_loop_contexts[1].current_state == "UI_CONTEXT_CHANGED"
+    assert seen_loop_contexts[1].last_verify_reason == "Editor opened"
+
+
+def test_fast_path_planner_matches_trivial_intents() -> None:
+    fast_path = FastPathPlanner(thresholds={"search": 0.9})
+
+    opened = fast_path.match("Please open Google Chrome.", app_name="Finder")
+    assert opened is not None
+    assert opened.intent == "open_app"
+    assert opened.actions[0].target == "Google Chrome"
+
+    navigate = fast_path.match("go to openai.com", app_name="Google Chrome")
+    assert navigate is not None
+    assert [action.kind for action in navigate.actions] == ["open_app", "key_combo", "type", "key_combo"]
+    assert navigate.actions[0].target == "Google Chrome"
+    assert navigate.actions[2].text == "https://openai.com"
+
+    assert fast_path.match("new tab", app_name="Safari").actions[0].key_combo == "cmd+t"
+    assert fast_path.match("new tab", app_name="Notes") is None
+    assert fast_path.match("save the document", app_name="Pages").actions[0].key_combo == "cmd+s"
+    # Search clears the default threshold but not its stricter per-intent one.
+    assert fast_path.match("search for flights", app_name="Safari") is None
+    assert fast_path.match("open the quarterly report", app_name="Finder") is None
+    assert fast_path.match("open Safari and go to openai.com", app_name="Finder") is None
+    # Not app launches or URLs: verbs that are not "open", file names, chained steps.
+    for transcript in (
+        "start recording",
+        "start dictation",
+        "open report.pdf",
+        "open notes.txt",
+        "open Safari.app",
+        "open mail then reply",
+        "open notes please",
+    ):
+        assert fast_path.match(transcript, app_name="Finder") is None, transcript
+    assert fast_path.match("open news.bbc.co.uk", app_name="Finder").intent == "navigate_url"
+
+    done = fast_path.plan(
+        "undo",
+        app_name="Notes",
+        served_intent="undo",
+        loop_context=LoopContext(
+            goal_transcript="undo",
+            cycle_index=1,
+            replan_count=0,
+            max_cycles=4,
+            max_replans=2,
+            last_verify_status="success",
+        ),
+    )
+    assert done is not None
+    assert done.actions == []
+    later = LoopContext(
+        goal_transcript="undo", cycle_index=1, replan_count=0, max_cycles=4, max_replans=2, last_verify_status="success"
+    )
+    # A command that first matches mid-loop was planned by the provider so far.
+    assert fast_path.plan("undo", app_name="Notes", loop_context=later) is None
+    assert fast_path.plan("undo", app_name="Notes", loop_context=later, served_intent="save") is None
+
+
+def test_fast_path_plans_locally_and_reports_savings(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    adapter = app_main._planner._adapter
+    monkeypatch.setattr(adapter, "_fast_path", FastPathPlanner())
+
+    async def fake_plan_with_anthropic(**kwargs) -> AdapterResult:  # noqa: ARG001
+        return AdapterResult(
+            actions=[Action(id="a1", kind="type", text="Buy milk")],
+            confidence=0.8,
+            summary="Type note",
+            warnings=[],
+        )
+
+    monkeypatch.setattr(adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+
+    local = client.post(
+        "/v1/plan",
+        json={"schema_version": 1, "session_id": "session-fast-path", "transcript": "undo", "app": {"name": "Notes"}},
+    )
+    assert local.status_code == 200
+    assert local.json()["actions"][0]["key_combo"] == "cmd+z"
+    assert "fast path: undo" in local.json()["planner_note"]
+
+    remote = client.post(
+        "/v1/plan",
+        json={"schema_version": 1, "session_id": "session-fast-path", "transcript": "write buy milk", "app": {"name": "Notes"}},
+    )
+    assert remote.json()["actions"][0]["kind"] == "type"
+
+    status_body = client.get("/v1/provider/status").json()
+    assert status_body["fast_path_hits"] == {"undo": 1}
+    assert status_body["provider_calls"] == 1
+    assert status_body["provider_calls_saved_ratio"] == 0.5
+
+
+def test_fast_path_navigate_runs_every_action_across_loop_cycles(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    monkeypatch.setattr(app_main._planner._adapter, "_fast_path", FastPathPlanner())
+    monkeypatch.setattr(
+        app_main._planner,
+        "_admission",
+        PlanAdmissionController(
+            session_rate_per_minute=600,
+            session_burst=10,
+            global_rate_per_minute=600,
+            global_burst=10,
+        ),
+    )
+
+    def plan_cycle(cycle_index: int) -> dict:
+        response = client.post(
+            "/v1/plan",
+            json={
+                "schema_version": 1,
+                "session_id": "session-fast-path-loop",
+                "transcript": "go to openai.com",
+                "app": {"name": "Safari"},
+                "loop_context": {
+                    "goal_transcript": "go to openai.com",
+                    "cycle_index": cycle_index,
+                    "replan_count": 0,
+                    "max_cycles": 6,
+                    "max_replans": 2,
+                    "last_verify_status": "success" if cycle_index else None,
+                },
+            },
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    first, second, third = plan_cycle(0), plan_cycle(1), plan_cycle(2)
+    assert [action["kind"] for action in first["actions"]] == ["open_app", "key_combo", "type"]
+    assert first["goal_state"] == "in_progress"
+    # Enter was not trimmed away: it is served on the next cycle, before completion.
+    assert [action["key_combo"] for action in second["actions"]] == ["enter"]
+    assert second["goal_state"] == "in_progress"
+    assert third["actions"] == []
+    assert third["goal_state"] == "complete"
+
+
+def test_fast_path_does_not_take_over_a_provider_led_loop(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    monkeypatch.setattr(app_main._planner._adapter, "_fast_path", FastPathPlanner())
+    monkeypatch.setattr(
+        app_main._planner,
+        "_admission",
+        PlanAdmissionController(
+            session_rate_per_minute=600,
+            session_burst=10,
+            global_rate_per_minute=600,
+            global_burst=10,
+        ),
+    )
+    provider_cycles: list[int] = []
+
+    async def fake_plan_with_anthropic(*, loop_context, **kwargs) -> AdapterResult:  # noqa: ARG001
+        provider_cycles.append(loop_context.cycle_index)
+        if loop_context.cycle_index == 0:
+            return AdapterResult(
+                actions=[Action(id="a1", kind="open_app", target="Safari")],
+                confidence=0.9,
+                summary="Open Safari",
+                warnings=[],
+            )
+        return AdapterResult(
+            actions=[Action(id="a1", kind="key_combo", key_combo="cmd+l")],
+            confidence=0.9,
+            summary="Focus the address bar",
+            warnings=[],
+        )
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+
+    def plan_cycle(cycle_index: int, app_name: str) -> dict:
+        response = client.post(
+            "/v1/plan",
+            json={
+                "schema_version": 1,
+                "session_id": "session-fast-path-mid-loop",
+                "transcript": "search for cats",
+                "app": {"name": app_name},
+                "loop_context": {
+                    "goal_transcript": "search for cats",
+                    "cycle_index": cycle_index,
+                    "replan_count": 0,
+                    "max_cycles": 6,
+                    "max_replans": 2,
+                    "last_verify_status": "success" if cycle_index else None,
+                },
+            },
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    # "search" only matches in a browser, so cycle 0 (Finder) goes to the provider...
+    first = plan_cycle(0, "Finder")
+    assert first["actions"][0]["target"] == "Safari"
+    # ...and cycle 1 (Safari) must not be read as the fast path's finished batch.
+    second = plan_cycle(1, "Safari")
+    assert second["goal_state"] == "in_progress"
+    assert second["actions"][0]["key_combo"] == "cmd+l"
+    assert provider_cycles == [0, 1]
+
+
+def test_extract_json_object_handles_fences_prose_and_unbalanced_braces() -> None:
+    fenced = 'Sure! ```json\n{"summary": "Open {x}", "actions": []}\n``` hope this } helps {'
+    assert extract_json_object(fenced) == {"summary": "Open {x}", "actions": []}
+    assert extract_json_object('{ unclosed {"goal_state": "complete", "note": "a \\" }"} tail') == {
+        "goal_state": "complete",
+        "note": 'a " }',
+    }
+    assert extract_json_object("no json here") is None
+    assert extract_json_object("{" * 20_000) is None
+
+
+def test_coerce_actions_collects_per_action_errors_in_one_pass() -> None:
+    adapter = MacOSUseAdapter()
+    actions, warnings = adapter._coerce_actions(
+        [
+            {"kind": "type", "text": "Buy milk"},
+            "not an action",
+            {"id": "a3", "kind": "wait", "timeout_ms": 5},
+            {"id": "a4", "kind": "teleport"},
+            {"id": "a5", "kind": "click", "target": "first_search_result"},
+        ]
+    )
+
+    assert [(action.id, action.kind) for action in actions] == [("a1", "type")]
+    assert warnings == [
+        "Action #2 is not an object",
+        "Rejected invalid action at index 3: timeout_ms: Input should be greater than or equal to 100",
+        "Rejected unknown action kind 'teleport' at index 4",
+        "Rejected invalid action at index 5: placeholder target 'first_search_result' for kind 'click'",
+    ]
+
+
+def test_tool_use_output_mode_reads_tool_input_and_falls_back_to_json_text(monkeypatch) -> None:
+    sent_payloads: list[dict] = []
+    tool_supported = [True]
+    prompt_too_long = [False]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        sent_payloads.append(body)
+        if "tools" in body:
+            if prompt_too_long[0]:
+                return httpx.Response(
+                    400, json={"error": {"type": "invalid_request_error", "message": "prompt is too long"}}
+                )
+            if not tool_supported[0]:
+                return httpx.Response(
+                    400,
+                    json={"error": {"type": "invalid_request_error", "message": "tool_choice: tool use is not supported"}},
+                )
+            plan = {"summary": "Type note", "confidence": 0.8, "goal_state": "in_progress", "actions": [{"kind": "type", "text": "Buy milk"}]}
+            return httpx.Response(200, json={"content": [{"type": "tool_use", "name": "submit_action_plan", "input": plan}]})
+        return httpx.Response(
+            200,
+            json={"content": [{"type": "text", "text": 'Plan: {"summary":"Type note","confidence":0.7,"actions":[{"kind":"type","text":"Buy milk"}]}'}]},
+        )
+
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        lambda **kwargs: real_async_client(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    adapter = MacOSUseAdapter()
+
+    def plan() -> AdapterResult:
+        return asyncio.run(
+            adapter._plan_with_anthropic(
+                transcript="write buy milk",
+                active_app_name="Notes",
+                ax_tree_summary=None,
+                api_key="sk-ant-test-key",
+                loop_context=None,
+            )
+        )
+
+    tool_result = plan()
+    assert sent_payloads[0]["tool_choice"] == {"type": "tool", "name": "submit_action_plan"}
+    assert tool_result.actions[0].text == "Buy milk"
+    assert tool_result.confidence == 0.8
+
+    tool_supported[0] = False
+    fallback_result = plan()
+    assert "tools" in sent_payloads[1] and "tools" not in sent_payloads[2]
+    assert fallback_result.actions[0].text == "Buy milk"
+    assert any("retrying with JSON text" in warning for warning in fallback_result.warnings)
+
+    stats = adapter.output_mode_stats
+    assert (stats["tool"].requests, stats["tool"].parse_failures) == (1, 0)
+    assert (stats["json_text"].requests, stats["json_text"].parse_failures) == (1, 0)
+
+    # A 400 that is not about tools is surfaced, not retried in JSON-text mode.
+    prompt_too_long[0] = True
+    sent_before = len(sent_payloads)
+    rejected: ProviderConfigurationError | None = None
+    try:
+        plan()
+    except ProviderConfigurationError as exc:
+        rejected = exc
+    assert rejected is not None
+    assert (rejected.status_code, rejected.error_code) == (400, "provider_bad_request")
+    assert "prompt is too long" in str(rejected)
+    assert len(sent_payloads) == sent_before + 1
+
+
+def test_model_json_response_matches_model_dump_encoding() -> None:
+    plan = ActionPlan(
+        session_id="session-json",
+        actions=[Action(id="a1", kind="type", text="Crème brûlée ☕")],
+        confidence=0.5,
+        risk_level="low",
+        requires_confirmation=False,
+    )
+    events = [TelemetryEvent(session_id="session-json", stage="executing", status="success", latency_ms=7)]
+
+    plan_response = ModelJSONResponse(plan)
+    assert plan_response.headers["content-type"] == "application/json"
+    assert json.loads(plan_response.body) == plan.model_dump(mode="json")
+
+    telemetry_response = ModelJSONResponse({"events": events, "count": 1})
+    assert json.loads(telemetry_response.body) == {
+        "events": [event.model_dump(mode="json") for event in events],
+        "count": 1,
+    }
+
+
+def test_reindex_actions_shares_actions_that_keep_their_id() -> None:
+    first = Action(id="a1", kind="key_combo", key_combo="return")
+    second = Action(id="a7", kind="wait", timeout_ms=500)
+
+    reindexed = MacOSUseAdapter._reindex_actions([first, second])
+
+    assert reindexed[0] is first
+    assert reindexed[1] is not second
+    assert (reindexed[1].id, second.id) == ("a2", "a7")
+
+
+def test_vendor_rules_load_lazily_and_cache_by_vendor_commit(tmp_path) -> None:
+    assert MacOSUseAdapter()._vendor_rules is None
+
+    vendor_path = tmp_path / "macos-use"
+    prompts_dir = vendor_path / "mlx_use" / "agent"
+    prompts_dir.mkdir(parents=True)
+    (prompts_dir / "prompts.py").write_text(
+        'raise ImportError("mlx is not installed")\n\n'
+        "class SystemPrompt:\n"
+        "    def important_rules(self) -> str:\n"
+        '        """Rules for the agent."""\n'
+        '        text = """\n1. Never send a message without confirmation.\n"""\n'
+        "        return text\n",
+        encoding="utf-8",
+    )
+    commit_file = tmp_path / "macos-use.commit"
+    commit_file.write_text("abc123\n", encoding="utf-8")
+    cache_path = tmp_path / "cache" / "vendor_rules.json"
+
+    def load() -> VendorRules:
+        return load_vendor_rules(vendor_path=vendor_path, commit_file=commit_file, cache_path=cache_path)
+
+    extracted = load()
+    assert extracted.origin == "source"
+    assert extracted.text == "1. Never send a message without confirmation."
+    assert json.loads(cache_path.read_text(encoding="utf-8"))["commit"] == "abc123"
+
+    (prompts_dir / "prompts.py").unlink()
+    assert load() == VendorRules(text=extracted.text, origin="cache")
+
+    commit_file.write_text("def456\n", encoding="utf-8")
+    assert load() == VendorRules(text="", origin="missing")
+    assert json.loads(cache_path.read_text(encoding="utf-8"))["commit"] == "abc123"
+
+
+def test_lazy_sidecar_app_serves_health_then_delegates_after_warmup() -> None:
+    with TestClient(LazySidecarApp("app.main:app")) as lazy_client:
+        health = lazy_client.get("/health")
+        assert health.status_code == 200
+        assert health.json()["status"] == "ok"
+
+        assert lazy_client.get("/v1/models").json()["schema_version"] == 1
+        profile = lazy_client.get(PROFILE_PATH).json()
+        assert profile["ready"] is True
+        assert [item["module"] for item in profile["imports"]][-1] == "app.main"
+        assert {"lifespan_startup", "first_health", "ready"} <= set(profile["marks"])
+
+    with TestClient(LazySidecarApp("app.missing_module:app")) as broken_client:
+        failed = broken_client.get("/v1/models")
+        assert failed.status_code == 503
+        assert failed.json()["detail"]["error_code"] == "sidecar_warmup_failed"
+        assert broken_client.get("/health").status_code == 503
+
+
+def test_packaged_sidecar_answers_health_within_startup_budget() -> None:
+    budget_seconds = float(os.getenv("ORANGE_TEST_STARTUP_BUDGET_SECONDS", "3.0"))
+    agent_dir = Path(__file__).resolve().parents[1]
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(agent_dir / "packaging" / "sidecar_entry.py"), "--port", str(port), "--log-level", "warning"],
+        cwd=agent_dir,
+        env={**os.environ, "PYTHONPATH": str(agent_dir)},
+    )
+    try:
+        time_to_health = None
+        while time.perf_counter() - started < budget_seconds + 10:
+            try:
+                response = httpx.get(f"http://127.0.0.1:{port}/health", timeout=0.5)
+            except httpx.TransportError:
+                time.sleep(0.01)
+                continue
+            if response.status_code == 200:
+                time_to_health = time.perf_counter() - started
+                break
+        assert time_to_health is not None and time_to_health < budget_seconds
+
+        profile = httpx.get(f"http://127.0.0.1:{port}{PROFILE_PATH}", timeout=2).json()
+        # Heavy modules must stay off the path to the first health check.
+        assert profile["eager_imports"] == []
+        assert profile["marks"]["lifespan_startup"] <= profile["marks"]["first_health"]
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def test_model_router_hot_swaps_compiled_table_from_config_file(tmp_path) -> None:
+    base = compile_routing_table(
+        model_simple="model-simple",
+        model_complex="model-complex",
+        app_overrides=parse_model_overrides("Mail:model-mail, bad-entry ,slack:"),
+    )
+    assert dict(base.app_overrides) == {"mail": "model-mail"}
+    assert base.select("open notes", app_name="Mail") == "model-mail"
+    assert base.select("open notes", app_name="Notes") == "model-simple"
+    assert base.select("write a note and then share it", app_name="Notes") == "model-complex"
+    assert base.candidates("model-simple")[:2] == ["model-simple", "claude-3-5-sonnet-latest"]
+
+    config_path = tmp_path / "routing.json"
+    config_path.write_text(json.dumps({"model_simple": "model-fast", "app_overrides": {"Slack": "model-slack"}}))
+    now = [0.0]
+    router = ModelRouter(base, config_path=config_path, poll_seconds=5.0, clock=lambda: now[0])
+    table = router.current()
+    assert (table.version, table.source) == (2, str(config_path))
+    assert table.select("open notes", app_name="Mail") == "model-fast"
+    assert table.select("open notes", app_name="slack") == "model-slack"
+    assert table.model_complex == "model-complex"
+
+    config_path.write_text("{not json")
+    os.utime(config_path, ns=(1, 1))
+    now[0] = 1.0
+    assert router.current() is table  # not polled yet
+    now[0] = 6.0
+    assert router.current() is table
+    assert router.last_error is not None and "Invalid model routing file" in router.last_error
+
+    config_path.write_text(json.dumps({"max_simple_words": 2}))
+    os.utime(config_path, ns=(2, 2))
+    reloaded = router.reload()
+    assert reloaded.version == 3 and router.last_error is None
+    assert reloaded.select("open notes app", app_name=None) == "model-complex"
+
+
+def test_models_reload_without_routing_file_is_rejected() -> None:
+    body = client.get("/v1/models").json()
+    assert body["routing_source"] == "env"
+    assert body["routing"][0]["reason"] == "Default model for short/simple tasks"
+
+    response = client.post("/v1/models/reload")
+    assert response.status_code == 400
+    assert response.json()["detail"]["error_code"] == "invalid_routing_config"
+
+
+def test_plan_telemetry_trains_learned_router_that_routes_in_on_mode(monkeypatch) -> None:
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+
+    async def fake_plan_with_anthropic(**kwargs) -> AdapterResult:  # noqa: ARG001
+        return AdapterResult(
+            actions=[Action(id="a1", kind="type", target="Reply", text="Thanks", expected_outcome="Reply typed")],
+            confidence=0.9,
+            summary="Reply",
+            warnings=[],
+            model="claude-3-5-sonnet-latest",
+            latency_ms=840,
+        )
+
+    monkeypatch.setattr(app_main._planner._adapter, "_plan_with_anthropic", fake_plan_with_anthropic)
+    plan = client.post(
+        "/v1/plan",
+        json={"session_id": "session-learned-1", "transcript": "reply to Sam and say thanks", "app": {"name": "Mail"}},
+    ).json()
+    assert (plan["model"], plan["provider_latency_ms"], plan["intent_class"]) == ("claude-3-5-sonnet-latest", 840, "compose")
+
+    client.post("/v1/telemetry", json={"session_id": "session-learned-1", "stage": "planning", "status": "completed"})
+    recorded = client.get("/v1/telemetry?limit=1").json()["events"][0]
+    assert (recorded["model"], recorded["intent_class"], recorded["latency_ms"]) == ("claude-3-5-sonnet-latest", "compose", 840)
+
+    # Haiku succeeds as often as sonnet on multi-step Mail sessions, so it wins on cost.
+    events = []
+    for idx in range(24):
+        model = "claude-3-5-haiku-latest" if idx % 2 else "claude-3-5-sonnet-latest"
+        session_id = f"s{idx}"
+        events += [
+            {"session_id": session_id, "stage": "planning", "status": "completed", "app": "Mail",
+             "model": model, "intent_class": "multi_step", "latency_ms": 400 if idx % 2 else 900},
+            {"session_id": session_id, "stage": "session", "status": "success", "replan_count": 0},
+        ]
+    events.append({"session_id": "canceled", "stage": "session", "status": "canceled", "model": "x", "intent_class": "edit"})
+    outcomes = outcomes_from_telemetry(events)
+    assert len(outcomes) == 24 and outcomes[0].app == "mail"
+
+    policy = train_policy(outcomes, min_sessions=5)
+    assert dict(policy.routes) == {"*|multi_step": "claude-3-5-haiku-latest"}
+    assert LearnedPolicy.from_json(policy.to_json()).routes == policy.routes
+    report = shadow_report(policy, outcomes)
+    assert report["agreement_rate"] == 0.5
+    assert report["switches"] == {"claude-3-5-sonnet-latest -> claude-3-5-haiku-latest": 12}
+    assert report["policy"]["mean_cost_units"] < report["observed"]["mean_cost_units"]
+
+    transcript = "open the invoices folder and then attach the newest file"
+    assert classify_intent(transcript) == "multi_step"
+    shadow = LearnedRouter(policy, mode="shadow")
+    on = LearnedRouter(policy, mode="on")
+    heuristic = "claude-3-5-sonnet-latest"
+    assert shadow.route(transcript, app_name="Notes", heuristic_model=heuristic) == heuristic
+    assert shadow.stats.disagreements == 1
+    assert on.route(transcript, app_name="Notes", heuristic_model=heuristic) == "claude-3-5-haiku-latest"
+    assert on.route(transcript, app_name="Xcode", heuristic_model=heuristic, pinned=True) == heuristic
+    assert on.route("make it bold", app_name="Notes", heuristic_model=heuristic) == heuristic
+    assert on.stats.uncovered == 1
+
+
+def test_policy_matcher_scans_once_for_whole_word_risk_complexity_and_intent(monkeypatch) -> None:
+    matcher = PolicyMatcher()
+    hits = matcher.scan("Reply to the sender and then DELETE the draft; empty   trash after lunch")
+    assert hits.risk == ("delete",)
+    assert hits.strict_risk == ("empty trash",)
+    assert hits.complexity == ("after", "and", "reply", "then")
+    assert hits.intents == ("compose", "multi_step", "edit")
+    assert hits.intent_class == "compose"
+    assert hits.risk_terms("strict") == ("delete", "empty trash")
+    assert hits.risk_terms("balanced") == ("delete",)
+    assert matcher.scan("Reply to the sender and then DELETE the draft; empty   trash after lunch") is hits
+
+    # "send" inside "sender" and "after" inside "afternoon" are not hits.
+    quiet = matcher.scan("open the message from the sender this afternoon")
+    assert (quiet.risk, quiet.complexity, quiet.intent_class) == ((), (), "compose")
+
+    table = compile_routing_table(
+        model_simple="simple",
+        model_complex="complex",
+        app_overrides={},
+        complexity_markers=(" and ", "then"),
+    )
+    assert table.complexity_markers == ("and", "then")
+    assert table.matcher is compile_policy_matcher(("and", "then"))
+    assert table.select("check the afternoon sender list", app_name=None) == "simple"
+    assert table.select("copy this and paste", app_name=None) == "complex"
+
+    async def fake_plan_actions(**kwargs) -> AdapterResult:  # noqa: ARG001
+        return AdapterResult(
+            actions=[Action(id="a1", kind="open_app", target="Mail")],
+            confidence=0.9,
+            summary="Open Mail",
+            warnings=[],
+        )
+
+    planner = PlannerService(EventBus())
+    monkeypatch.setattr(planner._adapter, "plan_actions", fake_plan_actions)
+    plan = asyncio.run(planner.plan(PlanRequest(session_id="session-policy", transcript="open the sender list in Mail")))
+    assert (plan.risk_level, plan.requires_confirmation, plan.intent_class) == ("low", False, "navigate")
+    plan = asyncio.run(planner.plan(PlanRequest(session_id="session-policy", transcript="send the list to Sam")))
+    assert (plan.risk_level, plan.requires_confirmation) == ("high", True)
+    # Inflected forms stay risky, as they were under substring matching.
+    for index, transcript in enumerate((
+        "posts the update",
+        "the posted comment",
+        "submits the form",
+        "submitted form again",
+        "bought it again",
+        "purchased items reorder",
+        "sent items cleanup",
+        "deleted files restore",
+    )):
+        assert matcher.scan(transcript).risk, transcript
+        plan = asyncio.run(planner.plan(PlanRequest(session_id=f"session-policy-{index}", transcript=transcript)))
+        assert plan.requires_confirmation, transcript
+
+
+def _png_bytes(size: tuple[int, int], *, window: tuple[int, int, int, int], caret: bool = False) -> bytes:
+    image = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle(window, fill=(40, 40, 60))
+    if caret:
+        draw.rectangle((window[0] + 20, window[1] + 20, window[0] + 23, window[1] + 40), fill=(255, 255, 255))
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_binary_screenshot_upload_downscales_reuses_identical_and_feeds_plan(monkeypatch) -> None:
+    screen = _png_bytes((2880, 1800), window=(200, 200, 1400, 1000))
+    first = client.put("/v1/screenshots/session-shot", content=screen, headers={"content-type": "image/png"})
+    assert first.status_code == 200
+    body = first.json()
+    assert (body["width"], body["height"], body["duplicate"]) == (1568, 980, False)
+    assert body["source_bytes"] == len(screen)
+
+    # Only a byte-identical re-upload is reused; even a caret-sized change is a new screenshot.
+    again = client.put("/v1/screenshots/session-shot", content=screen)
+    assert (again.json()["duplicate"], again.json()["screenshot_id"]) == (True, body["screenshot_id"])
+    caret = _png_bytes((2880, 1800), window=(200, 200, 1400, 1000), caret=True)
+    changed = client.put("/v1/screenshots/session-shot", content=caret)
+    assert changed.json()["duplicate"] is False
+    screenshot_id = changed.json()["screenshot_id"]
+    assert screenshot_id != body["screenshot_id"]
+
+    cropped = client.put(
+        "/v1/screenshots/session-crop?crop_left=100&crop_top=50&crop_width=800&crop_height=600", content=screen
+    )
+    assert (cropped.json()["width"], cropped.json()["height"]) == (800, 600)
+    assert client.put("/v1/screenshots/session-crop?crop_left=1", content=screen).status_code == 422
+    bad = client.put("/v1/screenshots/session-bad", content=b"not an image")
+    assert (bad.status_code, bad.json()["detail"]["error_code"]) == (422, "invalid_screenshot")
+
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test-plan-key")
+    seen: list[object] = []
+
+    async def fake_plan_actions(**kwargs) -> AdapterResult:
+        seen.append(kwargs["screenshot"])
+        return AdapterResult(actions=[Action(id="a1", kind="wait")], confidence=0.9, summary="Wait", warnings=[])
+
+    monkeypatch.setattr(app_main._planner._adapter, "plan_actions", fake_plan_actions)
+    plan = {"session_id": "session-shot", "transcript": "what is on screen", "screenshot_id": screenshot_id}
+    assert client.post("/v1/plan", json=plan).status_code == 200
+    assert seen == [None]  # forwarded only with ORANGE_PLANNER_VISION=1
+    newest = app_main._sessions.resolve_screenshot("session-shot", screenshot_id)
+    assert newest.data == prepare_screenshot(caret).data
+    stale = client.post("/v1/plan", json={**plan, "screenshot_id": body["screenshot_id"]})
+    assert (stale.status_code, stale.json()["detail"]["error_code"]) == (409, "screenshot_not_found")
+
+    sent: list[dict] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(json.loads(request.content))
+        return httpx.Response(
+            200,
+            json={"content": [{"type": "text", "text": '{"summary":"Wait","confidence":0.9,"actions":[{"id":"a1","kind":"wait"}]}'}]},
+        )
+
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        lambda **kwargs: real_async_client(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    asyncio.run(
+        MacOSUseAdapter()._plan_with_anthropic(
+            transcript="what is on screen",
+            active_app_name="Finder",
+            ax_tree_summary=None,
+            api_key="sk-ant-test-key",
+            loop_context=None,
+            screenshot=prepare_screenshot(screen),
+        )
+    )
+    content = sent[0]["messages"][0]["content"]
+    assert [block["type"] for block in content] == ["image", "text"]
+    assert content[0]["source"]["media_type"] == "image/jpeg"
@@ -0,0 +1,88 @@
+"""
+Train a learned model routing policy from exported telemetry and print a
+shadow-evaluation report for it.
+
+Input is what `GET /v1/telemetry?limit=1000` returns ({"events": [...]}), a
+plain JSON list of events, or JSON Lines. Sessions are split into training
+and held-out sets by a hash of their id, so reruns on a growing export keep
+the same split. The report compares the trained policy with the models that
+were actually used on the held-out sessions.
+
+Run from agent/:
+    python tools/train_model_router.py telemetry.json --output routing_policy.json
+Then point ORANGE_LEARNED_ROUTING_FILE at the output (ORANGE_LEARNED_ROUTING_MODE
+defaults to "shadow"; set it to "on" once the report looks right).
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+import sys
+from typing import Any
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core.learned_routing import SessionOutcome, outcomes_from_telemetry, shadow_report, train_policy  # noqa: E402
+
+
+def read_events(path: Path) -> list[dict[str, Any]]:
+    raw = path.read_text(encoding="utf-8").strip()
+    if not raw:
+        return []
+    if raw[0] in "[{":
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            return list(payload.get("events", []))
+        if isinstance(payload, list):
+            return payload
+    return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+
+def split_holdout(
+    events: list[dict[str, Any]], holdout: float
+) -> tuple[list[SessionOutcome], list[SessionOutcome]]:
+    train_events: list[dict[str, Any]] = []
+    holdout_events: list[dict[str, Any]] = []
+    for event in events:
+        digest = hashlib.sha1(str(event.get("session_id", "")).encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:2], "big") / 0x10000
+        (holdout_events if bucket < holdout else train_events).append(event)
+    return outcomes_from_telemetry(train_events), outcomes_from_telemetry(holdout_events)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("telemetry", type=Path, help="exported telemetry (JSON or JSON Lines)")
+    parser.add_argument("--output", type=Path, help="where to write the policy (printed if omitted)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of sessions held out for the report")
+    parser.add_argument("--min-sessions", type=int, default=5)
+    parser.add_argument("--success-tolerance", type=float, default=0.05)
+    parser.add_argument("--latency-weight", type=float, default=1.0, help="cost units per second of planner latency")
+    args = parser.parse_args(argv)
+
+    train, held_out = split_holdout(read_events(args.telemetry), min(max(args.holdout, 0.0), 1.0))
+    policy = train_policy(
+        train,
+        min_sessions=args.min_sessions,
+        success_tolerance=args.success_tolerance,
+        latency_weight=args.latency_weight,
+    )
+    if args.output:
+        args.output.write_text(policy.to_json() + "\n", encoding="utf-8")
+    else:
+        print(policy.to_json())
+
+    report = shadow_report(policy, held_out or train)
+    report["evaluated_on"] = "holdout" if held_out else "training"
+    print(json.dumps(report, indent=2), file=sys.stderr if not args.output else sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -114,7 +114,7 @@ final class PythonSidecarManager {
 
         return LaunchMode(
             executable: pythonExecutable,
-            arguments: ["-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", "7789"],
+            arguments: ["-m", "uvicorn", "app.startup:app", "--host", "127.0.0.1", "--port", "7789"],
             workingDirectory: agentDirectory
         )
     }
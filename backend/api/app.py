@@ -5,19 +5,25 @@ import hashlib
 import hmac
 import json
 import os
+import threading
 import time
 from typing import Any
 
 import httpx
 import jwt
-from fastapi import FastAPI, Header, HTTPException, Request, status
+from fastapi import FastAPI, Header, HTTPException, Request, Response, status
 from pydantic import BaseModel, ConfigDict, EmailStr, Field
 
+from .responses import ModelJSONResponse
+from .usage_summary import UsageSummaryEntry, UsageSummaryStore
+from .webhook_queue import WebhookEventQueue
+
 app = FastAPI(title="Orange Backend API", version="0.2.0")
 
 FREE_COMMAND_LIMIT = 300
 PRO_COMMAND_LIMIT = 10_000_000
 STRIPE_SIGNATURE_TOLERANCE_SECONDS = 300
+USAGE_WATCH_MAX_TIMEOUT_SECONDS = 30.0
 
 
 def _csv_env(name: str) -> set[str]:
@@ -29,6 +35,12 @@ ALLOWED_BETA_EMAILS = _csv_env("ORANGE_BETA_ALLOWLIST_EMAILS")
 ALLOWED_BETA_TOKENS = _csv_env("ORANGE_BETA_ALLOWLIST_TOKENS")
 
 USAGE_EVENTS: list["UsageIngestRequest"] = []
+USAGE_COUNTS_BY_PERIOD: dict[tuple[str, str], int] = {}
+USAGE_SUMMARIES = UsageSummaryStore()
+# Guards usage counts, plans and summary materialization together: request
+# threads and webhook workers both update them, and a summary rendered from
+# stale inputs must not overwrite a newer one.
+USAGE_LOCK = threading.RLock()
 WAITLIST_SIGNUPS: list["WaitlistSignupRequest"] = []
 TELEMETRY_EVENTS: list["SessionTelemetryEvent"] = []
 USER_PLAN_BY_ID: dict[str, str] = {}
@@ -123,7 +135,7 @@ def health() -> dict[str, str]:
 
 
 @app.post("/auth/token", response_model=AuthTokenResponse)
-def issue_token(request: AuthTokenRequest) -> AuthTokenResponse:
+def issue_token(request: AuthTokenRequest) -> ModelJSONResponse:
     claims = _decode_supabase_access_token(request.access_token)
     user_id = str(claims.get("sub") or "").strip()
     if not user_id:
@@ -142,21 +154,33 @@ def issue_token(request: AuthTokenRequest) -> AuthTokenResponse:
     USER_EMAIL_BY_ID[user_id] = email
     plan = USER_PLAN_BY_ID.get(user_id, "free")
 
-    return AuthTokenResponse(
-        user_id=user_id,
-        email=email,
-        plan=plan,
-        beta_access=True,
-        issued_at=datetime.now(tz=timezone.utc).isoformat(),
+    return ModelJSONResponse(
+        AuthTokenResponse(
+            user_id=user_id,
+            email=email,
+            plan=plan,
+            beta_access=True,
+            issued_at=datetime.now(tz=timezone.utc).isoformat(),
+        )
     )
 
 
 @app.post("/usage/ingest")
 def usage_ingest(event: UsageIngestRequest) -> dict[str, int | str]:
-    USAGE_EVENTS.append(event)
-    if len(USAGE_EVENTS) > 50_000:
-        del USAGE_EVENTS[:5_000]
-    return {"status": "accepted", "count": len(USAGE_EVENTS)}
+    with USAGE_LOCK:
+        USAGE_EVENTS.append(event)
+        _count_usage_event(event, delta=1)
+        touched_users = {event.user_id}
+        if len(USAGE_EVENTS) > 50_000:
+            for trimmed in USAGE_EVENTS[:5_000]:
+                _count_usage_event(trimmed, delta=-1)
+                touched_users.add(trimmed.user_id)
+            del USAGE_EVENTS[:5_000]
+        for user_id in touched_users:
+            if user_id == event.user_id or USAGE_SUMMARIES.get(user_id) is not None:
+                _materialize_usage_summary(user_id)
+        count = len(USAGE_EVENTS)
+    return {"status": "accepted", "count": count}
 
 
 @app.post("/telemetry/ingest")
@@ -168,29 +192,44 @@ def telemetry_ingest(event: SessionTelemetryEvent) -> dict[str, int | str]:
 
 
 @app.get("/telemetry")
-def telemetry_recent(limit: int = 100) -> dict[str, list[dict[str, Any]]]:
+def telemetry_recent(limit: int = 100) -> ModelJSONResponse:
     safe_limit = max(1, min(limit, 1000))
-    return {
-        "events": [item.model_dump(mode="json") for item in TELEMETRY_EVENTS[-safe_limit:]],
-    }
+    return ModelJSONResponse({"events": TELEMETRY_EVENTS[-safe_limit:]})
 
 
 @app.get("/usage/current", response_model=UsageResponse)
-def usage_current(user_id: str) -> UsageResponse:
-    plan = USER_PLAN_BY_ID.get(user_id, "free")
-    current_period = datetime.now(tz=timezone.utc).strftime("%Y-%m")
-    used = sum(1 for event in USAGE_EVENTS if event.user_id == user_id and event.created_at.startswith(current_period))
-    limit = PRO_COMMAND_LIMIT if plan == "pro" else FREE_COMMAND_LIMIT
-    remaining = max(0, limit - used)
-    can_execute = remaining > 0
-    return UsageResponse(
-        user_id=user_id,
-        plan=plan,
-        period=current_period,
-        commands_used=used,
-        command_limit=limit,
-        remaining=remaining,
-        can_execute=can_execute,
+def usage_current(
+    user_id: str,
+    if_none_match: str | None = Header(default=None, alias="if-none-match"),
+) -> Response:
+    entry = _current_usage_summary(user_id)
+    if if_none_match and entry.etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": entry.etag})
+    return Response(
+        content=entry.body,
+        media_type="application/json",
+        headers={"ETag": entry.etag},
+    )
+
+
+@app.get("/usage/watch", response_model=UsageResponse)
+async def usage_watch(user_id: str, etag: str | None = None, timeout: float = 25.0) -> Response:
+    """
+    Long-poll: return the summary once its ETag differs from `etag`, else 304 on
+    timeout. Async so that idle watchers wait on the event loop instead of
+    holding threadpool workers that sync routes need.
+    """
+    entry = _current_usage_summary(user_id)
+    if entry.etag == etag:
+        wait_seconds = max(0.0, min(timeout, USAGE_WATCH_MAX_TIMEOUT_SECONDS))
+        changed = await USAGE_SUMMARIES.wait_for_change(user_id, etag, wait_seconds)
+        if changed is None:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": entry.etag})
+        entry = changed
+    return Response(
+        content=entry.body,
+        media_type="application/json",
+        headers={"ETag": entry.etag},
     )
 
 
@@ -212,30 +251,51 @@ async def stripe_webhook(
     event_id = str(event.get("id") or "")
     if event_id in PROCESSED_STRIPE_EVENTS:
         return {"status": "duplicate"}
+    # Claimed up front so in-flight redeliveries are acknowledged; released
+    # again if the event is never applied, so Stripe's next retry gets through.
     PROCESSED_STRIPE_EVENTS.add(event_id)
 
-    event_type = str(event.get("type") or "")
-    data_object = event.get("data", {}).get("object", {})
-    if event_type.startswith("customer.subscription."):
-        _handle_subscription_event(data_object)
+    if _stripe_webhook_mode() == "queue":
+        data_object = event.get("data", {}).get("object", {}) or {}
+        ordering_key = str(data_object.get("customer") or event_id)
+        STRIPE_EVENT_QUEUE.enqueue(event, ordering_key=ordering_key)
+        return {"status": "queued"}
 
+    try:
+        _apply_stripe_event(event)
+    except Exception:
+        _release_stripe_event(event)
+        raise
     return {"status": "accepted"}
 
 
+@app.get("/admin/stripe/dead-letters")
+def stripe_dead_letters(
+    admin_token: str | None = Header(default=None, alias="x-orange-admin-token"),
+) -> dict[str, Any]:
+    _require_admin_token(admin_token)
+    return {
+        "queue": STRIPE_EVENT_QUEUE.stats(),
+        "dead_letters": STRIPE_EVENT_QUEUE.dead_letters(),
+    }
+
+
 @app.post("/beta/waitlist", response_model=WaitlistSignupResponse)
-def beta_waitlist(signup: WaitlistSignupRequest) -> WaitlistSignupResponse:
+def beta_waitlist(signup: WaitlistSignupRequest) -> ModelJSONResponse:
     WAITLIST_SIGNUPS.append(signup)
     beta_access = _has_beta_access(email=signup.email, invite_token=None)
     beta_token = _mint_beta_token(signup.email) if beta_access else None
-    return WaitlistSignupResponse(status="accepted", beta_access=beta_access, beta_token=beta_token)
+    return ModelJSONResponse(
+        WaitlistSignupResponse(status="accepted", beta_access=beta_access, beta_token=beta_token)
+    )
 
 
 @app.post("/beta/invite/claim", response_model=BetaInviteClaimResponse)
-def beta_claim_invite(request: BetaInviteClaimRequest) -> BetaInviteClaimResponse:
+def beta_claim_invite(request: BetaInviteClaimRequest) -> ModelJSONResponse:
     invite = request.invite_token.strip().lower()
     if invite not in ALLOWED_BETA_TOKENS and request.email.lower() not in ALLOWED_BETA_EMAILS:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid invite token")
-    return BetaInviteClaimResponse(status="ok", beta_token=_mint_beta_token(request.email))
+    return ModelJSONResponse(BetaInviteClaimResponse(status="ok", beta_token=_mint_beta_token(request.email)))
 
 
 def _has_beta_access(email: str, invite_token: str | None) -> bool:
@@ -253,6 +313,79 @@ def _mint_beta_token(email: str) -> str:
     return f"beta_{digest[:32]}"
 
 
+def _stripe_webhook_mode() -> str:
+    return os.getenv("ORANGE_STRIPE_WEBHOOK_MODE", "inline").strip().lower()
+
+
+def _require_admin_token(admin_token: str | None) -> None:
+    expected = os.getenv("ORANGE_ADMIN_TOKEN", "").strip()
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Admin token not configured")
+    if not admin_token or not hmac.compare_digest(admin_token.strip(), expected):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+
+def _apply_stripe_event(event: dict[str, Any]) -> None:
+    event_type = str(event.get("type") or "")
+    data_object = event.get("data", {}).get("object", {})
+    if event_type.startswith("customer.subscription."):
+        _handle_subscription_event(data_object)
+
+
+def _release_stripe_event(event: dict[str, Any]) -> None:
+    PROCESSED_STRIPE_EVENTS.discard(str(event.get("id") or ""))
+
+
+STRIPE_EVENT_QUEUE = WebhookEventQueue(
+    _apply_stripe_event,
+    on_dead_letter=_release_stripe_event,
+    workers=int(os.getenv("ORANGE_STRIPE_WEBHOOK_WORKERS", "4")),
+    max_attempts=int(os.getenv("ORANGE_STRIPE_WEBHOOK_MAX_ATTEMPTS", "5")),
+    backoff_seconds=float(os.getenv("ORANGE_STRIPE_WEBHOOK_BACKOFF_SECONDS", "0.5")),
+)
+
+
+def _usage_period(created_at: str) -> str:
+    return created_at[:7]
+
+
+def _count_usage_event(event: UsageIngestRequest, *, delta: int) -> None:
+    """Caller holds USAGE_LOCK."""
+    key = (event.user_id, _usage_period(event.created_at))
+    count = USAGE_COUNTS_BY_PERIOD.get(key, 0) + delta
+    if count > 0:
+        USAGE_COUNTS_BY_PERIOD[key] = count
+    else:
+        USAGE_COUNTS_BY_PERIOD.pop(key, None)
+
+
+def _materialize_usage_summary(user_id: str) -> UsageSummaryEntry:
+    with USAGE_LOCK:
+        plan = USER_PLAN_BY_ID.get(user_id, "free")
+        current_period = datetime.now(tz=timezone.utc).strftime("%Y-%m")
+        used = USAGE_COUNTS_BY_PERIOD.get((user_id, current_period), 0)
+        limit = PRO_COMMAND_LIMIT if plan == "pro" else FREE_COMMAND_LIMIT
+        remaining = max(0, limit - used)
+        summary = UsageResponse(
+            user_id=user_id,
+            plan=plan,
+            period=current_period,
+            commands_used=used,
+            command_limit=limit,
+            remaining=remaining,
+            can_execute=remaining > 0,
+        )
+        return USAGE_SUMMARIES.put(user_id, summary.model_dump(mode="json"))
+
+
+def _current_usage_summary(user_id: str) -> UsageSummaryEntry:
+    entry = USAGE_SUMMARIES.get(user_id)
+    current_period = datetime.now(tz=timezone.utc).strftime("%Y-%m")
+    if entry is None or entry.payload.get("period") != current_period:
+        entry = _materialize_usage_summary(user_id)
+    return entry
+
+
 def _handle_subscription_event(data_object: dict[str, Any]) -> None:
     customer_id = str(data_object.get("customer") or "").strip()
     status_value = str(data_object.get("status") or "").strip().lower()
@@ -264,7 +397,9 @@ def _handle_subscription_event(data_object: dict[str, Any]) -> None:
         user_id = STRIPE_CUSTOMER_TO_USER.get(customer_id, "")
     if not user_id:
         return
-    USER_PLAN_BY_ID[user_id] = "pro" if status_value in {"active", "trialing"} else "free"
+    with USAGE_LOCK:
+        USER_PLAN_BY_ID[user_id] = "pro" if status_value in {"active", "trialing"} else "free"
+        _materialize_usage_summary(user_id)
 
 
 def _verify_stripe_signature(payload: bytes, header: str, secret: str) -> bool:
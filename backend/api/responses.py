@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+# Deliberately duplicated in agent/app/responses.py: the sidecar and the
+# backend are built and deployed separately and share no package, so each
+# keeps its own copy.
+# Keep the two files identical.
+
+
+class ModelJSONResponse(JSONResponse):
+    """
+    JSON response that encodes Pydantic models straight to bytes.
+
+    `content` may be a model, or plain data with models nested inside; either
+    way it is serialized by pydantic-core in one pass instead of going through
+    `model_dump(mode="json")` and the stdlib encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
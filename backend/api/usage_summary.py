@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass
+import hashlib
+import json
+import threading
+from typing import Any
+
+
+@dataclass(frozen=True)
+class UsageSummaryEntry:
+    payload: dict[str, Any]
+    etag: str
+    version: int
+    # `payload` encoded once at materialization; responses send it as-is.
+    body: bytes = b""
+
+
+class UsageSummaryStore:
+    """
+    Materialized per-user usage summaries with change notification.
+
+    Writers call `put` whenever an input to the summary changes; the ETag only
+    moves when the rendered payload actually differs, so unchanged polls can be
+    answered with 304 and long-poll waiters are only woken for real changes.
+    Writers may run on any thread; waiters are coroutines parked on an
+    `asyncio.Event`, so an idle long-poll holds no worker thread.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, UsageSummaryEntry] = {}
+        self._waiters: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> UsageSummaryEntry | None:
+        return self._entries.get(user_id)
+
+    def put(self, user_id: str, payload: dict[str, Any]) -> UsageSummaryEntry:
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        etag = f'"{hashlib.sha256(encoded).hexdigest()[:20]}"'
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is not None and current.etag == etag:
+                return current
+            entry = UsageSummaryEntry(
+                payload=payload,
+                etag=etag,
+                version=(current.version + 1) if current else 1,
+                body=encoded,
+            )
+            self._entries[user_id] = entry
+            waiters = self._waiters.pop(user_id, ())
+        for loop, changed in waiters:
+            # The waiter's loop may already be gone; it has nobody to wake then.
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(changed.set)
+        return entry
+
+    async def wait_for_change(self, user_id: str, etag: str | None, timeout: float) -> UsageSummaryEntry | None:
+        """Wait until the entry's ETag differs from `etag`, or return None on timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max(0.0, timeout)
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry.etag != etag:
+                    return entry
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                self._waiters.setdefault(user_id, set()).add(waiter)
+            try:
+                async with asyncio.timeout(remaining):
+                    await waiter[1].wait()
+            except TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    pending = self._waiters.get(user_id)
+                    if pending is not None:
+                        pending.discard(waiter)
+                        if not pending:
+                            del self._waiters[user_id]
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookEventQueue:
+    """
+    Sharded worker pool for applying webhook events off the request path.
+
+    Events that share an ordering key (e.g. a Stripe customer id) always land on
+    the same shard, so they are applied in arrival order. Failed events are
+    retried with exponential backoff and moved to a dead-letter list once
+    `max_attempts` is exhausted; `on_dead_letter` is then called with the event.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[dict[str, Any]], None],
+        *,
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff_seconds: float = 0.5,
+        dead_letter_limit: int = 1_000,
+        on_dead_letter: Callable[[dict[str, Any]], None] | None = None,
+    ) -> None:
+        self._handler = handler
+        self._on_dead_letter = on_dead_letter
+        self._worker_count = max(1, workers)
+        self._max_attempts = max(1, max_attempts)
+        self._backoff_seconds = max(0.0, backoff_seconds)
+        self._dead_letter_limit = dead_letter_limit
+        self._shards: list[queue.Queue[tuple[str, dict[str, Any]]]] = [
+            queue.Queue() for _ in range(self._worker_count)
+        ]
+        self._dead_letters: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._processed = 0
+        self._retried = 0
+
+    def enqueue(self, event: dict[str, Any], *, ordering_key: str) -> None:
+        self._ensure_started()
+        shard = zlib.crc32(ordering_key.encode("utf-8")) % self._worker_count
+        self._shards[shard].put((ordering_key, event))
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Block until every queued event is applied or dead-lettered."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for shard in self._shards:
+            while shard.unfinished_tasks:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.005)
+        return True
+
+    def dead_letters(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return list(self._dead_letters)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self._worker_count,
+                "pending": sum(shard.unfinished_tasks for shard in self._shards),
+                "processed": self._processed,
+                "retried": self._retried,
+                "dead_lettered": len(self._dead_letters),
+            }
+
+    def _ensure_started(self) -> None:
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for index, shard in enumerate(self._shards):
+                worker = threading.Thread(
+                    target=self._run_worker,
+                    args=(shard,),
+                    name=f"webhook-worker-{index}",
+                    daemon=True,
+                )
+                worker.start()
+            self._started = True
+
+    def _run_worker(self, shard: queue.Queue[tuple[str, dict[str, Any]]]) -> None:
+        while True:
+            ordering_key, event = shard.get()
+            try:
+                self._apply_with_retries(ordering_key, event)
+            except Exception:
+                # A dying worker would strand every later event on its shard.
+                logger.exception("Webhook worker failed on event %s", event.get("id"))
+            finally:
+                shard.task_done()
+
+    def _apply_with_retries(self, ordering_key: str, event: dict[str, Any]) -> None:
+        last_error = ""
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                self._handler(event)
+            except Exception as exc:
+                last_error = f"{exc.__class__.__name__}: {exc}"
+                if attempt < self._max_attempts:
+                    with self._lock:
+                        self._retried += 1
+                    # Retry inline so later events for the same key stay ordered.
+                    time.sleep(self._backoff_seconds * (2 ** (attempt - 1)))
+                continue
+            with self._lock:
+                self._processed += 1
+            return
+
+        with self._lock:
+            self._dead_letters.append(
+                {
+                    "event_id": str(event.get("id") or ""),
+                    "event_type": str(event.get("type") or ""),
+                    "ordering_key": ordering_key,
+                    "attempts": self._max_attempts,
+                    "error": last_error,
+                    "failed_at": datetime.now(tz=timezone.utc).isoformat(),
+                }
+            )
+            if len(self._dead_letters) > self._dead_letter_limit:
+                del self._dead_letters[: len(self._dead_letters) - self._dead_letter_limit]
+        if self._on_dead_letter is not None:
+            try:
+                self._on_dead_letter(event)
+            except Exception:
+                logger.exception("Dead-letter callback failed for event %s", event.get("id"))
@@ -1,17 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+from datetime import datetime, timezone
 import hashlib
 import hmac
 import json
 from pathlib import Path
 import sys
+import threading
 import time
 
 from fastapi.testclient import TestClient
+import httpx
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
+from api import app as backend_app
 from api.app import app
+from api.webhook_queue import WebhookEventQueue
 
 
 client = TestClient(app)
@@ -75,3 +81,233 @@ def test_stripe_webhook_signature_validation(monkeypatch) -> None:
     )
     assert response.status_code == 200
     assert response.json()["status"] == "accepted"
+
+
+def _signed_webhook_headers(payload: str, secret: str) -> dict[str, str]:
+    timestamp = str(int(time.time()))
+    signed_payload = f"{timestamp}.{payload}".encode("utf-8")
+    signature = hmac.new(secret.encode("utf-8"), signed_payload, hashlib.sha256).hexdigest()
+    return {"stripe-signature": f"t={timestamp},v1={signature}", "content-type": "application/json"}
+
+
+def test_stripe_webhook_queue_mode_applies_in_background(monkeypatch) -> None:
+    secret = "whsec_test"
+    monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", secret)
+    monkeypatch.setenv("ORANGE_STRIPE_WEBHOOK_MODE", "queue")
+    monkeypatch.setattr(
+        backend_app,
+        "STRIPE_EVENT_QUEUE",
+        WebhookEventQueue(backend_app._apply_stripe_event, workers=2, backoff_seconds=0),
+    )
+    payload = json.dumps(
+        {
+            "id": "evt_queue_1",
+            "type": "customer.subscription.created",
+            "data": {"object": {"customer": "cus_q1", "status": "trialing", "metadata": {"user_id": "user-q1"}}},
+        }
+    )
+
+    response = client.post("/stripe/webhook", data=payload, headers=_signed_webhook_headers(payload, secret))
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+
+    assert backend_app.STRIPE_EVENT_QUEUE.join(timeout=2.0)
+    assert backend_app.USER_PLAN_BY_ID["user-q1"] == "pro"
+
+
+def test_stripe_webhook_queue_dead_letters_after_retries(monkeypatch) -> None:
+    secret = "whsec_test"
+    monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", secret)
+    monkeypatch.setenv("ORANGE_STRIPE_WEBHOOK_MODE", "queue")
+    monkeypatch.setenv("ORANGE_ADMIN_TOKEN", "admin-secret")
+
+    def failing_handler(event) -> None:  # noqa: ARG001
+        raise RuntimeError("downstream unavailable")
+
+    monkeypatch.setattr(
+        backend_app,
+        "STRIPE_EVENT_QUEUE",
+        WebhookEventQueue(failing_handler, workers=1, max_attempts=2, backoff_seconds=0),
+    )
+    payload = json.dumps(
+        {
+            "id": "evt_queue_dead",
+            "type": "customer.subscription.updated",
+            "data": {"object": {"customer": "cus_dead", "status": "active"}},
+        }
+    )
+
+    response = client.post("/stripe/webhook", data=payload, headers=_signed_webhook_headers(payload, secret))
+    assert response.status_code == 200
+    assert backend_app.STRIPE_EVENT_QUEUE.join(timeout=2.0)
+
+    forbidden = client.get("/admin/stripe/dead-letters", headers={"x-orange-admin-token": "wrong"})
+    assert forbidden.status_code == 403
+
+    admin = client.get("/admin/stripe/dead-letters", headers={"x-orange-admin-token": "admin-secret"})
+    assert admin.status_code == 200
+    body = admin.json()
+    assert body["queue"]["dead_lettered"] == 1
+    assert body["dead_letters"][0]["event_id"] == "evt_queue_dead"
+    assert body["dead_letters"][0]["attempts"] == 2
+    assert "downstream unavailable" in body["dead_letters"][0]["error"]
+
+
+def test_stripe_webhook_retry_after_dead_letter_is_applied(monkeypatch) -> None:
+    secret = "whsec_test"
+    monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", secret)
+    monkeypatch.setenv("ORANGE_STRIPE_WEBHOOK_MODE", "queue")
+    downstream_up = [False]
+
+    def flaky_handler(event) -> None:
+        if not downstream_up[0]:
+            raise RuntimeError("downstream unavailable")
+        backend_app._apply_stripe_event(event)
+
+    monkeypatch.setattr(
+        backend_app,
+        "STRIPE_EVENT_QUEUE",
+        WebhookEventQueue(
+            flaky_handler,
+            workers=1,
+            max_attempts=2,
+            backoff_seconds=0,
+            on_dead_letter=backend_app._release_stripe_event,
+        ),
+    )
+    payload = json.dumps(
+        {
+            "id": "evt_queue_retry",
+            "type": "customer.subscription.updated",
+            "data": {"object": {"customer": "cus_retry", "status": "active", "metadata": {"user_id": "user-retry"}}},
+        }
+    )
+
+    first = client.post("/stripe/webhook", data=payload, headers=_signed_webhook_headers(payload, secret))
+    assert first.json()["status"] == "queued"
+    assert backend_app.STRIPE_EVENT_QUEUE.join(timeout=2.0)
+    assert backend_app.STRIPE_EVENT_QUEUE.stats()["dead_lettered"] == 1
+    assert "user-retry" not in backend_app.USER_PLAN_BY_ID
+
+    # Stripe redelivers the dead-lettered event; it is queued again, not dropped as a duplicate.
+    downstream_up[0] = True
+    retry = client.post("/stripe/webhook", data=payload, headers=_signed_webhook_headers(payload, secret))
+    assert retry.json()["status"] == "queued"
+    assert backend_app.STRIPE_EVENT_QUEUE.join(timeout=2.0)
+    assert backend_app.USER_PLAN_BY_ID["user-retry"] == "pro"
+
+    duplicate = client.post("/stripe/webhook", data=payload, headers=_signed_webhook_headers(payload, secret))
+    assert duplicate.json()["status"] == "duplicate"
+
+
+def test_webhook_worker_survives_failing_dead_letter_callback() -> None:
+    applied: list[str] = []
+
+    def handler(event) -> None:
+        if event["id"] == "evt_poison":
+            raise RuntimeError("downstream unavailable")
+        applied.append(event["id"])
+
+    def failing_callback(event) -> None:  # noqa: ARG001
+        raise RuntimeError("event store unavailable")
+
+    events = WebhookEventQueue(
+        handler, workers=1, max_attempts=1, backoff_seconds=0, on_dead_letter=failing_callback
+    )
+    events.enqueue({"id": "evt_poison", "type": "customer.subscription.updated"}, ordering_key="cus_same")
+    events.enqueue({"id": "evt_next", "type": "customer.subscription.updated"}, ordering_key="cus_same")
+
+    assert events.join(timeout=2.0)
+    assert applied == ["evt_next"]
+    assert events.stats()["dead_lettered"] == 1
+
+
+def test_usage_current_etag_returns_not_modified() -> None:
+    created_at = datetime.now(tz=timezone.utc).isoformat()
+    client.post(
+        "/usage/ingest",
+        json={"user_id": "user-etag", "session_id": "s-etag", "status": "success", "created_at": created_at},
+    )
+    first = client.get("/usage/current", params={"user_id": "user-etag"})
+    assert first.status_code == 200
+    assert first.json()["commands_used"] == 1
+    etag = first.headers["etag"]
+
+    unchanged = client.get("/usage/current", params={"user_id": "user-etag"}, headers={"if-none-match": etag})
+    assert unchanged.status_code == 304
+
+    client.post(
+        "/usage/ingest",
+        json={"user_id": "user-etag", "session_id": "s-etag", "status": "success", "created_at": created_at},
+    )
+    changed = client.get("/usage/current", params={"user_id": "user-etag"}, headers={"if-none-match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["commands_used"] == 2
+    assert changed.headers["etag"] != etag
+
+
+def test_concurrent_usage_and_plan_updates_keep_summary_consistent() -> None:
+    created_at = datetime.now(tz=timezone.utc).isoformat()
+    event = backend_app.UsageIngestRequest(
+        user_id="user-concurrent", session_id="s-concurrent", status="success", created_at=created_at
+    )
+    subscription = {"customer": "cus_concurrent", "status": "active", "metadata": {"user_id": "user-concurrent"}}
+
+    def ingest() -> None:
+        for _ in range(200):
+            backend_app.usage_ingest(event)
+
+    def upgrade() -> None:
+        for _ in range(200):
+            backend_app._handle_subscription_event(subscription)
+
+    threads = [threading.Thread(target=ingest) for _ in range(4)] + [threading.Thread(target=upgrade)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = client.get("/usage/current", params={"user_id": "user-concurrent"}).json()
+    assert summary["commands_used"] == 800
+    assert summary["plan"] == "pro"
+
+
+def test_usage_watch_wakes_on_plan_change() -> None:
+    first = client.get("/usage/current", params={"user_id": "user-watch"})
+    etag = first.headers["etag"]
+
+    timed_out = client.get("/usage/watch", params={"user_id": "user-watch", "etag": etag, "timeout": 0.05})
+    assert timed_out.status_code == 304
+
+    timer = threading.Timer(
+        0.05,
+        backend_app._handle_subscription_event,
+        args=({"customer": "cus_watch", "status": "active", "metadata": {"user_id": "user-watch"}},),
+    )
+    timer.start()
+    pushed = client.get("/usage/watch", params={"user_id": "user-watch", "etag": etag, "timeout": 2})
+    timer.join()
+    assert pushed.status_code == 200
+    assert pushed.json()["plan"] == "pro"
+    assert pushed.headers["etag"] != etag
+
+
+def test_idle_usage_watchers_do_not_starve_sync_routes() -> None:
+    etag = client.get("/usage/current", params={"user_id": "user-many-watchers"}).headers["etag"]
+
+    async def run() -> tuple[float, list[int]]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            params = {"user_id": "user-many-watchers", "etag": etag, "timeout": 1.0}
+            # More watchers than the default 40-thread pool that sync routes share.
+            watchers = [asyncio.create_task(http.get("/usage/watch", params=params)) for _ in range(60)]
+            await asyncio.sleep(0.1)
+            started = time.monotonic()
+            health = await http.get("/usage/current", params={"user_id": "user-other"})
+            elapsed = time.monotonic() - started
+            assert health.status_code == 200
+            return elapsed, [response.status_code for response in await asyncio.gather(*watchers)]
+
+    elapsed, statuses = asyncio.run(run())
+    assert elapsed < 0.5
+    assert statuses == [304] * 60